@@ -4,7 +4,7 @@
 
 """
 import dash
-from dash import dcc, html, Input, Output, State, dash_table, ctx, ALL, MATCH
+from dash import dcc, html, Input, Output, State, dash_table, ctx, ALL, MATCH, ClientsideFunction, Patch, set_props
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
 import plotly.express as px
@@ -13,14 +13,34 @@ from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+import os
 import json
-from io import BytesIO
+from io import StringIO
+import csv
 import base64
-from flask import session
-import secrets
+from flask import session, request, send_file, abort, jsonify, Response
+from urllib.parse import urlencode
 
 from config import *
 from database import *
+from queries import (get_tolerance, fetch_refuel_page, fetch_refuel_key, fetch_refuel_row, refuel_summary, local_datetimes,
+                     analytics_rollup, site_now, audit_filters, fetch_audit_page, iter_audit_rows,
+                     REFUEL_INSERT)
+from rollup import refresh_rollup, rebuild_rollup
+from cache import ResultCache
+from metrics import add_status, efficiency, stamp_refuel_metrics, restamp_anomalies
+from exports import export_analytics_file
+from importer import run_import_job
+from backup import stream_backup, backup_filename
+from snapshots import latest_snapshot, list_snapshots
+from maintenance import start_scheduler
+from restore import run_restore_job
+from audit import record_audit
+from audit_archive import AUDIT_COLUMNS
+from events import stream_events, streams_available, notify_change
+from indexes import verify_query_plans
+from sessions import load_secret_key, ServerSessionInterface, session_store, revoke_user_sessions
+from jobs import submit_job, get_job, get_job_errors, can_view_job, fail_stale_jobs, FINISHED_STATUSES
 
 # ==================== APPLICATION INITIALIZATION ====================
 app = dash.Dash(
@@ -33,14 +53,31 @@ app = dash.Dash(
 
 server = app.server
 
-# Session configuration
+# Session configuration: one signing key for every worker, data server-side
 server.config.update(
-    SECRET_KEY=secrets.token_hex(32),
+    SECRET_KEY=load_secret_key(),
     SESSION_COOKIE_SECURE=False,
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE='Lax',
-    PERMANENT_SESSION_LIFETIME=timedelta(days=7)
+    PERMANENT_SESSION_LIFETIME=timedelta(days=SESSION_LIFETIME_DAYS)
 )
+server.session_interface = ServerSessionInterface(session_store)
+
+# Hand pooled SQLite connections back after every request
+server.after_request(discard_uncommitted)
+server.teardown_appcontext(release_db)
+
+# Apply pending schema migrations once per process, never per request
+init_db()
+
+# Jobs whose process died (restart, crash) would otherwise show as running forever
+fail_stale_jobs()
+
+# Warn if a hot query no longer uses the index declared for it
+_conn = get_db()
+for _label, _plan in verify_query_plans(_conn):
+    print(f"⚠️ Query plan check: {_label} does not use its index ({_plan})")
+_conn.close()
 
 # ==================== UTILITY FUNCTIONS ====================
 def load_logo():
@@ -398,17 +435,7 @@ def create_refueling_tab(user_data):
     can_delete = check_permission(user_data, 'refuels', 'delete')
     
     # Get machines and operators for dropdowns
-    conn = get_db()
-    machines_df = pd.read_sql_query(
-        'SELECT id, model FROM machines WHERE status="active" ORDER BY id', conn)
-    operators_df = pd.read_sql_query(
-        'SELECT id, name, badge FROM operators WHERE status="active" ORDER BY name', conn)
-    conn.close()
-    
-    machine_options = [{'label': f"{row['id']} - {row['model']}", 'value': row['id']} 
-                       for _, row in machines_df.iterrows()]
-    operator_options = [{'label': f"{row['name']} ({row['badge']})", 'value': row['id']} 
-                        for _, row in operators_df.iterrows()]
+    machine_options, operator_options = refuel_form_options()
     
     if not machine_options or not operator_options:
         return dbc.Alert(
@@ -508,7 +535,9 @@ def create_refueling_tab(user_data):
                             dbc.Button("This Week", id='btn-refuel-week', n_clicks=0,
                                       color='secondary', size='sm'),
                             dbc.Button("All History", id='btn-refuel-all', n_clicks=0,
-                                      color='secondary', size='sm')
+                                      color='secondary', size='sm'),
+                            dbc.Button("⚠️ Anomalies", id='btn-refuel-anomalies', n_clicks=0,
+                                      color='danger', outline=True, size='sm')
                         ], style={'float': 'right'})
                     ], md=6)
                 ])
@@ -517,6 +546,7 @@ def create_refueling_tab(user_data):
         
         # Refueling table
         html.Div(id='refueling-table-container'),
+        dcc.Store(id='refuel-table-state'),
         
         # Notifications
         html.Div(id='refuel-notification')
@@ -665,7 +695,7 @@ def create_analytics_tab(user_data):
                                 
                                 dcc.DatePickerSingle(
                                     id='date-from',
-                                    date=(datetime.now() - timedelta(days=30)).date(),
+                                    date=(site_now() - timedelta(days=30)).date(),
                                     display_format='YYYY-MM-DD'
                                  ), 
                                      
@@ -676,7 +706,7 @@ def create_analytics_tab(user_data):
                                 
                                 dcc.DatePickerSingle(
                                     id='date-to',
-                                    date=datetime.now().date(),
+                                    date=site_now().date(),
                                     display_format='YYYY-MM-DD'
                                 ),
                             ], width="auto"),
@@ -793,10 +823,27 @@ def create_settings_tab(user_data):
                 dbc.Row([
                     dbc.Col([
                         html.H5("Export Data", style={'color': COLORS['text_bright']}),
-                        dbc.Button("📤 Export Analytics", id='btn-export-analytics', n_clicks=0, size='sm',
-                                  color='success', className='me-2 mb-2'),
-                        dbc.Button("📦 Create Backup (JSON)", id='btn-backup', n_clicks=0,
-                                  color='info', className='mb-2')
+                        html.Div([
+                            dcc.DatePickerSingle(
+                                id='export-date-from',
+                                date=(site_now() - timedelta(days=30)).date(),
+                                display_format='YYYY-MM-DD'
+                            ),
+                            html.Span(" to ", style={'color': COLORS['text_dim'], 'margin': '0 8px'}),
+                            dcc.DatePickerSingle(
+                                id='export-date-to',
+                                date=site_now().date(),
+                                display_format='YYYY-MM-DD'
+                            )
+                        ], className='mb-2'),
+                        dbc.Button("📤 Export Analytics", id='btn-export-analytics', size='sm',
+                                  href=analytics_export_href(site_now() - timedelta(days=30), site_now()),
+                                  external_link=True, color='success', className='me-2 mb-2'),
+                        dbc.Button("📦 Create Backup (NDJSON.gz)", id='btn-backup', href='/backup.ndjson.gz',
+                                  external_link=True, color='info', className='me-2 mb-2'),
+                        dbc.Button("🗄️ Download Latest Snapshot", id='btn-snapshot', href='/snapshots/latest.db',
+                                  external_link=True, color='secondary', className='mb-2')
+                        if check_permission(user_data, 'settings', 'admin') else None
                     ], md=6),
                     dbc.Col([
                         html.H5("Import Data", style={'color': COLORS['text_bright']}),
@@ -804,7 +851,19 @@ def create_settings_tab(user_data):
                             id='upload-excel',
                             children=dbc.Button("📥 Import Excel", color='secondary'),
                             multiple=False
-                        )
+                        ),
+                        html.Div([
+                            html.H5("Restore Backup", style={'color': COLORS['text_bright'], 'marginTop': '15px'}),
+                            dcc.Upload(
+                                id='upload-backup',
+                                children=dbc.Button("♻️ Restore Backup (JSON / NDJSON.gz)", color='danger',
+                                                    outline=True),
+                                multiple=False
+                            ),
+                            dbc.Checkbox(id='restore-dry-run', value=True, label="Dry run (verify only)",
+                                         className='mt-2', style={'color': COLORS['text_bright']})
+                        ]) if check_permission(user_data, 'settings', 'admin') else None,
+                        html.Div(id='job-status', className='mt-3')
                     ], md=6)
                 ])
             ])
@@ -813,10 +872,6 @@ def create_settings_tab(user_data):
         # System info
         html.Div(id='system-info'),
         
-        # Download components
-        dcc.Download(id='download-analytics'),
-        dcc.Download(id='download-backup'),
-        
         # Notifications
         html.Div(id='settings-notification')
     ])
@@ -879,20 +934,81 @@ def create_users_tab(user_data):
         # Users table
         html.Div(id='users-table-container'),
         
-        # Audit log
-        dbc.Card([
-            dbc.CardHeader(
-                html.H4("📋 Audit Log (Recent Activity)", style={'color': COLORS['cat_yellow'], 'margin': '0'})
-            ),
-            dbc.CardBody([
-                html.Div(id='audit-log-container')
-            ])
-        ], style=CARD_STYLE),
+        # Audit log explorer
+        create_audit_explorer(),
         
         # Notifications
         html.Div(id='user-notification')
     ])
 
+AUDIT_ACTIONS = ['login', 'logout', 'create', 'update', 'delete', 'import_excel', 'create_backup',
+                 'download_snapshot', 'restore_backup', 'export_audit', 'system_initialized']
+AUDIT_ENTITY_TYPES = ['refuels', 'machines', 'operators', 'users', 'settings', 'system']
+
+def create_audit_explorer():
+    """Audit log card with server-side filters, keyset pager and CSV export"""
+    conn = get_db()
+    users = conn.execute('SELECT id, username FROM users ORDER BY username').fetchall()
+    conn.close()
+
+    label_style = {'fontWeight': 'bold', 'color': COLORS['text_bright']}
+    return dbc.Card([
+        dbc.CardHeader(
+            html.H4("📋 Audit Log", style={'color': COLORS['cat_yellow'], 'margin': '0'})
+        ),
+        dbc.CardBody([
+            dbc.Row([
+                dbc.Col([
+                    dbc.Label("User", style=label_style),
+                    dcc.Dropdown(id='audit-filter-user',
+                                 options=[{'label': u['username'], 'value': u['id']} for u in users],
+                                 placeholder="Any user", style={'color': '#000'})
+                ], md=2),
+                dbc.Col([
+                    dbc.Label("Action", style=label_style),
+                    dcc.Dropdown(id='audit-filter-action', options=AUDIT_ACTIONS,
+                                 placeholder="Any action", style={'color': '#000'})
+                ], md=2),
+                dbc.Col([
+                    dbc.Label("Entity", style=label_style),
+                    dcc.Dropdown(id='audit-filter-entity-type', options=AUDIT_ENTITY_TYPES,
+                                 placeholder="Any entity", style={'color': '#000'})
+                ], md=2),
+                dbc.Col([
+                    dbc.Label("Entity ID", style=label_style),
+                    dbc.Input(id='audit-filter-entity-id', placeholder="e.g. CAT-320", debounce=True,
+                              style=INPUT_STYLE)
+                ], md=2),
+                dbc.Col([
+                    dbc.Label("Date range", style=label_style),
+                    dcc.DatePickerRange(id='audit-filter-dates', display_format='YYYY-MM-DD',
+                                        clearable=True)
+                ], md=4)
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    dbc.Checklist(id='audit-include-archive',
+                                  options=[{'label': f" Include archived entries (older than "
+                                                     f"{AUDIT_RETENTION_DAYS} days, slower)", 'value': 'archive'}],
+                                  value=[], switch=True, style={'color': COLORS['text_dim']})
+                ], md=8),
+                dbc.Col([
+                    dbc.Button("📤 Export CSV", id='btn-audit-export', href=audit_export_href({}),
+                              external_link=True, size='sm', color='success')
+                ], md=4, style={'textAlign': 'right'})
+            ], style={'marginTop': '15px', 'marginBottom': '10px'}),
+            html.Div(id='audit-log-container'),
+            html.Div([
+                dbc.Button("◀ Newer", id='btn-audit-newer', n_clicks=0, size='sm', color='secondary',
+                          disabled=True, className='me-2'),
+                dbc.Button("Older ▶", id='btn-audit-older', n_clicks=0, size='sm', color='secondary',
+                          disabled=True, className='me-3'),
+                html.Span(id='audit-page-info', style={'color': COLORS['text_dim'], 'fontSize': '0.85rem'})
+            ], style={'marginTop': '10px'}),
+            dcc.Store(id='audit-page-store')
+        ])
+    ], style=CARD_STYLE)
+
 # ==================== DELETE CONFIRMATION MODAL ====================
 delete_modal = dbc.Modal([
     dbc.ModalHeader("⚠️ Confirm Deletion", style={
@@ -1074,7 +1190,11 @@ def create_main_app(user_data):
         dcc.Store(id='delete-confirmation-store'),
         dcc.Store(id='edit-refuel-store'),
         dcc.Store(id='edit-user-store'),
-        dcc.Interval(id='refresh-interval', interval=30000, n_intervals=0)
+        dcc.Store(id='job-store'),
+        *version_stores(),
+        dcc.Store(id='live-versions'),
+        dcc.Interval(id='refresh-interval', interval=30000, n_intervals=0),
+        dcc.Interval(id='job-poll', interval=JOB_POLL_INTERVAL_MS, n_intervals=0, disabled=True)
     ], style={'background': COLORS['bg_dark']})
 
 # ==================== ROOT LAYOUT ====================
@@ -1092,7 +1212,6 @@ app.layout = html.Div([
 )
 def display_page(pathname):
     """Route pages based on authentication"""
-    init_db()
     user_data = get_user_data()
     
     if user_data:
@@ -1130,9 +1249,11 @@ def login(n_clicks, username, password):
         
         cursor.execute('UPDATE users SET last_login = ? WHERE id = ?', 
                       (datetime.now(), user['id']))
-        log_audit(cursor, user['id'], user['username'], 'login')
+        bump_data_version(cursor, 'users')
         conn.commit()
         conn.close()
+        invalidate_user_cache(user['id'])
+        record_audit(user['id'], user['username'], 'login')
         
         return '/', ""
     
@@ -1151,23 +1272,66 @@ def logout(n_clicks):
     if n_clicks:
         user_data = get_user_data()
         if user_data:
-            conn = get_db()
-            cursor = conn.cursor()
-            log_audit(cursor, user_data['id'], user_data['username'], 'logout')
-            conn.commit()
-            conn.close()
+            record_audit(user_data['id'], user_data['username'], 'logout')
         
         session.clear()
         return '/'
     raise PreventUpdate
 
+# ==================== CHANGE-AWARE REFRESH ====================
+# Browsers normally get version changes pushed over /events; the interval is
+# the fallback while that stream is down. Either way each data component
+# listens to the version stores of the scopes it shows and re-renders only
+# when one of them moved. Nothing is sent back when nothing changed.
+def version_stores():
+    """One store per data scope, seeded with the current versions"""
+    versions = get_data_versions()
+    return [dcc.Store(id=f'version-{scope}', data=versions.get(scope, 0)) for scope in DATA_SCOPES]
+
+@app.callback(
+    [Output(f'version-{scope}', 'data') for scope in DATA_SCOPES],
+    Input('refresh-interval', 'n_intervals'),
+    [State(f'version-{scope}', 'data') for scope in DATA_SCOPES],
+    prevent_initial_call=True
+)
+def check_data_versions(n_intervals, *known_versions):
+    """Publish the data scopes that changed since the last check"""
+    if not get_user_data():
+        raise PreventUpdate
+    
+    versions = get_data_versions()
+    updates = [versions.get(scope, 0) if versions.get(scope, 0) != known else dash.no_update
+               for scope, known in zip(DATA_SCOPES, known_versions)]
+    if all(update is dash.no_update for update in updates):
+        raise PreventUpdate
+    return updates
+
+# Server push: assets/events.js feeds /events snapshots into live-versions
+app.clientside_callback(
+    ClientsideFunction(namespace='events', function_name='apply_versions'),
+    [Output(f'version-{scope}', 'data', allow_duplicate=True) for scope in DATA_SCOPES],
+    Input('live-versions', 'data'),
+    [State(f'version-{scope}', 'data') for scope in DATA_SCOPES],
+    prevent_initial_call=True
+)
+
+@server.route('/events')
+def events():
+    """Server-sent data version events for the logged-in browser"""
+    if not get_user_data():
+        abort(401)
+    if not streams_available():
+        # Every stream holds a thread; the browser falls back to interval polling
+        return Response(status=503, headers={'Retry-After': '60'})
+    return Response(stream_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Tab content rendering
 @app.callback(
     Output('tab-content', 'children'),
-    [Input('main-tabs', 'active_tab'),
-     Input('refresh-interval', 'n_intervals')]
+    Input('main-tabs', 'active_tab')
 )
-def render_tab_content(active_tab, n):
+def render_tab_content(active_tab):
     """Render content based on active tab"""
     user_data = get_user_data()
     if not user_data:
@@ -1190,9 +1354,37 @@ def render_tab_content(active_tab, n):
 
 # ==================== REFUELING CALLBACKS ====================
 
+def refuel_form_options():
+    """Dropdown options for the refuel form: (machines, operators)"""
+    conn = get_db()
+    machines_df = pd.read_sql_query(
+        'SELECT id, model FROM machines WHERE status="active" ORDER BY id', conn)
+    operators_df = pd.read_sql_query(
+        'SELECT id, name, badge FROM operators WHERE status="active" ORDER BY name', conn)
+    conn.close()
+    
+    machine_options = [{'label': f"{row['id']} - {row['model']}", 'value': row['id']} 
+                       for _, row in machines_df.iterrows()]
+    operator_options = [{'label': f"{row['name']} ({row['badge']})", 'value': row['id']} 
+                        for _, row in operators_df.iterrows()]
+    return machine_options, operator_options
+
+# Refresh form dropdowns when machines or operators change (keeps typed values)
+@app.callback(
+    [Output('refuel-machine', 'options'),
+     Output('refuel-operator', 'options')],
+    [Input('version-machines', 'data'),
+     Input('version-operators', 'data')],
+    prevent_initial_call=True
+)
+def refresh_refuel_form_options(machines_version, operators_version):
+    """Reload refuel form dropdown options"""
+    return refuel_form_options()
+
 # Add refuel entry
 @app.callback(
     [Output('refueling-table-container', 'children', allow_duplicate=True),
+     Output('refuel-table-state', 'data', allow_duplicate=True),
      Output('refuel-notification', 'children'),
      Output('refuel-machine', 'value'),
      Output('refuel-operator', 'value'),
@@ -1204,23 +1396,24 @@ def render_tab_content(active_tab, n):
      State('refuel-operator', 'value'),
      State('refuel-usage', 'value'),
      State('refuel-fuel', 'value'),
-     State('refuel-notes', 'value')],
+     State('refuel-notes', 'value'),
+     State('refuel-table-state', 'data')],
     prevent_initial_call=True
 )
-def add_refuel(n_clicks, machine_id, operator_id, usage, fuel, notes):
+def add_refuel(n_clicks, machine_id, operator_id, usage, fuel, notes, table_state):
     """Add new refuel entry"""
     if not n_clicks:
         raise PreventUpdate
     
     user_data = get_user_data()
     if not user_data or not check_permission(user_data, 'refuels', 'write'):
-        return dash.no_update, create_notification("❌ Permission denied", "danger"), *[dash.no_update]*5
+        return dash.no_update, dash.no_update, create_notification("❌ Permission denied", "danger"), *[dash.no_update]*5
     
     if not all([machine_id, operator_id, usage, fuel]):
-        return dash.no_update, create_notification("❌ Please fill all required fields", "warning"), *[dash.no_update]*5
+        return dash.no_update, dash.no_update, create_notification("❌ Please fill all required fields", "warning"), *[dash.no_update]*5
     
     if float(usage) <= 0 or float(fuel) <= 0:
-        return dash.no_update, create_notification("❌ Usage and fuel must be greater than 0", "warning"), *[dash.no_update]*5
+        return dash.no_update, dash.no_update, create_notification("❌ Usage and fuel must be greater than 0", "warning"), *[dash.no_update]*5
     
     try:
         conn = get_db()
@@ -1229,114 +1422,124 @@ def add_refuel(n_clicks, machine_id, operator_id, usage, fuel, notes):
         refuel_id = generate_uuid()
         timestamp = int(datetime.now().timestamp() * 1000)
         
-        cursor.execute('''
-            INSERT INTO refuels (id, timestamp, machine_id, operator_id, usage, fuel, notes, created_by)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (refuel_id, timestamp, machine_id, operator_id, float(usage), float(fuel), 
-              notes or '', user_data['id']))
+        cursor.execute(REFUEL_INSERT, (refuel_id, timestamp, machine_id, operator_id, float(usage), float(fuel),
+                                       notes or '', user_data['id']))
+        stamp_refuel_metrics(cursor, [refuel_id])
         
-        log_audit(cursor, user_data['id'], user_data['username'], 'create', 'refuels', refuel_id,
-                 f"Added refuel: {machine_id}, {usage}hrs, {fuel}L")
+        refresh_rollup(cursor, [timestamp])
         
+        bump_data_version(cursor, 'refuels')
+        version = get_data_versions(conn)['refuels']
         conn.commit()
+        notify_change()
         conn.close()
+        record_audit(user_data['id'], user_data['username'], 'create', 'refuels', refuel_id,
+                     f"Added refuel: {machine_id}, {usage}hrs, {fuel}L")
         
-        return (render_refueling_table('all'), 
+        # Newest-first first page on screen: send just the new row
+        if refuel_view_is_current(table_state, version) and table_state.get('live'):
+            table, table_state = dash.no_update, patch_refueling_table(table_state, version, refuel_id)
+        else:
+            table, table_state = reload_refueling_view(table_state)
+        
+        return (table, table_state,
                 create_notification("✅ Refuel entry logged successfully!"), 
                 None, None, None, None, '')
     except Exception as e:
-        return dash.no_update, create_notification(f"❌ Error: {str(e)}", "danger"), *[dash.no_update]*5
+        return dash.no_update, dash.no_update, create_notification(f"❌ Error: {str(e)}", "danger"), *[dash.no_update]*5
 
 # Render refueling table
 @app.callback(
-    Output('refueling-table-container', 'children'),
+    [Output('refueling-table-container', 'children'),
+     Output('refuel-table-state', 'data')],
     [Input('btn-refuel-today', 'n_clicks'),
      Input('btn-refuel-week', 'n_clicks'),
-     Input('btn-refuel-all', 'n_clicks')],
+     Input('btn-refuel-all', 'n_clicks'),
+     Input('btn-refuel-anomalies', 'n_clicks'),
+     Input('version-refuels', 'data'),
+     Input('version-machines', 'data'),
+     Input('version-operators', 'data'),
+     Input('version-settings', 'data')],
+    State('refuel-table-state', 'data'),
     prevent_initial_call=False
 )
-def update_refueling_table(btn_today, btn_week, btn_all):
+def update_refueling_table(btn_today, btn_week, btn_all, btn_anomalies, refuels_version, machines_version,
+                           operators_version, settings_version, table_state):
     """Update refueling table based on filter"""
     triggered_id = ctx.triggered_id if ctx.triggered_id else 'btn-refuel-today'
     
+    # This browser's own write already patched the table in place
+    if (ctx.triggered_prop_ids.keys() == {'version-refuels.data'} and table_state
+            and table_state.get('version', -1) >= (refuels_version or 0)):
+        raise PreventUpdate
+    
+    if isinstance(triggered_id, str) and triggered_id.startswith('version-'):
+        # Data changed elsewhere: re-read the page on screen, keeping page, sort and selection
+        return reload_refueling_view(table_state or {'filter': 'today'})
+    
     if triggered_id == 'btn-refuel-today':
         filter_type = 'today'
     elif triggered_id == 'btn-refuel-week':
         filter_type = 'week'
+    elif triggered_id == 'btn-refuel-anomalies':
+        filter_type = 'anomalies'
     else:
         filter_type = 'all'
     
     return render_refueling_table(filter_type)
 
+def prepare_refuel_rows(df):
+    """Add display columns (time, status) to a page of refuels"""
+    if df.empty:
+        return []
+    
+    df['datetime_str'] = local_datetimes(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M')
+    add_status(df)
+    return df.to_dict('records')
+
+def refuel_page_count(total):
+    """Number of server-side pages for a row count"""
+    return max(1, -(-total // REFUEL_PAGE_SIZE))
+
+def new_refuel_table_state(filter_type, version, rows, cursors=None):
+    """Table state of a freshly rendered first page"""
+    return {'filter': filter_type, 'version': version, 'rows': rows, 'live': True,
+            'page': 0, 'sort_by': [], 'filter_query': '', 'cursors': cursors or {},
+            'selected': [], 'selected_id': None}
+
 def render_refueling_table(filter_type='today'):
-    """Render refueling data table"""
+    """Render refueling data table (first page; later pages load on demand).
+
+    Returns (children, table state); the state records what the browser now
+    shows so writes can patch single rows instead of re-rendering.
+    """
     user_data = get_user_data()
     if not user_data:
-        return html.Div()
+        return html.Div(), None
     
     can_delete = check_permission(user_data, 'refuels', 'delete')
     
     conn = get_db()
-    query = '''
-        SELECT r.id, r.timestamp, r.machine_id, m.model as machine_model, m.rate,
-               o.name as operator_name, r.usage, r.fuel, r.notes
-        FROM refuels r
-        JOIN machines m ON r.machine_id = m.id
-        JOIN operators o ON r.operator_id = o.id
-        ORDER BY r.timestamp DESC
-    '''
+    version = get_data_versions(conn).get('refuels', 0)
+    stats = refuel_summary(filter_type, conn)
     
-    df = pd.read_sql_query(query, conn)
-    
-    # Get settings for threshold
-    cursor = conn.cursor()
-    cursor.execute('SELECT tolerance FROM settings WHERE id = ?', ('current',))
-    settings = cursor.fetchone()
-    tolerance = settings['tolerance'] if settings else 10
-    conn.close()
-    
-    if df.empty:
-        return dbc.Card([
-            dbc.CardBody([
-                html.P("No refuel entries found. Add your first entry above!", 
-                      style={'color': COLORS['text_dim'], 'textAlign': 'center', 'padding': '40px'})
-            ])
-        ], style=CARD_STYLE)
-    
-    # Calculate expected fuel and variance
-    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df['expected_fuel'] = df['usage'] * df['rate']
-    df['variance'] = df['fuel'] - df['expected_fuel']
-    df['variance_pct'] = (df['variance'] / df['expected_fuel'] * 100).round(2)
-    
-    # Apply filter
-    if filter_type == 'today':
-        today = datetime.now().date()
-        df = df[df['datetime'].dt.date == today]
-    elif filter_type == 'week':
-        week_ago = datetime.now() - timedelta(days=7)
-        df = df[df['datetime'] >= week_ago]
-    
-    if df.empty:
+    if stats['entries'] == 0:
+        conn.close()
+        message = ("No refuel entries found. Add your first entry above!" if filter_type == 'all'
+                   else f"No entries found for '{filter_type}' filter.")
         return dbc.Card([
             dbc.CardBody([
-                html.P(f"No entries found for '{filter_type}' filter.", 
+                html.P(message, 
                       style={'color': COLORS['text_dim'], 'textAlign': 'center', 'padding': '40px'})
             ])
-        ], style=CARD_STYLE)
+        ], style=CARD_STYLE), new_refuel_table_state(filter_type, version, 0)
     
-    # Prepare display data
-    display_df = df.copy()
-    display_df['datetime_str'] = display_df['datetime'].dt.strftime('%Y-%m-%d %H:%M')
-    
-    # Create status column
-    def get_status(row):
-        # Only flag positive variance (over-usage) as anomaly
-        if row['variance_pct'] > tolerance:
-            return f"⚠️ ANOMALY ({row['variance_pct']:+.1f}%)"
-        return f"✅ NORMAL ({row['variance_pct']:+.1f}%)"
+    df, total = fetch_refuel_page(filter_type, conn=conn)
+    conn.close()
     
-    display_df['status'] = display_df.apply(get_status, axis=1)
+    # Remember where page 0 ends so the next page can seek instead of OFFSET
+    cursors = {'0': [int(df['timestamp'].iloc[-1]), df['id'].iloc[-1]]} if not df.empty else {}
+    rows = prepare_refuel_rows(df)
     
     # Create table columns with ID column for actions
     columns = [
@@ -1360,7 +1563,7 @@ def render_refueling_table(filter_type='today'):
         },
         {
             'if': {
-                'filter_query': '{variance_pct} > ' + str(tolerance),
+                'filter_query': '{anomaly} = 1',
                 'column_id': 'status'
             },
             'backgroundColor': 'rgba(255, 77, 77, 0.2)',
@@ -1369,21 +1572,29 @@ def render_refueling_table(filter_type='today'):
         }
     ]
     
-    # Hide ID column but keep it in data
+    # Hide ID column but keep it in data; paging, sorting and filtering run in SQL
     table = dash_table.DataTable(
-        data=display_df.to_dict('records'),
+        data=rows,
         columns=columns,
         style_table=TABLE_STYLE['style_table'],
         style_header=TABLE_STYLE['style_header'],
         style_cell=TABLE_STYLE['style_cell'],
+        style_filter={'backgroundColor': '#222', 'color': COLORS['text_bright']},
         style_data_conditional=refuel_style_conditional + [
             {
                 'if': {'column_id': 'id'},
                 'display': 'none'
             }
         ],
-        page_size=20,
-        sort_action='native',
+        page_action='custom',
+        page_current=0,
+        page_size=REFUEL_PAGE_SIZE,
+        page_count=refuel_page_count(total),
+        sort_action='custom',
+        sort_mode='single',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         row_selectable='single' if can_delete else False,
         selected_rows=[],
         id='refueling-data-table'
@@ -1416,6 +1627,7 @@ def render_refueling_table(filter_type='today'):
         action_section = html.Div()
     
     # Summary stats with improved styling
+    text = refuel_summary_text(stats)
     summary = html.Div([
         html.Hr(style={'borderColor': '#333', 'margin': '20px 0'}),
         html.H5("📊 Summary Statistics", style={'color': COLORS['cat_yellow'], 'marginBottom': '15px'}),
@@ -1423,31 +1635,31 @@ def render_refueling_table(filter_type='today'):
             dbc.Col([
                 html.Div([
                     html.Strong("Total Entries", style={'color': COLORS['text_dim'], 'fontSize': '0.85rem', 'display': 'block'}),
-                    html.Span(str(len(df)), style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
+                    html.Span(text['refuel-stat-entries'], id='refuel-stat-entries', style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
                 ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['cat_yellow']}"})
             ], md=2),
             dbc.Col([
                 html.Div([
                     html.Strong("Total Fuel Used", style={'color': COLORS['text_dim'], 'fontSize': '0.85rem', 'display': 'block'}),
-                    html.Span(f"{df['fuel'].sum():.1f} L", style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
+                    html.Span(text['refuel-stat-fuel'], id='refuel-stat-fuel', style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
                 ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['cat_yellow']}"})
             ], md=2),
             dbc.Col([
                 html.Div([
                     html.Strong("Total Machine Hours", style={'color': COLORS['text_dim'], 'fontSize': '0.85rem', 'display': 'block'}),
-                    html.Span(f"{df['usage'].sum():.1f} hrs", style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
+                    html.Span(text['refuel-stat-usage'], id='refuel-stat-usage', style={'color': COLORS['cat_yellow'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
                 ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['cat_yellow']}"})
             ], md=3),
             dbc.Col([
                 html.Div([
                     html.Strong("Expected Fuel", style={'color': COLORS['text_dim'], 'fontSize': '0.85rem', 'display': 'block'}),
-                    html.Span(f"{df['expected_fuel'].sum():.1f} L", style={'color': COLORS['info'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
+                    html.Span(text['refuel-stat-expected'], id='refuel-stat-expected', style={'color': COLORS['info'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
                 ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['info']}"})
             ], md=3),
             dbc.Col([
                 html.Div([
                     html.Strong("Anomalies Detected", style={'color': COLORS['text_dim'], 'fontSize': '0.85rem', 'display': 'block'}),
-                    html.Span(str((df['variance_pct'] > tolerance).sum()), 
+                    html.Span(text['refuel-stat-anomalies'], id='refuel-stat-anomalies', 
                              style={'color': COLORS['danger'], 'fontSize': '1.8rem', 'fontWeight': 'bold'})
                 ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['danger']}"})
             ], md=2)
@@ -1455,8 +1667,175 @@ def render_refueling_table(filter_type='today'):
     ], style={'marginTop': '20px'})
     
     return dbc.Card([
-        dbc.CardBody([table, action_section, summary])
-    ], style=CARD_STYLE)
+        dbc.CardBody([
+            table, action_section, summary
+        ])
+    ], style=CARD_STYLE), new_refuel_table_state(filter_type, version, len(rows), cursors)
+
+def refuel_summary_text(stats):
+    """Display text of each summary statistic, keyed by its element id"""
+    return {
+        'refuel-stat-entries': str(stats['entries']),
+        'refuel-stat-fuel': f"{stats['fuel']:.1f} L",
+        'refuel-stat-usage': f"{stats['usage']:.1f} hrs",
+        'refuel-stat-expected': f"{stats['expected_fuel']:.1f} L",
+        'refuel-stat-anomalies': str(stats['anomalies']),
+    }
+
+def refuel_view_is_current(table_state, version):
+    """True when the browser's table shows rows and is exactly one write behind `version`"""
+    return bool(table_state) and table_state.get('rows', 0) > 0 and table_state.get('version') == version - 1
+
+def patch_refueling_table(table_state, version, refuel_id, index=None):
+    """Update one row of the refueling table in the browser instead of re-rendering it.
+
+    Without an index the refuel is prepended (newest-first first page only)
+    and the row pushed off the page moves the page-0 cursor and the
+    selection down by one; with one, the row at that position is replaced
+    and everything else stays. A row that leaves the view (a normal refuel
+    in the anomalies view) is not patched. The summary cards are refreshed
+    from the aggregate query. Returns a Patch for refuel-table-state, or
+    None when the caller has to reload the view.
+    """
+    conn = get_db()
+    stats = refuel_summary(table_state['filter'], conn)
+    row = prepare_refuel_rows(fetch_refuel_row(refuel_id, conn))
+    in_view = bool(row) and (table_state['filter'] != 'anomalies' or bool(row[0]['anomaly']))
+    if index is not None and not in_view:
+        conn.close()
+        return None
+    
+    state = Patch()
+    state['version'] = version
+    data = Patch()
+    table_props = {'data': data}
+    if index is None and in_view:
+        data.prepend(row[0])
+        rows = table_state['rows'] + 1
+        if rows > REFUEL_PAGE_SIZE:
+            del data[REFUEL_PAGE_SIZE]
+            rows = REFUEL_PAGE_SIZE
+            # Page 1 now starts at the row pushed off; later cursors moved too
+            state['cursors'] = {'0': fetch_refuel_key(table_state['filter'], REFUEL_PAGE_SIZE - 1, conn)}
+        selected = [i + 1 for i in table_state.get('selected') or [] if i + 1 < REFUEL_PAGE_SIZE]
+        table_props['selected_rows'] = selected
+        state['selected'] = selected
+        state['rows'] = rows
+        table_props['page_count'] = refuel_page_count(stats['entries'])
+    elif index is not None:
+        data[index] = row[0]
+    conn.close()
+    
+    set_props('refueling-data-table', table_props)
+    for element_id, value in refuel_summary_text(stats).items():
+        set_props(element_id, {'children': value})
+    return state
+
+def refresh_refueling_page(table_state):
+    """Re-run the page query for the page on screen, keeping page, sort, filter and selection.
+
+    Rows may have come or gone anywhere, so the page is read again rather
+    than patched; cursors of earlier pages stay valid, later ones are
+    dropped. Returns a Patch for refuel-table-state, or None when the view
+    is empty and the table has to be re-rendered.
+    """
+    page = table_state.get('page', 0)
+    sort_by = table_state.get('sort_by') or []
+    filter_query = table_state.get('filter_query') or ''
+    cursors = {key: value for key, value in (table_state.get('cursors') or {}).items() if int(key) < page}
+    
+    conn = get_db()
+    version = get_data_versions(conn).get('refuels', 0)
+    stats = refuel_summary(table_state['filter'], conn)
+    df, total = fetch_refuel_page(table_state['filter'], sort_by, filter_query, page,
+                                  after=cursors.get(str(page - 1)), conn=conn)
+    if df.empty and total:
+        # The page itself is gone: show the new last page
+        page = refuel_page_count(total) - 1
+        cursors = {key: value for key, value in cursors.items() if int(key) < page}
+        df, total = fetch_refuel_page(table_state['filter'], sort_by, filter_query, page,
+                                      after=cursors.get(str(page - 1)), conn=conn)
+    conn.close()
+    if df.empty:
+        return None
+    
+    cursors[str(page)] = [int(df['timestamp'].iloc[-1]), df['id'].iloc[-1]]
+    rows = prepare_refuel_rows(df)
+    selected = [i for i, row in enumerate(rows) if row['id'] == table_state.get('selected_id')]
+    
+    table_props = {'data': rows, 'page_count': refuel_page_count(total), 'selected_rows': selected}
+    if page != table_state.get('page', 0):
+        table_props['page_current'] = page
+    set_props('refueling-data-table', table_props)
+    for element_id, value in refuel_summary_text(stats).items():
+        set_props(element_id, {'children': value})
+    
+    state = Patch()
+    state['version'] = version
+    state['rows'] = len(rows)
+    state['page'] = page
+    state['cursors'] = cursors
+    state['selected'] = selected
+    state['selected_id'] = table_state.get('selected_id') if selected else None
+    return state
+
+def reload_refueling_view(table_state):
+    """Re-read the page on screen, or re-render the table when it shows none.
+
+    Returns (table container children, table state); the children are
+    no_update when the page was re-read in place.
+    """
+    state = refresh_refueling_page(table_state) if table_state and table_state.get('rows') else None
+    if state is None:
+        return render_refueling_table((table_state or {}).get('filter', 'all'))
+    return dash.no_update, state
+
+# Server-side paging, sorting and filtering of the refueling table
+@app.callback(
+    [Output('refueling-data-table', 'data'),
+     Output('refueling-data-table', 'page_count'),
+     Output('refueling-data-table', 'page_current'),
+     Output('refueling-data-table', 'selected_rows'),
+     Output('refuel-table-state', 'data', allow_duplicate=True)],
+    [Input('refueling-data-table', 'page_current'),
+     Input('refueling-data-table', 'sort_by'),
+     Input('refueling-data-table', 'filter_query')],
+    State('refuel-table-state', 'data'),
+    prevent_initial_call=True
+)
+def page_refueling_table(page_current, sort_by, filter_query, table_state):
+    """Load one page of the refueling log"""
+    if not get_user_data():
+        raise PreventUpdate
+    
+    page = page_current or 0
+    cursors = dict(table_state.get('cursors') or {})
+    
+    # A new sort or filter invalidates page positions
+    if any(not t['prop_id'].endswith('.page_current') for t in ctx.triggered):
+        page, cursors = 0, {}
+    
+    conn = get_db()
+    df, total = fetch_refuel_page(table_state['filter'], sort_by, filter_query, page,
+                                  after=cursors.get(str(page - 1)), conn=conn)
+    conn.close()
+    
+    if not df.empty:
+        cursors[str(page)] = [int(df['timestamp'].iloc[-1]), df['id'].iloc[-1]]
+    rows = prepare_refuel_rows(df)
+    
+    # New refuels can only be prepended to the default newest-first first page
+    state = Patch()
+    state['rows'] = len(rows)
+    state['live'] = page == 0 and not sort_by and not filter_query
+    state['page'] = page
+    state['sort_by'] = sort_by or []
+    state['filter_query'] = filter_query or ''
+    state['cursors'] = cursors
+    state['selected'] = []
+    state['selected_id'] = None
+    
+    return rows, refuel_page_count(total), page, [], state
 
 # ==================== FLEET CALLBACKS ====================
 
@@ -1501,11 +1880,12 @@ def add_machine(n_clicks, machine_id, model, rate, capacity):
             VALUES (?, ?, ?, ?, ?)
         ''', (machine_id, model, float(rate), int(capacity), user_data['id']))
         
-        log_audit(cursor, user_data['id'], user_data['username'], 'create', 'machines', machine_id,
-                 f"Added machine: {model}")
-        
+        bump_data_version(cursor, 'machines')
         conn.commit()
+        notify_change()
         conn.close()
+        record_audit(user_data['id'], user_data['username'], 'create', 'machines', machine_id,
+                     f"Added machine: {model}")
         
         return (render_machines_table(), 
                 create_notification(f"✅ Machine {machine_id} added successfully!"), 
@@ -1518,10 +1898,11 @@ def add_machine(n_clicks, machine_id, model, rate, capacity):
 # Render machines table
 @app.callback(
     Output('machines-table-container', 'children'),
-    Input('btn-add-machine', 'n_clicks'),
+    [Input('btn-add-machine', 'n_clicks'),
+     Input('version-machines', 'data')],
     prevent_initial_call=False
 )
-def update_machines_table(n):
+def update_machines_table(n, machines_version):
     """Update machines table"""
     return render_machines_table()
 
@@ -1630,11 +2011,12 @@ def add_operator(n_clicks, name, badge):
             VALUES (?, ?, ?, ?)
         ''', (operator_id, name, badge, user_data['id']))
         
-        log_audit(cursor, user_data['id'], user_data['username'], 'create', 'operators', operator_id,
-                 f"Added operator: {name}")
-        
+        bump_data_version(cursor, 'operators')
         conn.commit()
+        notify_change()
         conn.close()
+        record_audit(user_data['id'], user_data['username'], 'create', 'operators', operator_id,
+                     f"Added operator: {name}")
         
         return render_operators_table(), create_notification(f"✅ Operator {name} added successfully!"), '', ''
     except sqlite3.IntegrityError:
@@ -1645,10 +2027,11 @@ def add_operator(n_clicks, name, badge):
 # Render operators table
 @app.callback(
     Output('operators-table-container', 'children'),
-    Input('btn-add-operator', 'n_clicks'),
+    [Input('btn-add-operator', 'n_clicks'),
+     Input('version-operators', 'data')],
     prevent_initial_call=False
 )
-def update_operators_table(n):
+def update_operators_table(n, operators_version):
     """Update operators table"""
     return render_operators_table()
 
@@ -1700,46 +2083,55 @@ def render_operators_table():
 
 # ==================== ANALYTICS CALLBACKS ====================
 
+# Computed dashboards keyed by (date range, tolerance, data versions)
+analytics_cache = ResultCache(ANALYTICS_CACHE_ENTRIES, ANALYTICS_CACHE_MAX_BYTES)
+
 # Update analytics
 @app.callback(
     [Output('kpi-cards', 'children'),
      Output('fuel-trend-chart', 'figure'),
      Output('machine-performance-chart', 'figure'),
      Output('operator-performance-table', 'children')],
-    Input('btn-apply-dates', 'n_clicks'),
+    [Input('btn-apply-dates', 'n_clicks'),
+     Input('version-refuels', 'data'),
+     Input('version-machines', 'data'),
+     Input('version-operators', 'data'),
+     Input('version-settings', 'data')],
     [State('date-from', 'date'),
      State('date-to', 'date')],
     prevent_initial_call=False
 )
-def update_analytics(n_clicks, date_from, date_to):
+def update_analytics(n_clicks, refuels_version, machines_version, operators_version, settings_version,
+                     date_from, date_to):
     """Update analytics dashboard"""
     user_data = get_user_data()
     if not user_data:
         raise PreventUpdate
     
-    # Default dates if not provided
+    # Default dates if not provided: the last 30 days at the site
     if not date_from:
-        date_from = (datetime.now() - timedelta(days=30)).date()
+        date_from = (site_now() - timedelta(days=30)).date()
     if not date_to:
-        date_to = datetime.now().date()
+        date_to = site_now().date()
+    date_from = pd.to_datetime(date_from).date().isoformat()
+    date_to = pd.to_datetime(date_to).date().isoformat()
     
-    # Get data
+    # Results are shared until a writer bumps one of the data versions
     conn = get_db()
-    query = '''
-        SELECT r.*, m.model, m.rate, o.name as operator_name
-        FROM refuels r
-        JOIN machines m ON r.machine_id = m.id
-        JOIN operators o ON r.operator_id = o.id
-        ORDER BY r.timestamp DESC
-    '''
-    df = pd.read_sql_query(query, conn)
-    
-    # Get settings
-    cursor = conn.cursor()
-    cursor.execute('SELECT tolerance FROM settings WHERE id = ?', ('current',))
-    settings = cursor.fetchone()
-    tolerance = settings['tolerance'] if settings else 10
+    versions = get_data_versions(conn)
+    tolerance = get_tolerance(conn)
     conn.close()
+    key = (date_from, date_to, tolerance,
+           tuple(versions.get(scope, 0) for scope in ('refuels', 'machines', 'operators', 'settings')))
+    
+    return analytics_cache.get_or_compute(key, lambda: build_analytics(date_from, date_to))
+
+def build_analytics(date_from, date_to):
+    """Compute KPI cards, charts and operator table for a date range"""
+    # Get data from the daily rollup (fallback to all data when the range is empty)
+    df = analytics_rollup(date_from, date_to)
+    if df.empty:
+        df = analytics_rollup()
     
     if df.empty:
         empty_fig = go.Figure()
@@ -1756,26 +2148,11 @@ def update_analytics(n_clicks, date_from, date_to):
             html.P("No data available", style={'color': COLORS['text_dim']})
         )
     
-    # Process data
-    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df['expected_fuel'] = df['usage'] * df['rate']
-    df['variance'] = df['fuel'] - df['expected_fuel']
-    df['variance_pct'] = (df['variance'] / df['expected_fuel'] * 100).round(2)
-    df['efficiency'] = (df['expected_fuel'] / df['fuel'] * 100).round(2)
-    
-    # Filter by date
-    filtered_df = df[(df['datetime'].dt.date >= pd.to_datetime(date_from).date()) & 
-                     (df['datetime'].dt.date <= pd.to_datetime(date_to).date())]
-    
-    if filtered_df.empty:
-        filtered_df = df  # Fallback to all data
-    
     # Calculate KPI values
-    total_fuel = filtered_df['fuel'].sum()
-    expected_fuel = filtered_df['expected_fuel'].sum()
-    total_usage = filtered_df['usage'].sum()
-    anomalies = (filtered_df['variance_pct'] > tolerance).sum()
-    avg_efficiency = filtered_df['efficiency'].mean()
+    total_fuel = df['fuel'].sum()
+    expected_fuel = df['expected_fuel'].sum()
+    total_usage = df['usage'].sum()
+    anomalies = int(df['anomalies'].sum())
     
     # KPI Cards with improved styling
     kpi_cards = dbc.Row([
@@ -1838,10 +2215,11 @@ def update_analytics(n_clicks, date_from, date_to):
     ], className="g-3", style={'marginBottom': '20px'})
     
     # Expected vs Delivered Fuel Chart (Improved styling)
-    daily_data = filtered_df.groupby(filtered_df['datetime'].dt.date).agg({
+    daily_data = df.groupby('day').agg({
         'fuel': 'sum',
         'expected_fuel': 'sum'
     }).reset_index()
+    daily_data['datetime'] = pd.to_datetime(daily_data['day'])
     
     fuel_trend_fig = go.Figure()
     
@@ -1896,13 +2274,13 @@ def update_analytics(n_clicks, date_from, date_to):
     )
     
     # Machine Performance Chart (Improved with gradient colors)
-    machine_data = filtered_df.groupby('machine_id').agg({
+    machine_data = df.groupby('machine_id').agg({
         'fuel': 'sum',
         'usage': 'sum',
         'model': 'first',
         'expected_fuel': 'sum'
     }).reset_index()
-    machine_data['efficiency'] = (machine_data['expected_fuel'] / machine_data['fuel'] * 100).round(1)
+    machine_data['efficiency'] = efficiency(machine_data['expected_fuel'], machine_data['fuel'])
     
     # Create color scale based on efficiency
     colors_list = []
@@ -1950,13 +2328,13 @@ def update_analytics(n_clicks, date_from, date_to):
     )
     
     # Operator Performance Table with improved styling
-    operator_data = filtered_df.groupby('operator_name').agg({
+    operator_data = df.groupby('operator_name').agg({
         'fuel': 'sum',
         'usage': 'sum',
         'expected_fuel': 'sum',
-        'id': 'count'
+        'entries': 'sum'
     }).reset_index()
-    operator_data['efficiency'] = (operator_data['expected_fuel'] / operator_data['fuel'] * 100).round(1)
+    operator_data['efficiency'] = efficiency(operator_data['expected_fuel'], operator_data['fuel'])
     operator_data.columns = ['Operator', 'Total Fuel (L)', 'Total Usage (hrs)', 'Expected Fuel (L)', 'Entries', 'Efficiency (%)']
     operator_data = operator_data.sort_values('Total Fuel (L)', ascending=False)
     
@@ -2025,14 +2403,21 @@ def save_settings(n_clicks, tolerance):
         conn = get_db()
         cursor = conn.cursor()
         
+        previous_tolerance = get_tolerance(conn)
         cursor.execute('UPDATE settings SET tolerance = ?, updated_at = ?, updated_by = ? WHERE id = ?',
                       (float(tolerance), datetime.now(), user_data['id'], 'current'))
         
-        log_audit(cursor, user_data['id'], user_data['username'], 'update', 'settings', 'current',
-                 f"Updated tolerance to {tolerance}%")
+        # Stored anomaly flags and the rollup's counts depend on the tolerance
+        if float(tolerance) != previous_tolerance:
+            restamp_anomalies(cursor, float(tolerance))
+            rebuild_rollup(cursor)
         
+        bump_data_version(cursor, 'settings')
         conn.commit()
+        notify_change()
         conn.close()
+        record_audit(user_data['id'], user_data['username'], 'update', 'settings', 'current',
+                     f"Updated tolerance to {tolerance}%")
         
         return render_system_info(), create_notification("✅ Settings saved successfully!")
     except Exception as e:
@@ -2041,10 +2426,14 @@ def save_settings(n_clicks, tolerance):
 # Render system info
 @app.callback(
     Output('system-info', 'children', allow_duplicate=True),
-    Input('url', 'pathname'),
+    [Input('url', 'pathname'),
+     Input('version-machines', 'data'),
+     Input('version-operators', 'data'),
+     Input('version-refuels', 'data'),
+     Input('version-users', 'data')],
     prevent_initial_call=True
 )
-def update_system_info(pathname):
+def update_system_info(pathname, *versions):
     """Update system info"""
     return render_system_info()
 
@@ -2059,6 +2448,9 @@ def render_system_info():
     
     conn.close()
     
+    cache_stats = analytics_cache.stats()
+    snapshots = list_snapshots()
+    
     return dbc.Card([
         dbc.CardHeader(
             html.H4("ℹ️ System Information", style={'color': COLORS['cat_yellow'], 'margin': '0'})
@@ -2089,245 +2481,244 @@ def render_system_info():
                         html.H4(str(users_count), style={'color': COLORS['cat_yellow']})
                     ], style={'textAlign': 'center', 'padding': '20px', 'background': '#0a0a0a', 'borderRadius': '4px'})
                 ], md=3)
-            ])
+            ]),
+            html.Div([
+                html.Strong("Analytics cache (this worker): ", style={'color': COLORS['text_dim']}),
+                html.Span(f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                          f"({cache_stats['hit_rate']:.0f}% hit rate), "
+                          f"{cache_stats['entries']} entries, {cache_stats['bytes'] / 1024:.0f} KB, "
+                          f"{cache_stats['evictions']} evictions",
+                          style={'color': COLORS['text_bright']})
+            ], style={'marginTop': '15px', 'padding': '10px 15px', 'background': '#0a0a0a', 'borderRadius': '4px',
+                      'fontSize': '0.85rem'}),
+            html.Div([
+                html.Strong("Snapshots: ", style={'color': COLORS['text_dim']}),
+                html.Span(f"{len(snapshots)} kept, latest {snapshots[0]['created'].strftime('%Y-%m-%d %H:%M')} "
+                          f"({snapshots[0]['size'] / 1024 / 1024:.1f} MB)" if snapshots else "none yet",
+                          style={'color': COLORS['text_bright']})
+            ], style={'marginTop': '10px', 'padding': '10px 15px', 'background': '#0a0a0a', 'borderRadius': '4px',
+                      'fontSize': '0.85rem'})
         ])
     ], style=CARD_STYLE)
 
 # Export Excel
-@app.callback(
-    Output('download-analytics', 'data'),
-    Input('btn-export-analytics', 'n_clicks'),
-    State('date-from', 'date'),
-    State('date-to', 'date'),
-    prevent_initial_call=True
-)
-def export_analytics(n_clicks, date_from, date_to):
-    if not n_clicks:
-        raise PreventUpdate
-    
-    conn = get_db()
-    df = pd.read_sql_query('''
-        SELECT r.timestamp, r.machine_id, m.model, o.name AS operator,
-               r.usage, r.fuel, m.rate,
-               (r.usage * m.rate) AS expected_fuel,
-               (r.fuel - (r.usage * m.rate)) AS variance
-        FROM refuels r
-        JOIN machines m ON r.machine_id = m.id
-        JOIN operators o ON r.operator_id = o.id
-    ''', conn)
-
-    conn.close()
-
-    df['date'] = pd.to_datetime(df['timestamp'], unit='ms').dt.date
-
+def analytics_export_href(date_from, date_to):
+    """URL of the streaming analytics export for a date range"""
+    params = {}
     if date_from:
-        df = df[df['date'] >= pd.to_datetime(date_from).date()]
+        params['from'] = pd.to_datetime(date_from).date().isoformat()
     if date_to:
-        df = df[df['date'] <= pd.to_datetime(date_to).date()]
-
-    summary = df.groupby('machine_id').agg({
-        'fuel': 'sum',
-        'expected_fuel': 'sum',
-        'variance': 'sum'
-    }).reset_index()
+        params['to'] = pd.to_datetime(date_to).date().isoformat()
+    return '/export/analytics.xlsx' + (f"?{urlencode(params)}" if params else '')
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Detailed Logs', index=False)
-        summary.to_excel(writer, sheet_name='Machine Summary', index=False)
-
-    return dcc.send_bytes(
-    lambda out: out.write(output.getvalue()),
-    f"analytics_report_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+@app.callback(
+    Output('btn-export-analytics', 'href'),
+    [Input('export-date-from', 'date'),
+     Input('export-date-to', 'date')]
 )
+def update_export_link(date_from, date_to):
+    """Point the export button at the selected date range"""
+    return analytics_export_href(date_from, date_to)
+
+@server.route('/export/analytics.xlsx')
+def export_analytics():
+    """Stream the analytics workbook for ?from=YYYY-MM-DD&to=YYYY-MM-DD"""
+    user_data = get_user_data()
+    if not check_permission(user_data, 'reports', 'read'):
+        abort(403)
     
+    try:
+        date_to = pd.to_datetime(request.args['to']).date() if request.args.get('to') else site_now().date()
+        date_from = (pd.to_datetime(request.args['from']).date() if request.args.get('from')
+                     else date_to - timedelta(days=30))
+    except (ValueError, TypeError):
+        abort(400)
+    if date_from > date_to:
+        abort(400)
+    
+    return send_file(
+        export_analytics_file(date_from, date_to),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f"analytics_report_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+    )
 
 # Import Excel
 @app.callback(
-    Output('settings-notification', 'children', allow_duplicate=True),
+    [Output('settings-notification', 'children', allow_duplicate=True),
+     Output('job-store', 'data'),
+     Output('job-poll', 'disabled')],
     Input('upload-excel', 'contents'),
     State('upload-excel', 'filename'),
     prevent_initial_call=True
 )
 def import_excel(contents, filename):
-    """Import data from Excel file"""
+    """Queue an Excel import as a background job"""
     if not contents:
         raise PreventUpdate
     
     user_data = get_user_data()
     if not user_data or not check_permission(user_data, 'machines', 'write'):
-        return create_notification("❌ Permission denied", "danger")
+        return create_notification("❌ Permission denied", "danger"), dash.no_update, dash.no_update
     
     try:
         # Decode the file
         content_type, content_string = contents.split(',')
         decoded = base64.b64decode(content_string)
-        
-        # Read Excel file
-        excel_data = BytesIO(decoded)
-        xls = pd.ExcelFile(excel_data)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        imported_counts = {'operators': 0, 'machines': 0, 'refuels': 0}
-        errors = []
-        
-        # Import Operators (sheet: "Operators")
-        if 'Operators' in xls.sheet_names:
-            operators_df = pd.read_excel(excel_data, sheet_name='Operators')
-            
-            for idx, row in operators_df.iterrows():
-                try:
-                    operator_name = str(row.get('Operator', '')).strip()
-                    badge = str(row.get('Badge Number', '')).strip()
-                    
-                    if not operator_name or not badge:
-                        continue
-                    
-                    # Check if operator already exists
-                    cursor.execute('SELECT id FROM operators WHERE badge = ?', (badge,))
-                    if cursor.fetchone():
-                        continue  # Skip if exists
-                    
-                    operator_id = generate_uuid()
-                    cursor.execute('''
-                        INSERT INTO operators (id, name, badge, created_by)
-                        VALUES (?, ?, ?, ?)
-                    ''', (operator_id, operator_name, badge, user_data['id']))
-                    
-                    imported_counts['operators'] += 1
-                except Exception as e:
-                    errors.append(f"Operator row {idx+1}: {str(e)}")
-        
-        # Import Machines (sheet: "Assets")
-        if 'Assets' in xls.sheet_names:
-            machines_df = pd.read_excel(excel_data, sheet_name='Assets')
-            
-            for idx, row in machines_df.iterrows():
-                try:
-                    machine_id = str(row.get('Machine ID', '')).strip().upper()
-                    model = str(row.get('Model', '')).strip()
-                    rate = float(row.get('Rate', 0))
-                    capacity = int(row.get('Capacity', 0))
-                    
-                    if not machine_id or not model or rate <= 0 or capacity <= 0:
-                        continue
-                    
-                    # Check if machine already exists
-                    cursor.execute('SELECT id FROM machines WHERE id = ?', (machine_id,))
-                    if cursor.fetchone():
-                        continue  # Skip if exists
-                    
-                    cursor.execute('''
-                        INSERT INTO machines (id, model, rate, capacity, created_by)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (machine_id, model, rate, capacity, user_data['id']))
-                    
-                    imported_counts['machines'] += 1
-                except Exception as e:
-                    errors.append(f"Machine row {idx+1}: {str(e)}")
-        
-        # Import Refueling (sheet: "Refueling")
-        if 'Refueling' in xls.sheet_names:
-            refuels_df = pd.read_excel(excel_data, sheet_name='Refueling')
-            
-            for idx, row in refuels_df.iterrows():
-                try:
-                    # Parse time
-                    time_val = row.get('Time')
-                    if pd.isna(time_val):
-                        continue
-                    
-                    if isinstance(time_val, str):
-                        dt = pd.to_datetime(time_val)
-                    else:
-                        dt = time_val
-                    
-                    timestamp = int(dt.timestamp() * 1000)
-                    
-                    # Get machine and operator
-                    machine_id = str(row.get('Machine', '')).strip().upper()
-                    operator_name = str(row.get('Operator', '')).strip()
-                    usage = float(row.get('Hours worked', 0))
-                    fuel = float(row.get('Fuel issued', 0))
-                    
-                    if not machine_id or not operator_name or usage <= 0 or fuel <= 0:
-                        continue
-                    
-                    # Find machine
-                    cursor.execute('SELECT id FROM machines WHERE id = ?', (machine_id,))
-                    machine = cursor.fetchone()
-                    if not machine:
-                        errors.append(f"Refuel row {idx+1}: Machine {machine_id} not found")
-                        continue
-                    
-                    # Find operator by name
-                    cursor.execute('SELECT id FROM operators WHERE name = ?', (operator_name,))
-                    operator = cursor.fetchone()
-                    if not operator:
-                        errors.append(f"Refuel row {idx+1}: Operator {operator_name} not found")
-                        continue
-                    
-                    refuel_id = generate_uuid()
-                    cursor.execute('''
-                        INSERT INTO refuels (id, timestamp, machine_id, operator_id, usage, fuel, notes, created_by)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (refuel_id, timestamp, machine_id, operator['id'], usage, fuel, '', user_data['id']))
-                    
-                    imported_counts['refuels'] += 1
-                except Exception as e:
-                    errors.append(f"Refuel row {idx+1}: {str(e)}")
-        
-        # Log audit
-        log_audit(cursor, user_data['id'], user_data['username'], 'import_excel', 'system', filename,
-                 f"Imported: {imported_counts}")
-        
-        conn.commit()
-        conn.close()
-        
-        # Create success message
-        message = f"✅ Import completed!\n"
-        message += f"Operators: {imported_counts['operators']}, "
-        message += f"Machines: {imported_counts['machines']}, "
-        message += f"Refuels: {imported_counts['refuels']}"
-        
-        if errors:
-            message += f"\n⚠️ {len(errors)} errors (check console for details)"
-            print("\n".join(errors[:10]))  # Print first 10 errors
-        
-        return create_notification(message, "success" if not errors else "warning")
-        
     except Exception as e:
-        return create_notification(f"❌ Import failed: {str(e)}", "danger")
+        return create_notification(f"❌ Import failed: {str(e)}", "danger"), dash.no_update, dash.no_update
+    
+    job_id = submit_job('import_excel', filename, user_data['id'], run_import_job,
+                        decoded, filename, user_data)
+    return create_notification(f"⏳ Import of {filename} started", "info"), job_id, False
 
-# Create backup
+# Restore backup
 @app.callback(
-    Output('download-backup', 'data'),
-    Input('btn-backup', 'n_clicks'),
+    [Output('settings-notification', 'children', allow_duplicate=True),
+     Output('job-store', 'data', allow_duplicate=True),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    Input('upload-backup', 'contents'),
+    [State('upload-backup', 'filename'),
+     State('restore-dry-run', 'value')],
     prevent_initial_call=True
 )
-def create_backup(n_clicks):
-    """Create JSON backup"""
-    if not n_clicks:
+def restore_backup(contents, filename, dry_run):
+    """Queue a backup restore (or dry run) as a background job"""
+    if not contents:
         raise PreventUpdate
     
+    user_data = get_user_data()
+    if not check_permission(user_data, 'settings', 'admin'):
+        return create_notification("❌ Permission denied", "danger"), dash.no_update, dash.no_update
+    
+    try:
+        content_type, content_string = contents.split(',')
+        decoded = base64.b64decode(content_string)
+    except Exception as e:
+        return create_notification(f"❌ Restore failed: {str(e)}", "danger"), dash.no_update, dash.no_update
+    
+    job_id = submit_job('restore', filename, user_data['id'], run_restore_job,
+                        decoded, filename, bool(dry_run), user_data)
+    action = "Dry run" if dry_run else "Restore"
+    return create_notification(f"⏳ {action} of {filename} started", "info"), job_id, False
+
+# Progress of each job phase, for the progress bar
+JOB_PHASE_PROGRESS = {'parsing': 10, 'verifying': 30, 'validating': 40, 'writing': 70}
+
+def job_result_text(job):
+    """One-line summary of a finished job"""
+    result = job['result'] or {}
+    if job['kind'] == 'restore':
+        tables = ', '.join(f"{name.capitalize()}: {count}" for name, count in result.get('tables', {}).items())
+        if result.get('dry_run'):
+            return f"✅ Dry run passed for {job['filename']} - would restore {tables}"
+        return f"✅ Restored {job['filename']}: {tables}"
+    return (f"✅ Imported {job['filename']}: Operators: {result.get('operators', 0)}, "
+            f"Machines: {result.get('machines', 0)}, Refuels: {result.get('refuels', 0)}")
+
+def render_job(job):
+    """Progress bar, result and error download for a background job"""
+    errors_link = html.A(f"⬇️ Download {job['error_count']} row errors (CSV)",
+                         href=f"/jobs/{job['id']}/errors.csv",
+                         style={'color': COLORS['cat_yellow']}) if job['error_count'] else None
+    
+    if job['status'] == 'failed':
+        return html.Div([
+            dbc.Alert(f"❌ {job['filename']} failed: {job['message']}", color='danger', className='mb-2'),
+            errors_link
+        ])
+    
+    if job['status'] == 'done':
+        return html.Div([
+            dbc.Progress(value=100, label="100%", color='success' if not job['error_count'] else 'warning',
+                         className='mb-2'),
+            html.P(job_result_text(job), style={'color': COLORS['text_bright'], 'marginBottom': '5px'}),
+            errors_link
+        ])
+    
+    progress = JOB_PHASE_PROGRESS.get(job['phase'], 0)
+    rows = f" ({job['processed_rows']:,} / {job['total_rows']:,} rows)" if job['total_rows'] else ''
+    return html.Div([
+        dbc.Progress(value=progress, label=f"{progress}%", striped=True, animated=True, className='mb-2'),
+        html.P(f"⏳ {(job['phase'] or job['status']).capitalize()} {job['filename']}{rows}",
+               style={'color': COLORS['text_dim'], 'marginBottom': '5px'}),
+        errors_link
+    ])
+
+@app.callback(
+    [Output('job-status', 'children'),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    Input('job-poll', 'n_intervals'),
+    State('job-store', 'data'),
+    prevent_initial_call=True
+)
+def poll_job(n_intervals, job_id):
+    """Show the progress of the current background job"""
+    job = get_job(job_id) if job_id else None
+    if not can_view_job(job, get_user_data()):
+        return None, True
+    return render_job(job), job['status'] in FINISHED_STATUSES
+
+@server.route('/jobs/<job_id>')
+def job_progress(job_id):
+    """Lightweight JSON progress of a background job"""
+    job = get_job(job_id)
+    if not can_view_job(job, get_user_data()):
+        abort(404)
+    return jsonify({key: job[key] for key in ('id', 'kind', 'filename', 'status', 'phase', 'total_rows',
+                                              'processed_rows', 'error_count', 'result', 'message',
+                                              'created_at', 'updated_at', 'finished_at')})
+
+@server.route('/jobs/<job_id>/errors.csv')
+def job_errors_csv(job_id):
+    """Download every row error collected by a job"""
+    job = get_job(job_id)
+    if not can_view_job(job, get_user_data()):
+        abort(404)
+    
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Error'])
+    writer.writerows([message] for message in get_job_errors(job_id))
+    return Response(output.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename=import_errors_{job_id[:8]}.csv'})
+
+# Create backup
+@server.route('/backup.ndjson.gz')
+def create_backup():
+    """Stream a gzip-compressed NDJSON backup"""
+    user_data = get_user_data()
+    if not check_permission(user_data, 'reports', 'write'):
+        abort(403)
+    
     conn = get_db()
+    log_audit(conn.cursor(), user_data['id'], user_data['username'], 'create_backup', 'system', 'db')
+    conn.commit()
+    conn.close()
     
-    backup = {
-        'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0',
-        'company': 'J-INVESTMENTS',
-        'machines': pd.read_sql_query('SELECT * FROM machines', conn).to_dict('records'),
-        'operators': pd.read_sql_query('SELECT * FROM operators', conn).to_dict('records'),
-        'refuels': pd.read_sql_query('SELECT * FROM refuels', conn).to_dict('records'),
-        'settings': pd.read_sql_query('SELECT * FROM settings', conn).to_dict('records')
-    }
+    return Response(stream_backup(), mimetype='application/gzip',
+                    headers={'Content-Disposition': f'attachment; filename={backup_filename()}'})
+
+# Download latest snapshot
+@server.route('/snapshots/latest.db')
+def download_latest_snapshot():
+    """Serve the newest database snapshot (admins only)"""
+    user_data = get_user_data()
+    if not check_permission(user_data, 'settings', 'admin'):
+        abort(403)
+    
+    snapshot = latest_snapshot()
+    if not snapshot:
+        abort(404)
     
+    conn = get_db()
+    log_audit(conn.cursor(), user_data['id'], user_data['username'], 'download_snapshot', 'system',
+              snapshot['name'])
+    conn.commit()
     conn.close()
     
-    backup_json = json.dumps(backup, indent=2)
-    return dcc.send_string(backup_json, f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    return send_file(os.path.abspath(snapshot['path']), mimetype='application/vnd.sqlite3',
+                     as_attachment=True, download_name=snapshot['name'])
 
 # ==================== USERS CALLBACKS ====================
 
@@ -2375,8 +2766,11 @@ def create_user(n_clicks, username, fullname, email, password, role):
         log_audit(cursor, user_data['id'], user_data['username'], 'create', 'users', user_id,
                  f"Created user: {username} ({role})")
         
+        bump_data_version(cursor, 'users')
         conn.commit()
+        notify_change()
         conn.close()
+        invalidate_user_cache(user_id)
         
         return (render_users_table(), 
                 create_notification(f"✅ User {username} created successfully!"), 
@@ -2388,14 +2782,118 @@ def create_user(n_clicks, username, fullname, email, password, role):
 
 # Render users table
 @app.callback(
-    [Output('users-table-container', 'children'),
-     Output('audit-log-container', 'children')],
-    Input('btn-create-user', 'n_clicks'),
+    Output('users-table-container', 'children'),
+    [Input('btn-create-user', 'n_clicks'),
+     Input('version-users', 'data')],
     prevent_initial_call=False
 )
-def update_users_tables(n):
-    """Update users and audit log tables"""
-    return render_users_table(), render_audit_log()
+def update_users_tables(n, users_version):
+    """Update users table"""
+    return render_users_table()
+
+# ==================== AUDIT EXPLORER CALLBACKS ====================
+def audit_export_href(params):
+    """URL of the CSV export for the explorer's current filters"""
+    params = {key: value for key, value in params.items() if value}
+    return '/audit/export.csv' + (f"?{urlencode(params)}" if params else '')
+
+# Filters reset to the first page; pages are keyset cursors, so "Older"
+# costs the same on page 1 and page 10,000. Audit writes (synchronous or
+# batched) bump the audit scope and refresh the first page only.
+@app.callback(
+    [Output('audit-log-container', 'children'),
+     Output('audit-page-store', 'data'),
+     Output('btn-audit-newer', 'disabled'),
+     Output('btn-audit-older', 'disabled'),
+     Output('audit-page-info', 'children'),
+     Output('btn-audit-export', 'href')],
+    [Input('audit-filter-user', 'value'),
+     Input('audit-filter-action', 'value'),
+     Input('audit-filter-entity-type', 'value'),
+     Input('audit-filter-entity-id', 'value'),
+     Input('audit-filter-dates', 'start_date'),
+     Input('audit-filter-dates', 'end_date'),
+     Input('audit-include-archive', 'value'),
+     Input('btn-audit-newer', 'n_clicks'),
+     Input('btn-audit-older', 'n_clicks'),
+     Input('version-audit', 'data')],
+    State('audit-page-store', 'data')
+)
+def update_audit_explorer(user_id, action, entity_type, entity_id, day_from, day_to, archive,
+                          newer_clicks, older_clicks, audit_version, pager):
+    """Show one page of audit entries for the current filters"""
+    user_data = get_user_data()
+    if not check_permission(user_data, 'users', 'write'):
+        raise PreventUpdate
+
+    pager = pager or {'cursors': [None], 'page': 0, 'next': None}
+    triggered = ctx.triggered_id
+    if triggered == 'btn-audit-older':
+        if not pager['next']:
+            raise PreventUpdate
+        cursors, page = pager['cursors'][:pager['page'] + 1] + [pager['next']], pager['page'] + 1
+    elif triggered == 'btn-audit-newer':
+        if pager['page'] == 0:
+            raise PreventUpdate
+        cursors, page = pager['cursors'], pager['page'] - 1
+    elif triggered == 'version-audit' and pager['page'] > 0:
+        # New entries land on the first page; leave a deeper page where it is
+        raise PreventUpdate
+    else:
+        cursors, page = [None], 0
+
+    filters = audit_filters(user_id, action, entity_type, entity_id, day_from, day_to)
+    include_archive = 'archive' in (archive or [])
+    # One extra row tells whether an older page exists
+    rows = fetch_audit_page(filters, cursors[page], AUDIT_PAGE_SIZE + 1, include_archive)
+    has_older = len(rows) > AUDIT_PAGE_SIZE
+    rows = rows[:AUDIT_PAGE_SIZE]
+
+    first = page * AUDIT_PAGE_SIZE + 1
+    info = f"Entries {first}–{first + len(rows) - 1}" if rows else ""
+    export_href = audit_export_href({'user': user_id, 'action': action, 'entity_type': entity_type,
+                                     'entity_id': (entity_id or '').strip(), 'from': day_from, 'to': day_to,
+                                     'archive': '1' if include_archive else None})
+    pager = {'cursors': cursors, 'page': page,
+             'next': [rows[-1]['timestamp'], rows[-1]['id']] if has_older else None}
+    return render_audit_log(rows), pager, page == 0, not has_older, info, export_href
+
+@server.route('/audit/export.csv')
+def export_audit_csv():
+    """Stream every audit entry matching ?user=&action=&entity_type=&entity_id=&from=&to=&archive=1"""
+    user_data = get_user_data()
+    if not check_permission(user_data, 'users', 'write'):
+        abort(403)
+
+    args = request.args
+    try:
+        filters = audit_filters(args.get('user'), args.get('action'), args.get('entity_type'),
+                                args.get('entity_id'), args.get('from'), args.get('to'))
+    except (ValueError, TypeError):
+        abort(400)
+    include_archive = args.get('archive') == '1'
+
+    conn = get_db()
+    log_audit(conn.cursor(), user_data['id'], user_data['username'], 'export_audit', 'system', 'audit_log',
+              json.dumps({**filters, 'archive': include_archive}))
+    conn.commit()
+    conn.close()
+
+    def generate():
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(AUDIT_COLUMNS)
+        for count, row in enumerate(iter_audit_rows(filters, include_archive, EXPORT_CHUNK_ROWS), 1):
+            writer.writerow([row[column] for column in AUDIT_COLUMNS])
+            if count % 1000 == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+
+    return Response(generate(), mimetype='text/csv',
+                    headers={'Content-Disposition':
+                             f"attachment; filename=audit_log_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"})
 
 # ==================== EDIT USER CALLBACKS ====================
 
@@ -2536,9 +3034,17 @@ def confirm_edit_user(n_clicks, admin_password, fullname, email, role, status,
             log_audit(cursor, user_data['id'], user_data['username'], 'update', 'users', user_id,
                      f"Updated user: {fullname} - Role: {role}, Status: {'Active' if status else 'Inactive'}")
         
+        bump_data_version(cursor, 'users')
         conn.commit()
+        notify_change()
         conn.close()
         
+        # Role, permission and deactivation changes take effect immediately
+        invalidate_user_cache(user_id)
+        # A new password or deactivation logs the user out everywhere else
+        if new_password or not status:
+            revoke_user_sessions(user_id, keep=session.sid)
+        
         # Return updated table and clear fields
         return False, '', '', '', '', render_users_table(), []
     except Exception as e:
@@ -2658,29 +3164,21 @@ def render_users_table():
         dbc.CardBody([table, action_section])
     ], style=CARD_STYLE)
 
-def render_audit_log():
-    """Render audit log"""
-    conn = get_db()
-    df = pd.read_sql_query('''
-        SELECT timestamp, username, action, entity_type, details
-        FROM audit_log
-        ORDER BY timestamp DESC
-        LIMIT 50
-    ''', conn)
-    conn.close()
-    
-    if df.empty:
+def render_audit_log(rows):
+    """Render one page of audit entries"""
+    if not rows:
         return html.P("No audit entries", style={'color': COLORS['text_dim']})
-    
-    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
-    
+
+    columns = [('timestamp', 'Time (UTC)'), ('username', 'User'), ('action', 'Action'),
+               ('entity_type', 'Entity'), ('entity_id', 'Entity ID'), ('details', 'Details')]
+
     table = dash_table.DataTable(
-        data=df.to_dict('records'),
-        columns=[{'name': col, 'id': col} for col in df.columns],
+        data=[{field: row[field] for field, _ in columns} for row in rows],
+        columns=[{'name': name, 'id': field} for field, name in columns],
         **TABLE_STYLE,
-        page_size=20
+        page_action='none'
     )
-    
+
     return table
 
 # ==================== DELETE MODAL CALLBACKS ====================
@@ -2716,10 +3214,7 @@ def open_delete_modal(machine_clicks, operator_clicks, refuel_clicks):
 @app.callback(
     [Output('delete-modal', 'is_open', allow_duplicate=True),
      Output('delete-error', 'children'),
-     Output('admin-password-input', 'value'),
-     Output('machines-table-container', 'children', allow_duplicate=True),
-     Output('operators-table-container', 'children', allow_duplicate=True),
-     Output('refueling-table-container', 'children', allow_duplicate=True)],
+     Output('admin-password-input', 'value')],
     Input('confirm-delete-btn', 'n_clicks'),
     [State('admin-password-input', 'value'),
      State('delete-confirmation-store', 'data')],
@@ -2732,11 +3227,11 @@ def confirm_delete(n_clicks, admin_password, delete_data):
     
     user_data = get_user_data()
     if not user_data:
-        return True, create_notification("❌ Not authenticated", "danger"), '', *[dash.no_update]*3
+        return True, create_notification("❌ Not authenticated", "danger"), ''
     
     # Verify admin password
     if not verify_admin_password(admin_password):
-        return True, create_notification("❌ Invalid admin password", "danger"), '', *[dash.no_update]*3
+        return True, create_notification("❌ Invalid admin password", "danger"), ''
     
     entity_type = delete_data['type']
     entity_id = delete_data['id']
@@ -2754,20 +3249,35 @@ def confirm_delete(n_clicks, admin_password, delete_data):
             log_audit(cursor, user_data['id'], user_data['username'], 'delete', 'operators', entity_id,
                      "Deleted operator")
         elif entity_type == 'refuel':
+            cursor.execute('SELECT timestamp FROM refuels WHERE id = ?', (entity_id,))
+            refuel = cursor.fetchone()
             cursor.execute('DELETE FROM refuels WHERE id = ?', (entity_id,))
             log_audit(cursor, user_data['id'], user_data['username'], 'delete', 'refuels', entity_id,
                      "Deleted refuel entry")
+            if refuel:
+                refresh_rollup(cursor, [refuel['timestamp']])
         
+        scope = {'machine': 'machines', 'operator': 'operators', 'refuel': 'refuels'}.get(entity_type, 'refuels')
+        bump_data_version(cursor, scope)
         conn.commit()
+        notify_change()
         conn.close()
         
-        # Return updated tables
-        return (False, '', '', 
-                render_machines_table() if entity_type == 'machine' else dash.no_update,
-                render_operators_table() if entity_type == 'operator' else dash.no_update,
-                render_refueling_table('all') if entity_type == 'refuel' else dash.no_update)
+        # The modal serves every tab, so only the table on screen is updated
+        if entity_type == 'machine':
+            set_props('machines-table-container', {'children': render_machines_table()})
+        elif entity_type == 'operator':
+            set_props('operators-table-container', {'children': render_operators_table()})
+        elif entity_type == 'refuel':
+            # Re-read the page on screen: the next row moves up into it
+            table, state = reload_refueling_view(delete_data.get('view'))
+            if table is not dash.no_update:
+                set_props('refueling-table-container', {'children': table})
+            set_props('refuel-table-state', {'data': state})
+        
+        return False, '', ''
     except Exception as e:
-        return True, create_notification(f"❌ Error: {str(e)}", "danger"), '', *[dash.no_update]*3
+        return True, create_notification(f"❌ Error: {str(e)}", "danger"), ''
 
 # Cancel delete
 @app.callback(
@@ -2789,18 +3299,25 @@ def cancel_delete(n_clicks):
     [Output('selected-refuel-info', 'children'),
      Output('edit-selected-refuel-btn', 'disabled'),
      Output('delete-selected-refuel-btn', 'disabled'),
-     Output('selected-refuel-id-store', 'data')],
+     Output('selected-refuel-id-store', 'data'),
+     Output('refuel-table-state', 'data', allow_duplicate=True)],
     [Input('refueling-data-table', 'selected_rows'),
      Input('refueling-data-table', 'data')],
-    prevent_initial_call=False
+    prevent_initial_call='initial_duplicate'
 )
 def update_selected_refuel(selected_rows, table_data):
     """Update action buttons based on row selection"""
-    if not selected_rows or not table_data:
-        return '', True, True, None
+    # The table state remembers the selection so writes can keep it
+    state = Patch()
+    if not selected_rows or not table_data or selected_rows[0] >= len(table_data):
+        state['selected'] = []
+        state['selected_id'] = None
+        return '', True, True, None, state
     
     selected_row_idx = selected_rows[0]
     selected_data = table_data[selected_row_idx]
+    state['selected'] = [selected_row_idx]
+    state['selected_id'] = selected_data['id']
     
     info = html.Div([
         html.Strong("Selected Entry: ", style={'color': COLORS['text_dim']}),
@@ -2810,7 +3327,7 @@ def update_selected_refuel(selected_rows, table_data):
                  style={'color': COLORS['cat_yellow']})
     ], style={'padding': '10px', 'background': '#0a0a0a', 'borderRadius': '4px', 'border': f"1px solid {COLORS['cat_yellow']}"})
     
-    return info, False, False, selected_data['id']
+    return info, False, False, selected_data['id'], state
 
 # Open edit modal from selected row button
 @app.callback(
@@ -2822,10 +3339,11 @@ def update_selected_refuel(selected_rows, table_data):
      Output('edit-refuel-notes', 'value', allow_duplicate=True),
      Output('edit-refuel-store', 'data', allow_duplicate=True)],
     Input('edit-selected-refuel-btn', 'n_clicks'),
-    State('selected-refuel-id-store', 'data'),
+    [State('selected-refuel-id-store', 'data'),
+     State('refueling-data-table', 'selected_rows')],
     prevent_initial_call=True
 )
-def open_edit_from_button(n_clicks, refuel_id):
+def open_edit_from_button(n_clicks, refuel_id, selected_rows):
     """Open edit modal from selected row button"""
     if not n_clicks or not refuel_id:
         raise PreventUpdate
@@ -2834,9 +3352,10 @@ def open_edit_from_button(n_clicks, refuel_id):
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT r.id, r.machine_id, o.name as operator_name, r.usage, r.fuel, r.notes
+        SELECT r.id, m.id AS machine_id, o.name as operator_name, r.usage, r.fuel, r.notes
         FROM refuels r
-        JOIN operators o ON r.operator_id = o.id
+        JOIN machines m ON m.key = r.machine_key
+        JOIN operators o ON o.key = r.operator_key
         WHERE r.id = ?
     ''', (refuel_id,))
     refuel = cursor.fetchone()
@@ -2847,7 +3366,7 @@ def open_edit_from_button(n_clicks, refuel_id):
     
     return (True, refuel['machine_id'], refuel['operator_name'], 
             refuel['usage'], refuel['fuel'], refuel['notes'] or '', 
-            {'id': refuel_id})
+            {'id': refuel_id, 'row': selected_rows[0] if selected_rows else None})
 
 # Open delete modal from selected row button
 @app.callback(
@@ -2855,15 +3374,18 @@ def open_edit_from_button(n_clicks, refuel_id):
      Output('delete-modal-text', 'children', allow_duplicate=True),
      Output('delete-confirmation-store', 'data', allow_duplicate=True)],
     Input('delete-selected-refuel-btn', 'n_clicks'),
-    State('selected-refuel-id-store', 'data'),
+    [State('selected-refuel-id-store', 'data'),
+     State('refuel-table-state', 'data')],
     prevent_initial_call=True
 )
-def open_delete_from_button(n_clicks, refuel_id):
+def open_delete_from_button(n_clicks, refuel_id, table_state):
     """Open delete modal from selected row button"""
     if not n_clicks or not refuel_id:
         raise PreventUpdate
     
-    return True, "Are you sure you want to delete this refuel entry?", {'type': 'refuel', 'id': refuel_id}
+    # The table view lets the delete re-read just the page on screen
+    return (True, "Are you sure you want to delete this refuel entry?",
+            {'type': 'refuel', 'id': refuel_id, 'view': table_state})
 
 # ==================== EDIT REFUEL MODAL CALLBACKS ====================
 
@@ -2873,16 +3395,18 @@ def open_delete_from_button(n_clicks, refuel_id):
      Output('edit-error', 'children'),
      Output('edit-admin-password-input', 'value'),
      Output('refueling-table-container', 'children', allow_duplicate=True),
-     Output('refueling-data-table', 'selected_rows', allow_duplicate=True)],
+     Output('refuel-table-state', 'data', allow_duplicate=True)],
     Input('confirm-edit-btn', 'n_clicks'),
     [State('edit-admin-password-input', 'value'),
      State('edit-refuel-usage', 'value'),
      State('edit-refuel-fuel', 'value'),
      State('edit-refuel-notes', 'value'),
-     State('edit-refuel-store', 'data')],
+     State('edit-refuel-store', 'data'),
+     State('refueling-data-table', 'selected_rows'),
+     State('refuel-table-state', 'data')],
     prevent_initial_call=True
 )
-def confirm_edit_refuel(n_clicks, admin_password, usage, fuel, notes, edit_data):
+def confirm_edit_refuel(n_clicks, admin_password, usage, fuel, notes, edit_data, selected_rows, table_state):
     """Confirm and execute refuel entry edit"""
     if not n_clicks or not edit_data:
         raise PreventUpdate
@@ -2910,15 +3434,29 @@ def confirm_edit_refuel(n_clicks, admin_password, usage, fuel, notes, edit_data)
             SET usage = ?, fuel = ?, notes = ?
             WHERE id = ?
         ''', (float(usage), float(fuel), notes or '', refuel_id))
+        stamp_refuel_metrics(cursor, [refuel_id])
         
-        log_audit(cursor, user_data['id'], user_data['username'], 'update', 'refuels', refuel_id,
-                 f"Updated refuel entry - Usage: {usage}hrs, Fuel: {fuel}L")
+        cursor.execute('SELECT timestamp FROM refuels WHERE id = ?', (refuel_id,))
+        refuel = cursor.fetchone()
+        if refuel:
+            refresh_rollup(cursor, [refuel['timestamp']])
         
+        bump_data_version(cursor, 'refuels')
+        version = get_data_versions(conn)['refuels']
         conn.commit()
+        notify_change()
         conn.close()
-        
-        # Return updated table and clear selection
-        return False, '', '', render_refueling_table('all'), []
+        record_audit(user_data['id'], user_data['username'], 'update', 'refuels', refuel_id,
+                     f"Updated refuel entry - Usage: {usage}hrs, Fuel: {fuel}L")
+        
+        # Replace just the edited row while it is still where the modal found it
+        row = edit_data.get('row')
+        state = None
+        if row is not None and selected_rows == [row] and refuel_view_is_current(table_state, version):
+            state = patch_refueling_table(table_state, version, refuel_id, index=row)
+        if state is None:
+            return False, '', '', *reload_refueling_view(table_state)
+        return False, '', '', dash.no_update, state
     except Exception as e:
         return True, create_notification(f"❌ Error: {str(e)}", "danger"), '', dash.no_update, dash.no_update
 
@@ -2937,7 +3475,6 @@ def cancel_edit_refuel(n_clicks):
 
 # ==================== RUN APPLICATION ====================
 if __name__ == '__main__':
-    init_db()
     print("=" * 60)
     print("J-INVESTMENTS FLEET MANAGEMENT SYSTEM")
     print("Dash Framework")
@@ -2951,4 +3488,6 @@ if __name__ == '__main__':
     print("Default login: admin / admin123")
     print("⚠️  CHANGE DEFAULT PASSWORD IMMEDIATELY!")
     print("=" * 60)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler()  # serving process only, not the reloader
     app.run(debug=True, host='0.0.0.0', port=8050)
@@ -0,0 +1,77 @@
+/*
+ * Live data updates for J-INVESTMENTS Fleet Management.
+ *
+ * Subscribes to /events (server-sent events) and pushes each data-version
+ * snapshot into the live-versions store; the apply_versions clientside
+ * callback then updates only the version-<scope> stores that changed.
+ * While the stream is open the polling interval is disabled; if it drops,
+ * polling resumes until EventSource reconnects. A refused stream (503: the
+ * worker's stream slots are full) is retried after STREAM_RETRY_MS.
+ */
+(function () {
+    'use strict';
+
+    window.dash_clientside = window.dash_clientside || {};
+    window.dash_clientside.events = {
+        apply_versions: function (live) {
+            var known = Array.prototype.slice.call(arguments, 1);
+            var changed = false;
+            var updates = live.versions.map(function (pair, i) {
+                if (pair[1] !== known[i]) {
+                    changed = true;
+                    return pair[1];
+                }
+                return window.dash_clientside.no_update;
+            });
+            if (!changed) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            return updates;
+        }
+    };
+
+    var source = null;
+    var STREAM_RETRY_MS = 60000;
+    var retryAt = 0;
+
+    function setProps(id, props) {
+        if (window.dash_clientside.set_props) {
+            try {
+                window.dash_clientside.set_props(id, props);
+            } catch (e) {
+                /* component not in the current layout (e.g. login page) */
+            }
+        }
+    }
+
+    function connect() {
+        if (source || !window.EventSource || !document.getElementById('main-tabs') || Date.now() < retryAt) {
+            return;
+        }
+        source = new EventSource('/events');
+        source.onopen = function () {
+            setProps('refresh-interval', {disabled: true});
+        };
+        source.addEventListener('versions', function (event) {
+            setProps('live-versions', {data: JSON.parse(event.data)});
+        });
+        source.onerror = function () {
+            setProps('refresh-interval', {disabled: false});
+            if (source.readyState === EventSource.CLOSED || !document.getElementById('main-tabs')) {
+                // Refused (or logged out): keep polling, try streaming again later
+                source.close();
+                source = null;
+                retryAt = Date.now() + STREAM_RETRY_MS;
+            }
+        };
+    }
+
+    // The main layout is rendered after login by a callback, so watch for it
+    setInterval(function () {
+        if (!document.getElementById('main-tabs') && source) {
+            source.close();
+            source = null;
+        }
+        connect();
+    }, 2000);
+})();
@@ -0,0 +1,187 @@
+"""
+Asynchronous audit trail for J-INVESTMENTS Fleet Management
+
+Routine events (logins, creates, updates, imports) are queued in memory by
+record_audit() after the caller's own commit and written by one background
+thread per process in executemany batches, so they never hold the caller's
+write lock. Each event carries the time it happened, not the time it was
+written.
+
+Durability:
+- the queue is bounded; when it is full callers wait up to
+  AUDIT_ENQUEUE_TIMEOUT_SECONDS and then write the event themselves, so
+  events are slowed down rather than dropped;
+- rows the database refuses (e.g. locked past its busy timeout) are
+  appended to AUDIT_SPILL_FILE at once, without stalling the writer, and
+  replayed (by any worker) before the next batch is written; only if that
+  file cannot be written either are events lost, with a message saying so;
+- the queue is flushed at interpreter exit and from gunicorn's worker_exit
+  hook (see gunicorn.conf.py);
+- security-critical events (deletes, user and permission changes, restores,
+  full-database downloads) still use database.log_audit() inside the
+  caller's transaction, so they commit or roll back with the change itself.
+"""
+
+import os
+import json
+import fcntl
+import queue
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+from config import (AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_SECONDS,
+                    AUDIT_ENQUEUE_TIMEOUT_SECONDS, AUDIT_SHUTDOWN_TIMEOUT_SECONDS, AUDIT_SPILL_FILE)
+from database import get_db, bump_data_version
+
+INSERT_AUDIT = '''
+    INSERT INTO audit_log (timestamp, user_id, username, action, entity_type, entity_id, details)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+def audit_timestamp():
+    """Now, in the format of SQLite's CURRENT_TIMESTAMP (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def write_audit_rows(rows):
+    """Insert audit rows in one transaction"""
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(INSERT_AUDIT, rows)
+        bump_data_version(cursor, 'audit')
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# ==================== SPILL FILE ====================
+def spill_audit_rows(rows, path=AUDIT_SPILL_FILE):
+    """Append rows that could not be written to the spill file (one JSON list per line)"""
+    with open(path, 'a', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(''.join(json.dumps(list(row)) + '\n' for row in rows))
+        f.flush()
+        os.fsync(f.fileno())
+
+def replay_spilled_audit(path=AUDIT_SPILL_FILE):
+    """Write spilled rows to the database, then empty the file; returns the number written.
+
+    Raises (keeping the file) if the database still refuses them.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r+', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        rows = []
+        for line in f:
+            try:
+                rows.append(tuple(json.loads(line)))
+            except ValueError:
+                print(f"⚠️ Audit spill: skipped unreadable line {line[:80]!r}")
+        if rows:
+            write_audit_rows(rows)
+        f.truncate(0)
+    return len(rows)
+
+def write_or_spill(rows):
+    """Write rows after any spilled ones; spill them instead if the database refuses"""
+    try:
+        replay_spilled_audit()
+        write_audit_rows(rows)
+    except Exception as e:
+        try:
+            spill_audit_rows(rows)
+            print(f"⚠️ Audit writer: {e}; {len(rows)} events spilled to {AUDIT_SPILL_FILE}")
+        except OSError as spill_error:
+            print(f"⚠️ Audit writer: {e}; {len(rows)} events lost ({spill_error})")
+
+class AuditWriter:
+    """Bounded in-memory queue of audit rows drained by a background thread"""
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the writer thread once per process (gunicorn forks workers)"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, row):
+        """Queue one audit row; writes it directly if the queue stays full"""
+        self._ensure_started()
+        try:
+            self._queue.put(row, timeout=AUDIT_ENQUEUE_TIMEOUT_SECONDS)
+        except queue.Full:
+            write_or_spill([row])
+
+    def flush(self, timeout=AUDIT_SHUTDOWN_TIMEOUT_SECONDS):
+        """Wait until everything queued so far is written; False on timeout"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def pending(self):
+        """Rows waiting to be written"""
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def _run(self):
+        """Writer thread: batch rows until the batch is full or a flush interval passes"""
+        while True:
+            batch, waiters = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + AUDIT_FLUSH_SECONDS
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    # A flush request writes what is queued now instead of waiting
+                    deadline = 0
+                else:
+                    batch.append(item)
+                if len(batch) >= AUDIT_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                write_or_spill(batch)
+            elif waiters:
+                # Nothing new, but a flush still retries what was spilled
+                try:
+                    replay_spilled_audit()
+                except Exception as e:
+                    print(f"⚠️ Audit writer: spilled events not replayed yet ({e})")
+            for waiter in waiters:
+                waiter.set()
+
+audit_writer = AuditWriter()
+
+def record_audit(user_id, username, action, entity_type=None, entity_id=None, details=None):
+    """Queue an audit event; call after committing the change it describes"""
+    audit_writer.submit((audit_timestamp(), user_id, username, action, entity_type, entity_id, details))
+
+def flush_audit(timeout=AUDIT_SHUTDOWN_TIMEOUT_SECONDS):
+    """Write all queued audit events before returning"""
+    return audit_writer.flush(timeout)
+
+atexit.register(flush_audit)
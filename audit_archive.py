@@ -0,0 +1,228 @@
+"""
+Audit log retention for J-INVESTMENTS Fleet Management
+
+Audit rows older than AUDIT_RETENTION_DAYS leave the live audit_log table
+and go to one gzip NDJSON file per calendar month in AUDIT_ARCHIVE_DIR
+(one JSON array per row, columns as in AUDIT_COLUMNS). Each run appends a
+new gzip member to the month's file; readers see the members as one
+stream.
+
+The audit_archives table records every file's committed size, and the
+rows are deleted from audit_log in the same transaction that records it.
+A run that dies between writing and committing leaves bytes past the
+recorded size; the next run truncates them before appending, so nothing
+is archived twice or lost. A run holds an exclusive flock on
+AUDIT_ARCHIVE_DIR/.lock throughout, so the scheduler and a manual run
+never write the same month file at once; the later one waits, then finds
+nothing left to move.
+
+audit_archive_terms is the search index. It holds per-month row counts
+for user_id, username, action and entity_type, so a search opens only the
+months that can match. Entity ids and free text are matched while the
+candidate months are read. A month file is in archiving order, not time
+order, so each month's matches are sorted by (timestamp, id) newest first
+before they are yielded; months themselves are visited newest first, which
+keeps the whole stream in the keyset order the audit pages resume from.
+"""
+
+import io
+import os
+import gzip
+import fcntl
+import json
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+
+from config import AUDIT_RETENTION_DAYS, AUDIT_ARCHIVE_DIR, BACKUP_COMPRESS_LEVEL
+from database import get_db, bump_data_version
+
+AUDIT_COLUMNS = ('id', 'timestamp', 'user_id', 'username', 'action', 'entity_type', 'entity_id', 'details')
+INDEXED_FIELDS = ('user_id', 'username', 'action', 'entity_type')
+
+# ==================== ARCHIVING ====================
+def _month_bounds(month):
+    """'YYYY-MM' -> [start, end) timestamps comparable with audit_log.timestamp"""
+    year, number = map(int, month.split('-'))
+    following = f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+    return f"{month}-01", f"{following}-01"
+
+def archive_path(month):
+    """Archive file of one month"""
+    return os.path.join(AUDIT_ARCHIVE_DIR, f"audit_{month}.ndjson.gz")
+
+def _archive_month(conn, month, cutoff):
+    """Move one month's expired rows into its archive file; returns rows moved"""
+    start, end = _month_bounds(month)
+    end = min(end, cutoff)
+    rows = conn.execute(f'''
+        SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_log
+        WHERE timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp, id
+    ''', (start, end)).fetchall()
+    if not rows:
+        return 0
+
+    archive = conn.execute('SELECT path, size FROM audit_archives WHERE month = ?', (month,)).fetchone()
+    path = archive['path'] if archive else archive_path(month)
+    terms = {}
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        # Drop anything a failed run wrote after the last committed member
+        f.truncate(archive['size'] if archive else 0)
+        f.seek(0, os.SEEK_END)
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=BACKUP_COMPRESS_LEVEL) as member:
+            for row in rows:
+                member.write(json.dumps(list(row), default=str).encode() + b'\n')
+                for field in INDEXED_FIELDS:
+                    if row[field] is not None:
+                        key = (field, str(row[field]))
+                        terms[key] = terms.get(key, 0) + 1
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cursor = conn.cursor()
+        # Rows written after the SELECT have larger ids and wait for the next run
+        cursor.execute('DELETE FROM audit_log WHERE timestamp >= ? AND timestamp < ? AND id <= ?',
+                       (start, end, max(row['id'] for row in rows)))
+        cursor.execute('''
+            INSERT INTO audit_archives (month, path, size, rows, first_timestamp, last_timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(month) DO UPDATE SET
+                size = excluded.size,
+                rows = rows + excluded.rows,
+                first_timestamp = MIN(first_timestamp, excluded.first_timestamp),
+                last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+                updated_at = CURRENT_TIMESTAMP
+        ''', (month, path, size, len(rows), rows[0]['timestamp'], rows[-1]['timestamp']))
+        cursor.executemany('''
+            INSERT INTO audit_archive_terms (field, value, month, rows) VALUES (?, ?, ?, ?)
+            ON CONFLICT(field, value, month) DO UPDATE SET rows = rows + excluded.rows
+        ''', [(field, value, month, count) for (field, value), count in terms.items()])
+        bump_data_version(cursor, 'audit')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+def archive_audit_log(now=None):
+    """Archive every audit row older than the retention horizon; returns {month: rows}"""
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=AUDIT_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+
+    with open(os.path.join(AUDIT_ARCHIVE_DIR, '.lock'), 'a') as lock:
+        # Month files are truncated and appended in place; one run at a time
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        conn = get_db()
+        try:
+            months = [row[0] for row in conn.execute('''
+                SELECT DISTINCT substr(timestamp, 1, 7) FROM audit_log
+                WHERE timestamp < ? ORDER BY 1
+            ''', (cutoff,))]
+            moved = {month: _archive_month(conn, month, cutoff) for month in months}
+        finally:
+            conn.close()
+        # Directory mtime is the scheduler's record of the last run
+        os.utime(AUDIT_ARCHIVE_DIR)
+    return moved
+
+def last_archive_time():
+    """When archiving last ran (scheduler bookkeeping), or None"""
+    if not os.path.isdir(AUDIT_ARCHIVE_DIR):
+        return None
+    return datetime.fromtimestamp(os.stat(AUDIT_ARCHIVE_DIR).st_mtime)
+
+# ==================== SEARCH ====================
+def list_archives(conn=None):
+    """Archived months, newest first, with row counts and time span"""
+    own = conn is None
+    if own:
+        conn = get_db()
+    rows = conn.execute('''
+        SELECT month, path, size, rows, first_timestamp, last_timestamp
+        FROM audit_archives ORDER BY month DESC
+    ''').fetchall()
+    if own:
+        conn.close()
+    return [dict(row) for row in rows]
+
+def _candidate_months(conn, date_from, date_to, before, terms):
+    """Months whose span overlaps the dates and whose index has every term"""
+    clauses, params = [], []
+    if date_from:
+        clauses.append('last_timestamp >= ?')
+        params.append(date_from)
+    if date_to:
+        clauses.append('first_timestamp < ?')
+        params.append(date_to)
+    if before:
+        clauses.append('first_timestamp <= ?')
+        params.append(before[0])
+    for field, value in terms.items():
+        clauses.append('month IN (SELECT month FROM audit_archive_terms WHERE field = ? AND value = ?)')
+        params += [field, str(value)]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return conn.execute(f'SELECT month, path, size FROM audit_archives {where} ORDER BY month DESC',
+                        params).fetchall()
+
+def read_archive(path, size):
+    """Rows (dicts) of one archive file, oldest first, up to its committed size"""
+    with open(path, 'rb') as f:
+        data = f.read(size)
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as stream:
+        for line in stream:
+            yield dict(zip(AUDIT_COLUMNS, json.loads(line)))
+
+def iter_archived_rows(date_from=None, date_to=None, entity_id=None, text=None, before=None, **terms):
+    """Archived audit rows matching the filters, newest first.
+
+    Keyword terms (user_id, username, action, entity_type) are matched
+    exactly and narrow the months through the index; dates are
+    'YYYY-MM-DD[ HH:MM:SS]' strings, date_to exclusive; text is a
+    case-insensitive substring of the details; before is a (timestamp, id)
+    keyset position to continue after.
+    """
+    unknown = set(terms) - set(INDEXED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown audit search field(s): {', '.join(sorted(unknown))}")
+    terms = {field: value for field, value in terms.items() if value is not None}
+    text = text.lower() if text else None
+    before = tuple(before) if before else None
+
+    conn = get_db()
+    months = _candidate_months(conn, date_from, date_to, before, terms)
+    conn.close()
+
+    for archive in months:
+        matches = []
+        for row in read_archive(archive['path'], archive['size']):
+            if date_from and row['timestamp'] < date_from:
+                continue
+            if date_to and row['timestamp'] >= date_to:
+                continue
+            if before and (row['timestamp'], row['id']) >= before:
+                continue
+            if any(str(row[field]) != str(value) for field, value in terms.items()):
+                continue
+            if entity_id is not None and row['entity_id'] != entity_id:
+                continue
+            if text and text not in (row['details'] or '').lower():
+                continue
+            matches.append(row)
+        # File order is archiving order, not time order: runs append
+        # members as rows age out, and rows restored or written with a
+        # skewed clock land wherever they fell, so sort before yielding
+        matches.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+        yield from matches
+
+def search_archives(limit=1000, **filters):
+    """Up to `limit` (None for all) archived rows; filters as for iter_archived_rows"""
+    return list(islice(iter_archived_rows(**filters), limit))
+
+if __name__ == '__main__':
+    # One-off run, e.g. from cron: python audit_archive.py
+    moved = archive_audit_log()
+    print(f"Archived: {sum(moved.values())} rows in {len(moved)} month(s)")
@@ -0,0 +1,84 @@
+"""
+Streaming backups for J-INVESTMENTS Fleet Management
+
+A backup is gzip-compressed NDJSON, produced table by table from one read
+transaction on a dedicated connection, so it is a consistent snapshot and
+memory stays flat however many refuels there are:
+
+    {"format": "j-investments-backup", "version": 2, ...}    header
+    {"table": "machines", "columns": ["id", "model", ...]}   table start
+    ["EX-001", "CAT 320", ...]                                one line per row
+    ...
+    {"manifest": {"machines": {"rows": 12, "sha256": "..."}, ...}}
+
+Each table's sha256 covers its row lines exactly as written (UTF-8,
+newline-terminated), so a restore can verify every table independently.
+"""
+
+import json
+import hashlib
+import zlib
+from datetime import datetime
+
+from config import BACKUP_CHUNK_ROWS, BACKUP_COMPRESS_LEVEL
+from database import open_connection
+
+BACKUP_FORMAT = 'j-investments-backup'
+BACKUP_VERSION = 2
+BACKUP_TABLES = ('settings', 'machines', 'operators', 'refuels')
+# Tables read (and restored) through their compatibility view, so rows carry
+# the string IDs of what they reference rather than internal integer keys
+BACKUP_SOURCES = {'refuels': 'refuels_compat'}
+# refuels key column -> view column with the referenced string ID
+BACKUP_KEY_COLUMNS = {'machine_key': 'machine_id', 'operator_key': 'operator_id', 'created_by_key': 'created_by'}
+
+def _dumps(value):
+    """Compact JSON line"""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str) + '\n'
+
+def iter_backup_lines(conn, tables=BACKUP_TABLES):
+    """Yield the NDJSON lines of a backup read through conn"""
+    schema_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    yield _dumps({'format': BACKUP_FORMAT, 'version': BACKUP_VERSION,
+                  'timestamp': datetime.now().isoformat(), 'company': 'J-INVESTMENTS',
+                  'schema_version': schema_version, 'tables': list(tables)})
+
+    manifest = {}
+    for table in tables:
+        source = BACKUP_SOURCES.get(table)
+        cursor = conn.execute(f'SELECT * FROM {source}' if source else f'SELECT * FROM {table} ORDER BY rowid')
+        yield _dumps({'table': table, 'columns': [column[0] for column in cursor.description]})
+
+        digest = hashlib.sha256()
+        rows = 0
+        while True:
+            chunk = cursor.fetchmany(BACKUP_CHUNK_ROWS)
+            if not chunk:
+                break
+            lines = ''.join(_dumps(list(row)) for row in chunk)
+            digest.update(lines.encode('utf-8'))
+            rows += len(chunk)
+            yield lines
+        manifest[table] = {'rows': rows, 'sha256': digest.hexdigest()}
+
+    yield _dumps({'manifest': manifest})
+
+def stream_backup():
+    """Yield the gzip-compressed backup in chunks (for a streaming response)"""
+    conn = open_connection()
+    try:
+        # One read transaction: every table comes from the same snapshot
+        conn.execute('BEGIN')
+        compressor = zlib.compressobj(BACKUP_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        for lines in iter_backup_lines(conn):
+            data = compressor.compress(lines.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        conn.rollback()
+        conn.dispose()
+
+def backup_filename():
+    """Download name for a new backup"""
+    return f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
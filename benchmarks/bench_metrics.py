@@ -0,0 +1,66 @@
+"""
+Micro-benchmark: row-wise apply vs the vectorized status labels, on the
+expected fuel / variance / anomaly columns stored with each refuel
+
+    python benchmarks/bench_metrics.py [rows]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import add_status
+
+TOLERANCE = 10
+
+def make_frame(rows):
+    """Synthetic refuel rows with the metric columns stamped as in the database"""
+    rng = np.random.default_rng(42)
+    usage = rng.uniform(1, 12, rows).round(1)
+    rate = rng.choice([8.5, 12.0, 15.5, 22.0], rows)
+    fuel = (usage * rate * rng.normal(1.0, 0.08, rows)).round(1)
+    df = pd.DataFrame({'usage': usage, 'fuel': fuel, 'rate': rate})
+    df['expected_fuel'] = df['usage'] * df['rate']
+    df['variance'] = df['fuel'] - df['expected_fuel']
+    df['variance_pct'] = (df['variance'] / df['expected_fuel'] * 100).round(2)
+    df['anomaly'] = (df['variance_pct'] > TOLERANCE).astype(int)
+    return df
+
+def row_wise(df):
+    """Per-row status labels from the stored columns"""
+    def get_status(row):
+        if row['anomaly']:
+            return f"⚠️ ANOMALY ({row['variance_pct']:+.1f}%)"
+        return f"✅ NORMAL ({row['variance_pct']:+.1f}%)"
+
+    df['status'] = df.apply(get_status, axis=1)
+    return df
+
+def best_of(func, df, repeat=5):
+    """Best wall time (seconds) over several runs on fresh copies"""
+    timings = []
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        func(frame)
+        timings.append(time.perf_counter() - start)
+    return min(timings), frame
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = make_frame(rows)
+
+    old_time, old = best_of(row_wise, df, repeat=3)
+    new_time, new = best_of(add_status, df)
+
+    assert (old['status'] == new['status']).all(), "status labels differ"
+
+    print(f"Rows:       {rows:,}")
+    print(f"Row-wise:   {old_time * 1000:8.1f} ms")
+    print(f"Vectorized: {new_time * 1000:8.1f} ms")
+    print(f"Speed-up:   {old_time / new_time:8.1f}x")
@@ -2,6 +2,8 @@
 Configuration for J-INVESTMENTS Fleet Management
 """
 
+import os
+
 # Color scheme from CAT branding
 COLORS = {
     'cat_yellow': '#FFB400',
@@ -125,3 +127,77 @@ ROLE_PERMISSIONS = {
 }
 
 DATABASE = 'j_investments_fleet.db'
+
+# SQLite connection tuning
+DB_POOL_SIZE = 8               # idle connections kept per worker process
+DB_BUSY_TIMEOUT_MS = 5000      # wait this long for a lock before "database is locked"
+DB_CACHE_SIZE_KB = 16384       # page cache per connection
+DB_STATEMENT_CACHE_SIZE = 256  # prepared statements cached per connection
+
+# Session user cache (per worker process)
+USER_CACHE_TTL_SECONDS = 30
+USER_CACHE_SIZE = 512
+
+# Refueling log pagination (rows per server-side page)
+REFUEL_PAGE_SIZE = 20
+REFUEL_COUNT_CACHE_ENTRIES = 256  # matching-row totals kept per filter and data version
+
+# Site timezone (IANA name) used for "today", day boundaries and displayed times
+SITE_TIMEZONE = os.environ.get('SITE_TIMEZONE', 'UTC')
+
+# Analytics result cache (per worker process)
+ANALYTICS_CACHE_ENTRIES = 64
+ANALYTICS_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Excel export: rows fetched from SQLite per chunk
+EXPORT_CHUNK_ROWS = 5000
+
+# Background jobs (imports): worker threads per process and UI poll interval
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL_MS = 1000
+JOB_PROGRESS_DIR = 'job_progress'  # live row progress of jobs inside a write transaction
+IMPORT_CHUNK_ROWS = 5000           # refuel rows written per progress report
+
+# Backups: rows fetched per chunk and gzip compression level
+BACKUP_CHUNK_ROWS = 5000
+BACKUP_COMPRESS_LEVEL = 6
+
+# Hot snapshots (SQLite online backup API)
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_INTERVAL_HOURS = 6
+SNAPSHOT_RETENTION = 28          # newest snapshots kept
+SNAPSHOT_PAGES_PER_STEP = 256    # pages copied per backup step
+SNAPSHOT_STEP_SLEEP = 0.01       # seconds between steps, lets writers in
+
+# Scheduled maintenance runs in whichever process holds this file lock
+MAINTENANCE_LOCK_FILE = 'maintenance.lock'
+
+# Server-sent change events (/events)
+EVENTS_POLL_SECONDS = 0.5          # cross-worker check of data_versions
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_MAX_STREAM_SECONDS = 300    # clients reconnect after this
+EVENTS_MAX_STREAMS = 8             # per worker; gunicorn threads = DB_POOL_SIZE + this
+
+# Audit trail writer (per worker process)
+AUDIT_QUEUE_SIZE = 10000               # events held in memory before callers wait
+AUDIT_BATCH_SIZE = 500                 # rows per executemany
+AUDIT_FLUSH_SECONDS = 0.5              # longest an event waits for its batch
+AUDIT_ENQUEUE_TIMEOUT_SECONDS = 2.0    # then the caller writes the event itself
+AUDIT_SHUTDOWN_TIMEOUT_SECONDS = 10
+AUDIT_SPILL_FILE = 'audit_spill.jsonl' # rows the database refused, replayed on the next write
+
+# Audit retention: older rows move to monthly gzip archives
+AUDIT_RETENTION_DAYS = 90
+AUDIT_ARCHIVE_DIR = 'audit_archive'
+AUDIT_ARCHIVE_INTERVAL_HOURS = 24
+
+# Audit explorer (Users tab): rows per keyset page
+AUDIT_PAGE_SIZE = 50
+
+# Sessions: cookie signing key file (unless $SECRET_KEY is set) and the
+# server-side store's per-worker front cache
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', 'secret_key')
+SESSION_LIFETIME_DAYS = 7
+SESSION_CACHE_SIZE = 1024
+SESSION_CACHE_TTL_SECONDS = 30       # other workers see revocations within this
+SESSION_PURGE_INTERVAL_HOURS = 6
@@ -2,21 +2,115 @@
 Database operations for J-INVESTMENTS Fleet Management
 """
 
+import os
+import time
+import queue
 import sqlite3
 import hashlib
+import threading
 import uuid
 import json
+from collections import OrderedDict
 from datetime import datetime
-from flask import session
+from flask import session, g, has_request_context
 
-from config import DATABASE, ROLE_PERMISSIONS
+from config import (DATABASE, ROLE_PERMISSIONS, DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS,
+                    DB_CACHE_SIZE_KB, DB_STATEMENT_CACHE_SIZE,
+                    USER_CACHE_TTL_SECONDS, USER_CACHE_SIZE)
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE, check_same_thread=False)
+# ==================== CONNECTION POOL ====================
+# Each thread checks out one connection and reuses it for nested get_db()
+# calls; it goes back to the idle pool when the last caller closes it or
+# when the Flask request tears down.
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+_local = threading.local()
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection whose close() returns it to the pool"""
+
+    def close(self):
+        """Release this checkout; the connection stays open for reuse"""
+        if getattr(_local, 'conn', None) is not self:
+            return
+        _local.depth -= 1
+        if _local.depth <= 0:
+            release_db()
+
+    def dispose(self):
+        """Really close the underlying connection"""
+        super().close()
+
+def _connect():
+    """Open a new tuned connection"""
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, factory=PooledConnection,
+                           cached_statements=DB_STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
+def _checkout():
+    """Take an idle connection from the pool or open a new one"""
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        # Forked worker: never share sqlite handles with the parent
+        _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+def get_db():
+    """Get pooled database connection for the current thread"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        conn = _checkout()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+    _local.depth += 1
+    return conn
+
+def release_db(exc=None):
+    """Return the thread's connection to the pool (Flask teardown hook)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    _local.depth = 0
+    if getattr(_local, 'pid', None) != os.getpid():
+        return
+    try:
+        if conn.in_transaction:
+            conn.rollback()  # discard work left behind by a failed callback
+        _pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.dispose()
+
+def discard_uncommitted(response):
+    """Roll back work a failed callback left open (Flask after_request hook).
+
+    Runs before the session is saved, so the session store never waits
+    behind this thread's write lock; release_db() would discard it anyway.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'pid', None) == os.getpid() and conn.in_transaction:
+        conn.rollback()
+    return response
+
+def open_connection():
+    """Open a dedicated, unpooled connection for long reads (e.g. backups).
+
+    The caller owns it and must call dispose() when finished.
+    """
+    return _connect()
+
 def hash_password(password):
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
@@ -26,31 +120,73 @@ def generate_uuid():
     return str(uuid.uuid4())
 
 def log_audit(cursor, user_id, username, action, entity_type=None, entity_id=None, details=None):
-    """Log audit trail"""
+    """Log audit trail inside the caller's transaction.
+
+    Kept for security-critical events; routine events go through
+    audit.record_audit() after the commit.
+    """
     cursor.execute('''
         INSERT INTO audit_log (user_id, username, action, entity_type, entity_id, details)
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (user_id, username, action, entity_type, entity_id, details))
+    bump_data_version(cursor, 'audit')
+
+# ==================== DATA VERSIONS ====================
+# Writers bump the scopes they change in the same transaction; readers use
+# the counters as cache keys and cheap "anything changed?" tokens.
+DATA_SCOPES = ('refuels', 'machines', 'operators', 'settings', 'users', 'audit')
+
+def bump_data_version(cursor, *scopes):
+    """Increment the change counter of each scope"""
+    cursor.executemany('''
+        INSERT INTO data_versions (scope, version) VALUES (?, 1)
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1
+    ''', [(scope,) for scope in scopes])
+
+def get_data_versions(conn=None):
+    """Current change counter of every scope"""
+    own = conn is None
+    if own:
+        conn = get_db()
+    rows = conn.execute('SELECT scope, version FROM data_versions').fetchall()
+    if own:
+        conn.close()
+    return {row['scope']: row['version'] for row in rows}
+
+# ==================== PERMISSIONS ====================
+# A user's permissions are compiled once into a frozenset of (resource,
+# permission) pairs and cached with the user (see _load_user), so checks
+# are a set lookup instead of a JSON parse.
+def compile_permissions(user_data):
+    """Immutable set of (resource, permission) pairs granted to a user"""
+    grants = None
+    # Custom permissions first
+    if user_data.get('permissions'):
+        try:
+            grants = {resource: list(perms)
+                      for resource, perms in json.loads(user_data['permissions']).items()}
+        except (ValueError, TypeError, AttributeError):
+            grants = None
+    # Fall back to role permissions
+    if grants is None:
+        grants = ROLE_PERMISSIONS.get(user_data.get('role'), {})
+    return frozenset((resource, permission)
+                     for resource, perms in grants.items() for permission in perms)
+
+def user_permissions(user_data):
+    """Compiled permission set of a user, from the cache when available"""
+    capabilities = user_data.get('capabilities')
+    if capabilities is None:
+        capabilities = compile_permissions(user_data)
+    return capabilities
 
 def check_permission(user_data, resource, permission):
     """Check if user has permission for resource"""
     if not user_data:
         return False
-    
-    role = user_data.get('role')
-    if role == 'admin':
+    if user_data.get('role') == 'admin':
         return True
-    
-    # Check custom permissions first
-    if user_data.get('permissions'):
-        try:
-            perms = json.loads(user_data['permissions'])
-            return permission in perms.get(resource, [])
-        except:
-            pass
-    
-    # Fall back to role permissions
-    return permission in ROLE_PERMISSIONS.get(role, {}).get(resource, [])
+    return (resource, permission) in user_permissions(user_data)
 
 def verify_admin_password(password):
     """Verify admin password for delete operations"""
@@ -64,150 +200,63 @@ def verify_admin_password(password):
     conn.close()
     return result['count'] > 0
 
-def get_user_data():
-    """Get current user data from session"""
-    user_id = session.get('user_id')
-    if not user_id:
-        return None
-    
+# ==================== USER CACHE ====================
+# user_id -> (expires_at, user dict or None). Per worker process; writers in
+# this process invalidate explicitly, other workers catch up within the TTL.
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+def _load_user(user_id):
+    """Fetch an active user row, going through the TTL/LRU cache"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry and entry[0] > now:
+            _user_cache.move_to_end(user_id)
+            return entry[1]
+
     conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM users WHERE id = ? AND active = 1', (user_id,))
     user = cursor.fetchone()
     conn.close()
-    
-    return dict(user) if user else None
+    user = dict(user) if user else None
+    if user:
+        user['capabilities'] = compile_permissions(user)
+
+    with _user_cache_lock:
+        _user_cache[user_id] = (now + USER_CACHE_TTL_SECONDS, user)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return user
+
+def invalidate_user_cache(user_id=None):
+    """Drop one cached user (or all of them) after users are written"""
+    with _user_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(user_id, None)
+    if has_request_context():
+        g.pop('user_data_memo', None)
+
+def get_user_data():
+    """Get current user data from session"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+
+    # Memoized for the rest of this request
+    memo = g.get('user_data_memo')
+    if memo is not None and memo[0] == user_id:
+        return memo[1]
+
+    user = _load_user(user_id)
+    g.user_data_memo = (user_id, user)
+    return user
 
 def init_db():
-    """Initialize enterprise database"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            full_name TEXT NOT NULL,
-            email TEXT,
-            role TEXT NOT NULL,
-            permissions TEXT,
-            active INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT,
-            last_login TIMESTAMP
-        )
-    ''')
-    
-    # Machines table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS machines (
-            id TEXT PRIMARY KEY,
-            model TEXT NOT NULL,
-            rate REAL NOT NULL,
-            capacity REAL NOT NULL,
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT,
-            FOREIGN KEY (created_by) REFERENCES users(id)
-        )
-    ''')
-    
-    # Operators table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS operators (
-            id TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            badge TEXT NOT NULL UNIQUE,
-            status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            created_by TEXT,
-            FOREIGN KEY (created_by) REFERENCES users(id)
-        )
-    ''')
-    
-    # Refuels table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS refuels (
-            id TEXT PRIMARY KEY,
-            timestamp BIGINT NOT NULL,
-            machine_id TEXT NOT NULL,
-            operator_id TEXT NOT NULL,
-            usage REAL NOT NULL,
-            fuel REAL NOT NULL,
-            notes TEXT,
-            created_by TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (machine_id) REFERENCES machines(id),
-            FOREIGN KEY (operator_id) REFERENCES operators(id),
-            FOREIGN KEY (created_by) REFERENCES users(id)
-        )
-    ''')
-    
-    # Settings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            id TEXT PRIMARY KEY,
-            tolerance REAL NOT NULL DEFAULT 10,
-            company_name TEXT DEFAULT 'J-INVESTMENTS',
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_by TEXT,
-            FOREIGN KEY (updated_by) REFERENCES users(id)
-        )
-    ''')
-    
-    # Audit log table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS audit_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            user_id TEXT NOT NULL,
-            username TEXT NOT NULL,
-            action TEXT NOT NULL,
-            entity_type TEXT,
-            entity_id TEXT,
-            details TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
-    
-    # Create indices for performance
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_timestamp ON refuels(timestamp)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_machine ON refuels(machine_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_operator ON refuels(operator_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_log(user_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log(timestamp)')
-    
-    # Create default admin user if not exists
-    cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-    if cursor.fetchone()[0] == 0:
-        admin_id = generate_uuid()
-        permissions = json.dumps({
-            'machines': ['read', 'write', 'delete', 'admin'],
-            'operators': ['read', 'write', 'delete', 'admin'],
-            'refuels': ['read', 'write', 'delete', 'admin'],
-            'settings': ['read', 'write', 'admin'],
-            'users': ['read', 'write', 'delete', 'admin'],
-            'reports': ['read', 'write', 'admin']
-        })
-        cursor.execute('''
-            INSERT INTO users (id, username, password_hash, full_name, email, role, permissions)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (admin_id, 'admin', hash_password('admin123'), 'System Administrator', 
-              'admin@j-investments.com', 'admin', permissions))
-        
-        log_audit(cursor, admin_id, 'admin', 'system_initialized', 'system', 'db', 
-                 'Database initialized with default admin account')
-    
-    # Create default settings if not exists
-    cursor.execute("SELECT COUNT(*) FROM settings")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('''
-            INSERT INTO settings (id, tolerance, company_name) 
-            VALUES ('current', 10, 'J-INVESTMENTS')
-        ''')
-    
-    conn.commit()
-    conn.close()
-    print("✓ Database initialized successfully")
+    """Bring the database schema up to date"""
+    from migrations import migrate
+    return migrate()
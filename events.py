@@ -0,0 +1,135 @@
+"""
+Server-sent change events for J-INVESTMENTS Fleet Management
+
+Writers bump the data_versions counters inside their own transaction (see
+database.bump_data_version), so that table is the fan-out channel between
+gunicorn workers. Each worker runs one watcher thread - only while it has
+subscribers - that reads the counters every EVENTS_POLL_SECONDS and
+broadcasts any change to the worker's open /events streams. notify_change()
+wakes the watcher immediately after a local commit.
+
+Every open stream holds one gunicorn thread, so a worker accepts at most
+EVENTS_MAX_STREAMS of them; beyond that /events answers 503 and the
+browser keeps polling on its refresh interval, leaving the remaining
+threads to Dash callbacks.
+"""
+
+import json
+import time
+import queue
+import threading
+
+from config import EVENTS_POLL_SECONDS, EVENTS_KEEPALIVE_SECONDS, EVENTS_MAX_STREAM_SECONDS, EVENTS_MAX_STREAMS
+from database import get_db, get_data_versions, DATA_SCOPES
+
+class Broadcaster:
+    """In-process publish/subscribe of data version snapshots"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher = None
+        self._versions = None
+
+    def subscribe(self):
+        """Register a new stream; returns its queue"""
+        subscriber = queue.Queue(maxsize=16)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._watcher is None or not self._watcher.is_alive():
+                self._watcher = threading.Thread(target=self._watch, name='events', daemon=True)
+                self._watcher.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Drop a stream"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream_count(self):
+        """Streams currently open in this worker"""
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, versions):
+        """Send a versions snapshot to every stream; slow streams drop stale snapshots"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(versions)
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(versions)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def wake(self):
+        """Check the counters now instead of at the next poll"""
+        self._wake.set()
+
+    def read_versions(self):
+        """Current counters, in DATA_SCOPES order"""
+        conn = get_db()
+        try:
+            versions = get_data_versions(conn)
+        finally:
+            conn.close()
+        return [[scope, versions.get(scope, 0)] for scope in DATA_SCOPES]
+
+    def _watch(self):
+        """Watcher thread: publish whenever the counters change; exit when idle"""
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._watcher = None
+                    return
+            try:
+                versions = self.read_versions()
+                if versions != self._versions:
+                    self._versions = versions
+                    self.publish(versions)
+            except Exception as e:
+                print(f"⚠️ Event watcher: {e}")
+            self._wake.wait(EVENTS_POLL_SECONDS)
+            self._wake.clear()
+
+broadcaster = Broadcaster()
+
+def notify_change():
+    """Call after committing a write so this worker's streams update at once"""
+    broadcaster.wake()
+
+def streams_available():
+    """False when this worker already serves EVENTS_MAX_STREAMS streams"""
+    return broadcaster.stream_count() < EVENTS_MAX_STREAMS
+
+def _format(event, data):
+    """One SSE message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_events():
+    """Yield SSE messages for one client until it disconnects or the stream expires.
+
+    Streams are closed after EVENTS_MAX_STREAM_SECONDS; the browser's
+    EventSource reconnects on its own, which spreads clients over workers.
+    """
+    subscriber = broadcaster.subscribe()
+    deadline = time.monotonic() + EVENTS_MAX_STREAM_SECONDS
+    try:
+        yield "retry: 3000\n\n"
+        sent = broadcaster.read_versions()
+        yield _format('versions', {'versions': sent})
+        while time.monotonic() < deadline:
+            try:
+                versions = subscriber.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if versions != sent:
+                sent = versions
+                yield _format('versions', {'versions': versions})
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -0,0 +1,92 @@
+"""
+Streaming Excel export for J-INVESTMENTS Fleet Management
+
+Refuels are read from SQLite in fixed-size chunks and appended to an
+openpyxl write-only workbook backed by a temporary file, so memory use does
+not grow with the length of the exported date range.
+"""
+
+import tempfile
+
+import pandas as pd
+from openpyxl import Workbook
+
+from config import EXPORT_CHUNK_ROWS
+from database import get_db
+from metrics import add_status
+from queries import day_bounds, local_datetimes
+
+DETAIL_COLUMNS = ['Date/Time', 'Machine ID', 'Model', 'Operator', 'Usage (hrs)', 'Fuel (L)',
+                  'Rate (L/hr)', 'Expected (L)', 'Variance (L)', 'Variance (%)', 'Status']
+SUMMARY_COLUMNS = ['Machine ID', 'Model', 'Entries', 'Fuel (L)', 'Expected (L)', 'Variance (L)',
+                   'Anomalies']
+
+EXPORT_DETAIL_SELECT = '''
+    SELECT r.timestamp, m.id AS machine_id, m.model, o.name AS operator,
+           r.usage, r.fuel, m.rate, r.expected_fuel, r.variance, r.variance_pct, r.anomaly
+    FROM refuels r
+    JOIN machines m ON m.key = r.machine_key
+    JOIN operators o ON o.key = r.operator_key
+    WHERE r.timestamp >= ? AND r.timestamp < ?
+    ORDER BY r.timestamp
+'''
+
+def _detail_rows(chunk):
+    """Worksheet rows for one chunk of refuels"""
+    df = pd.DataFrame(chunk, columns=['timestamp', 'machine_id', 'model', 'operator', 'usage', 'fuel',
+                                      'rate', 'expected_fuel', 'variance', 'variance_pct', 'anomaly'])
+    add_status(df)
+    df['timestamp'] = local_datetimes(df['timestamp']).dt.tz_localize(None)
+    df = df[['timestamp', 'machine_id', 'model', 'operator', 'usage', 'fuel', 'rate',
+             'expected_fuel', 'variance', 'variance_pct', 'status']]
+    df = df.astype(object).where(df.notna(), None)
+    return df.itertuples(index=False, name=None)
+
+def write_analytics_workbook(fileobj, date_from, date_to):
+    """Write the detailed log and machine summary for [date_from, date_to] to fileobj"""
+    start, _ = day_bounds(date_from)
+    _, end = day_bounds(date_to)
+
+    wb = Workbook(write_only=True)
+    details = wb.create_sheet('Detailed Logs')
+    summary = wb.create_sheet('Machine Summary')
+    details.append(DETAIL_COLUMNS)
+    summary.append(SUMMARY_COLUMNS)
+
+    conn = get_db()
+    try:
+        cursor = conn.execute(EXPORT_DETAIL_SELECT, (start, end))
+        while True:
+            chunk = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not chunk:
+                break
+            for row in _detail_rows([tuple(r) for r in chunk]):
+                details.append(row)
+
+        # Per-machine totals come straight from the daily rollup
+        cursor = conn.execute('''
+            SELECT ru.machine_id, m.model, SUM(ru.entries), SUM(ru.fuel), SUM(ru.expected_fuel),
+                   SUM(ru.fuel) - SUM(ru.expected_fuel), SUM(ru.anomalies)
+            FROM refuel_daily_rollup ru
+            JOIN machines m ON ru.machine_id = m.id
+            WHERE ru.day >= ? AND ru.day <= ?
+            GROUP BY ru.machine_id
+            ORDER BY ru.machine_id
+        ''', (date_from.isoformat(), date_to.isoformat()))
+        for row in cursor:
+            summary.append(tuple(row))
+    finally:
+        conn.close()
+
+    wb.save(fileobj)
+
+def export_analytics_file(date_from, date_to):
+    """Build the analytics workbook in an anonymous temporary file, rewound for reading"""
+    fileobj = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        write_analytics_workbook(fileobj, date_from, date_to)
+    except Exception:
+        fileobj.close()
+        raise
+    fileobj.seek(0)
+    return fileobj
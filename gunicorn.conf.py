@@ -1,4 +1,24 @@
 bind = "0.0.0.0:10000"
 workers = 2
-threads = 2
+# threads = DB_POOL_SIZE + EVENTS_MAX_STREAMS (config.py): an open browser tab
+# holds one thread for its /events stream, at most EVENTS_MAX_STREAMS per
+# worker (further tabs get 503 and poll), and the remaining threads match the
+# pooled connections of the callbacks. SQLite still has one writer, so more
+# callback threads would only queue on its lock. Raise the three together.
+threads = 16
 timeout = 120
+
+def post_worker_init(worker):
+    """Start the maintenance scheduler (snapshots, audit archiving, session purge).
+
+    Not in the master: it forks every worker, and a child must never inherit a
+    thread mid-way through a SQLite call or holding a lock. Every worker starts
+    the thread; only the one holding the maintenance file lock runs tasks.
+    """
+    from maintenance import start_scheduler
+    start_scheduler()
+
+def worker_exit(server, worker):
+    """Write queued audit events before the worker goes away"""
+    from audit import flush_audit
+    flush_audit()
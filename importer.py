@@ -0,0 +1,251 @@
+"""
+Excel import pipeline for J-INVESTMENTS Fleet Management
+
+Each sheet is parsed once, validated column-wise and resolved against
+pre-loaded lookups; the resulting rows are written with executemany inside
+the caller's transaction. The three stages are separate so callers can
+report progress between them, and write_import also reports after every
+IMPORT_CHUNK_ROWS refuels:
+
+    sheets = read_workbook(data)
+    plan = validate_workbook(sheets, conn)
+    counts, timestamps = write_import(cursor, plan, user_id, progress)
+"""
+
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from audit import record_audit
+from config import IMPORT_CHUNK_ROWS
+from database import get_db, generate_uuid, bump_data_version
+from events import notify_change
+from jobs import update_job, add_job_errors, report_progress
+from metrics import stamp_refuel_metrics
+from queries import SITE_TZ, REFUEL_INSERT
+from rollup import refresh_rollup
+
+IMPORT_SHEETS = ('Operators', 'Assets', 'Refueling')
+
+# Oldest operator wins when names repeat; {} takes the placeholders
+OPERATOR_LOOKUP_SELECT = 'SELECT name, id FROM operators WHERE name IN ({}) ORDER BY rowid'
+OPERATOR_LOOKUP_BATCH = 500
+
+# ==================== PARSING ====================
+def read_workbook(data):
+    """Parse the known sheets of an .xlsx file (bytes) into DataFrames, once each"""
+    xls = pd.ExcelFile(BytesIO(data))
+    return {name: xls.parse(name) for name in IMPORT_SHEETS if name in xls.sheet_names}
+
+def _column(df, name):
+    """A column of the sheet, or an all-missing column if the header is absent"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+def _text(series):
+    """Stripped strings, with missing cells as ''"""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+def _number(series):
+    """Numeric values, NaN where missing; second value flags unparseable cells"""
+    values = pd.to_numeric(series, errors='coerce')
+    return values, series.notna() & values.isna()
+
+def _timestamps(series):
+    """Epoch-ms for a Time column; naive times are taken as site-local"""
+    try:
+        parsed = pd.to_datetime(series, errors='coerce', format='mixed')
+    except ValueError:
+        # pandas 3 raises on mixed offsets where pandas 2 returned objects
+        parsed = pd.Series(dtype=object)
+    if not isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        if parsed.dtype == object:
+            # Mixed offsets: normalise everything to UTC
+            parsed = pd.to_datetime(series, errors='coerce', utc=True, format='mixed')
+        else:
+            parsed = parsed.dt.tz_localize(SITE_TZ, ambiguous='NaT', nonexistent='shift_forward')
+    # Independent of the datetime unit pandas inferred (ns, us, ms or s)
+    epoch_ms = (parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)
+    return epoch_ms.where(parsed.notna()), series.notna() & parsed.isna()
+
+def _row_errors(label, mask, message):
+    """One error string per flagged row, numbered like the sheet index + 1"""
+    return [f"{label} row {idx + 1}: {message(idx)}" for idx in mask[mask].index]
+
+# ==================== VALIDATION ====================
+def _validate_operators(df, existing_badges):
+    """New operator rows (id, name, badge); existing and repeated badges are skipped"""
+    names = _text(_column(df, 'Operator'))
+    badges = _text(_column(df, 'Badge Number'))
+    keep = (names != '') & (badges != '') & ~badges.isin(existing_badges)
+    keep &= ~badges.where(keep).duplicated()
+    rows = pd.DataFrame({'name': names[keep], 'badge': badges[keep]})
+    rows.insert(0, 'id', [generate_uuid() for _ in range(len(rows))])
+    return rows, []
+
+def _validate_machines(df, existing_ids):
+    """New machine rows (id, model, rate, capacity) and row errors"""
+    machine_ids = _text(_column(df, 'Machine ID')).str.upper()
+    models = _text(_column(df, 'Model'))
+    rates, bad_rate = _number(_column(df, 'Rate'))
+    capacities, bad_capacity = _number(_column(df, 'Capacity'))
+
+    errors = _row_errors('Machine', bad_rate, lambda idx: f"invalid rate {df['Rate'][idx]!r}")
+    errors += _row_errors('Machine', bad_capacity & ~bad_rate,
+                          lambda idx: f"invalid capacity {df['Capacity'][idx]!r}")
+
+    capacities = np.trunc(capacities)
+    keep = ((machine_ids != '') & (models != '') & (rates > 0) & (capacities > 0)
+            & ~machine_ids.isin(existing_ids))
+    keep &= ~machine_ids.where(keep).duplicated()
+    rows = pd.DataFrame({'id': machine_ids[keep], 'model': models[keep],
+                         'rate': rates[keep], 'capacity': capacities[keep].astype(int)})
+    return rows, errors
+
+def _validate_refuels(df, machine_ids, operator_ids_by_name):
+    """New refuel rows (id, timestamp, machine_id, operator_id, usage, fuel) and row errors"""
+    timestamps, bad_time = _timestamps(_column(df, 'Time'))
+    machines = _text(_column(df, 'Machine')).str.upper()
+    operators = _text(_column(df, 'Operator'))
+    usage, bad_usage = _number(_column(df, 'Hours worked'))
+    fuel, bad_fuel = _number(_column(df, 'Fuel issued'))
+
+    errors = _row_errors('Refuel', bad_time, lambda idx: f"invalid time {df['Time'][idx]!r}")
+    bad_number = (bad_usage | bad_fuel) & ~bad_time
+    errors += _row_errors('Refuel', bad_number, lambda idx: "invalid hours worked or fuel issued")
+
+    candidate = (timestamps.notna() & (machines != '') & (operators != '')
+                 & (usage > 0) & (fuel > 0))
+    operator_ids = operators.map(operator_ids_by_name)
+    unknown_machine = candidate & ~machines.isin(machine_ids)
+    unknown_operator = candidate & ~unknown_machine & operator_ids.isna()
+    errors += _row_errors('Refuel', unknown_machine,
+                          lambda idx: f"Machine {machines[idx]} not found")
+    errors += _row_errors('Refuel', unknown_operator,
+                          lambda idx: f"Operator {operators[idx]} not found")
+
+    keep = candidate & ~unknown_machine & ~unknown_operator
+    rows = pd.DataFrame({'timestamp': timestamps[keep].astype('int64'),
+                         'machine_id': machines[keep], 'operator_id': operator_ids[keep],
+                         'usage': usage[keep].astype(float), 'fuel': fuel[keep].astype(float)})
+    rows.insert(0, 'id', [generate_uuid() for _ in range(len(rows))])
+    return rows, errors
+
+def validate_workbook(sheets, conn):
+    """Resolve and validate parsed sheets against the database.
+
+    Returns a plan dict with 'operators', 'machines' and 'refuels' DataFrames
+    ready to insert and a list of row 'errors'. References to machines and
+    operators created by the same workbook resolve as well.
+    """
+    existing_badges = {row[0] for row in conn.execute('SELECT badge FROM operators')}
+    existing_machines = {row[0] for row in conn.execute('SELECT id FROM machines')}
+    # Only the operator names the workbook refers to, via idx_operators_name
+    names = []
+    if 'Refueling' in sheets:
+        names = sorted(set(_text(_column(sheets['Refueling'], 'Operator'))) - {''})
+    operator_ids_by_name = {}
+    for start in range(0, len(names), OPERATOR_LOOKUP_BATCH):
+        batch = names[start:start + OPERATOR_LOOKUP_BATCH]
+        placeholders = ', '.join('?' * len(batch))
+        for name, operator_id in conn.execute(OPERATOR_LOOKUP_SELECT.format(placeholders), batch):
+            operator_ids_by_name.setdefault(name, operator_id)
+
+    empty = pd.DataFrame()
+    plan = {'operators': empty, 'machines': empty, 'refuels': empty, 'errors': []}
+
+    if 'Operators' in sheets:
+        plan['operators'], errors = _validate_operators(sheets['Operators'], existing_badges)
+        plan['errors'] += errors
+        for operator_id, name in zip(plan['operators']['id'], plan['operators']['name']):
+            operator_ids_by_name.setdefault(name, operator_id)
+
+    if 'Assets' in sheets:
+        plan['machines'], errors = _validate_machines(sheets['Assets'], existing_machines)
+        plan['errors'] += errors
+        existing_machines.update(plan['machines']['id'])
+
+    if 'Refueling' in sheets:
+        plan['refuels'], errors = _validate_refuels(sheets['Refueling'], existing_machines,
+                                                    operator_ids_by_name)
+        plan['errors'] += errors
+
+    return plan
+
+# ==================== WRITING ====================
+def write_import(cursor, plan, user_id, progress=None):
+    """Insert a validated plan; returns (counts, refuel timestamps).
+
+    progress(rows_written) is called after the operators, the machines and
+    each refuel chunk. Caller commits.
+    """
+    operators, machines, refuels = plan['operators'], plan['machines'], plan['refuels']
+    progress = progress or (lambda written: None)
+
+    if len(operators):
+        cursor.executemany('''
+            INSERT INTO operators (id, name, badge, created_by)
+            VALUES (?, ?, ?, ?)
+        ''', zip(operators['id'], operators['name'], operators['badge'],
+                 [user_id] * len(operators)))
+        progress(len(operators))
+
+    if len(machines):
+        cursor.executemany('''
+            INSERT INTO machines (id, model, rate, capacity, created_by)
+            VALUES (?, ?, ?, ?, ?)
+        ''', zip(machines['id'], machines['model'], machines['rate'].tolist(),
+                 machines['capacity'].tolist(), [user_id] * len(machines)))
+        progress(len(operators) + len(machines))
+
+    timestamps = refuels['timestamp'].tolist() if len(refuels) else []
+    for start in range(0, len(refuels), IMPORT_CHUNK_ROWS):
+        chunk = refuels.iloc[start:start + IMPORT_CHUNK_ROWS]
+        chunk_timestamps = timestamps[start:start + IMPORT_CHUNK_ROWS]
+        cursor.executemany(REFUEL_INSERT, zip(chunk['id'], chunk_timestamps, chunk['machine_id'], chunk['operator_id'],
+                                              chunk['usage'].tolist(), chunk['fuel'].tolist(),
+                                              [''] * len(chunk), [user_id] * len(chunk)))
+        stamp_refuel_metrics(cursor, chunk['id'].tolist())
+        progress(len(operators) + len(machines) + start + len(chunk))
+
+    counts = {'operators': len(operators), 'machines': len(machines), 'refuels': len(refuels)}
+    return counts, timestamps
+
+# ==================== BACKGROUND JOB ====================
+def run_import_job(job_id, data, filename, user_data):
+    """Job function: parse, validate (progress committed) then write in one transaction"""
+    update_job(job_id, phase='parsing')
+    sheets = read_workbook(data)
+    total_rows = sum(len(df) for df in sheets.values())
+
+    update_job(job_id, phase='validating', total_rows=total_rows)
+    conn = get_db()
+    try:
+        plan = validate_workbook(sheets, conn)
+        if plan['errors']:
+            add_job_errors(job_id, plan['errors'])
+        # Rejected rows count as processed; written rows are added chunk by chunk
+        rejected = total_rows - sum(len(plan[table]) for table in ('operators', 'machines', 'refuels'))
+        update_job(job_id, phase='writing', processed_rows=rejected)
+
+        # update_job would commit this transaction; progress goes to the job's file
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+        counts, timestamps = write_import(cursor, plan, user_data['id'],
+                                          lambda written: report_progress(job_id, rejected + written))
+        refresh_rollup(cursor, timestamps)
+        bump_data_version(cursor, 'operators', 'machines', 'refuels')
+        conn.commit()
+        notify_change()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+    update_job(job_id, processed_rows=total_rows)
+    record_audit(user_data['id'], user_data['username'], 'import_excel', 'system', filename,
+                 f"Imported: {counts}")
+    return counts
@@ -0,0 +1,89 @@
+"""
+Index management for J-INVESTMENTS Fleet Management
+
+Secondary indexes are declared here, next to the query shapes they serve.
+A migration that changes them returns create_indexes() as a backfill, so it
+builds the current declarations once the chain is complete; migration
+bodies never call it (see migrations.py). At startup
+verify_query_plans() runs EXPLAIN QUERY PLAN on the hot queries and warns
+when SQLite would not use the intended index, e.g. after a query was
+edited without its index.
+"""
+
+from exports import EXPORT_DETAIL_SELECT
+from importer import OPERATOR_LOOKUP_SELECT
+from queries import REFUEL_COUNT_SELECT, REFUEL_LOG_SELECT, REFUEL_SUMMARY_SELECT
+from rollup import ROLLUP_DAY_INSERT
+
+# ==================== DECLARATIONS ====================
+# name -> (table, columns, partial-index condition or None)
+INDEXES = {
+    # Date-range reads (rollup refresh, summary, log pages) find machine,
+    # operator, usage, fuel and the stored metrics in the index itself
+    'idx_refuels_time_metrics': ('refuels', ('timestamp', 'machine_key', 'operator_key', 'usage', 'fuel',
+                                             'expected_fuel', 'anomaly'), None),
+    # One machine over a range (log filtered by machine)
+    'idx_refuels_machine_metrics': ('refuels', ('machine_key', 'timestamp', 'operator_key', 'usage', 'fuel',
+                                                'expected_fuel', 'anomaly'), None),
+    # One operator over a range (log filtered by operator name)
+    'idx_refuels_operator_time': ('refuels', ('operator_key', 'timestamp'), None),
+    # Anomalies-only log view; holds just the flagged rows
+    'idx_refuels_anomalies': ('refuels', ('timestamp',), 'anomaly = 1'),
+    # Importer resolves operator names
+    'idx_operators_name': ('operators', ('name',), None),
+}
+
+# Indexes replaced by a declared one (single-column prefixes, and the
+# covering indexes from before the stored fuel metrics)
+SUPERSEDED_INDEXES = ('idx_refuels_timestamp', 'idx_refuels_machine', 'idx_refuels_operator',
+                      'idx_refuels_time_cover', 'idx_refuels_machine_time')
+
+def create_indexes(cursor):
+    """Create every declared index and drop superseded ones (idempotent)"""
+    for name, (table, columns, where) in INDEXES.items():
+        condition = f' WHERE {where}' if where else ''
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)}){condition}")
+    for name in SUPERSEDED_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+# ==================== VERIFICATION ====================
+# (label, sql, params, plan fragments that must all appear). Range reads
+# only have to be index-only: with few machines and fresh ANALYZE stats
+# SQLite may rightly prefer a skip-scan of idx_refuels_machine_metrics.
+# The export reads variance columns too, so it only needs a range search.
+INDEX_ONLY_REFUELS = 'SEARCH r USING COVERING INDEX idx_refuels_'
+QUERY_PLAN_CHECKS = [
+    ('daily rollup refresh', ROLLUP_DAY_INSERT, ('2024-01-01', 0, 1), [INDEX_ONLY_REFUELS]),
+    ('refueling summary', f'{REFUEL_SUMMARY_SELECT} WHERE r.timestamp >= ? AND r.timestamp < ?', (0, 1),
+     [INDEX_ONLY_REFUELS]),
+    ('analytics export', EXPORT_DETAIL_SELECT, (0, 1), ['SEARCH r USING INDEX idx_refuels_']),
+    ('refueling count by machine', f'{REFUEL_COUNT_SELECT} WHERE r.timestamp >= ? AND m.id = ?',
+     (0, 'M'), ['USING COVERING INDEX idx_refuels_machine_metrics']),
+    ('refueling anomalies page', f'{REFUEL_LOG_SELECT} WHERE r.anomaly = 1 ORDER BY r.timestamp DESC LIMIT 20',
+     (), ['USING INDEX idx_refuels_anomalies']),
+    ('refueling count by operator', f'{REFUEL_COUNT_SELECT} WHERE r.timestamp >= ? AND o.name = ?',
+     (0, 'N'), ['idx_operators_name', 'idx_refuels_operator_time']),
+    ('operator lookup', OPERATOR_LOOKUP_SELECT.format('?, ?'), ('A', 'B'), ['idx_operators_name']),
+]
+
+def query_plan(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN details of one statement, joined into one string"""
+    return ' | '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+def verify_query_plans(conn):
+    """Check the hot queries' plans; returns [(label, plan)] of the ones that miss their index"""
+    problems = []
+    for label, sql, params, expected in QUERY_PLAN_CHECKS:
+        plan = query_plan(conn, sql, params)
+        if not all(fragment in plan for fragment in expected):
+            problems.append((label, plan))
+    return problems
+
+if __name__ == '__main__':
+    from database import get_db
+    conn = get_db()
+    for label, sql, params, expected in QUERY_PLAN_CHECKS:
+        plan = query_plan(conn, sql, params)
+        mark = '✓' if all(fragment in plan for fragment in expected) else '⚠️'
+        print(f"{mark} {label}: {plan}")
+    conn.close()
@@ -0,0 +1,199 @@
+"""
+Background jobs for J-INVESTMENTS Fleet Management
+
+Long-running work (Excel imports) runs on a small thread pool in the worker
+process instead of inside the request. Job state lives in the jobs table, so
+any gunicorn worker can answer a progress poll; row errors are stored in
+job_errors for download.
+
+A job function takes the job id as its first argument, reports progress
+with update_job() and returns a JSON-serialisable result. update_job()
+commits on the thread's connection, so inside a write transaction a job
+reports rows with report_progress() instead: it writes the count to a file
+in JOB_PROGRESS_DIR, which get_job() reads from any worker.
+
+The owning process holds an flock on that file from submission until the
+job finishes. fail_stale_jobs() (run at startup) fails unfinished jobs
+whose file is missing or unlocked - their process is gone.
+"""
+
+import os
+import json
+import fcntl
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_WORKERS, JOB_PROGRESS_DIR
+from database import get_db, generate_uuid
+
+JOB_FIELDS = {'status', 'phase', 'total_rows', 'processed_rows', 'error_count', 'result', 'message'}
+FINISHED_STATUSES = ('done', 'failed')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_progress_fds = {}
+
+def _get_executor():
+    """Per-process thread pool (recreated after a fork)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+            _executor_pid = os.getpid()
+        return _executor
+
+# ==================== JOB STATE ====================
+def create_job(kind, filename, user_id, job_id=None):
+    """Record a queued job and return its id"""
+    job_id = job_id or generate_uuid()
+    conn = get_db()
+    conn.execute('''
+        INSERT INTO jobs (id, kind, filename, created_by)
+        VALUES (?, ?, ?, ?)
+    ''', (job_id, kind, filename, user_id))
+    conn.commit()
+    conn.close()
+    return job_id
+
+def update_job(job_id, **fields):
+    """Update and commit job fields. Never call inside an open write transaction."""
+    unknown = set(fields) - JOB_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+    if 'result' in fields:
+        fields['result'] = json.dumps(fields['result'])
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    finished = ", finished_at = CURRENT_TIMESTAMP" if fields.get('status') in FINISHED_STATUSES else ''
+
+    conn = get_db()
+    conn.execute(f'''
+        UPDATE jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP{finished}
+        WHERE id = ?
+    ''', list(fields.values()) + [job_id])
+    conn.commit()
+    conn.close()
+
+def add_job_errors(job_id, errors):
+    """Store row errors for a job and update its error count"""
+    conn = get_db()
+    offset = conn.execute('SELECT COUNT(*) FROM job_errors WHERE job_id = ?', (job_id,)).fetchone()[0]
+    conn.executemany('INSERT INTO job_errors (job_id, seq, message) VALUES (?, ?, ?)',
+                     [(job_id, offset + i, message) for i, message in enumerate(errors)])
+    conn.execute('UPDATE jobs SET error_count = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                 (offset + len(errors), job_id))
+    conn.commit()
+    conn.close()
+
+def get_job(job_id):
+    """Job row as a dict (result decoded), or None"""
+    conn = get_db()
+    row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    job = dict(row)
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    if job['status'] == 'running':
+        job['processed_rows'] = max(job['processed_rows'], _read_progress(job_id))
+    return job
+
+def get_job_errors(job_id):
+    """A job's row error messages, in order"""
+    conn = get_db()
+    rows = conn.execute('SELECT message FROM job_errors WHERE job_id = ? ORDER BY seq', (job_id,)).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def can_view_job(job, user_data):
+    """Jobs are visible to their creator and to admins"""
+    return bool(job and user_data and (user_data['role'] == 'admin' or job['created_by'] == user_data['id']))
+
+# ==================== PROGRESS FILES ====================
+def _progress_path(job_id):
+    """Progress file of one job"""
+    return os.path.join(JOB_PROGRESS_DIR, job_id)
+
+def _hold_progress_file(job_id):
+    """Create and lock a job's progress file for the lifetime of the job"""
+    os.makedirs(JOB_PROGRESS_DIR, exist_ok=True)
+    fd = os.open(_progress_path(job_id), os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    _progress_fds[job_id] = fd
+
+def _release_progress_file(job_id):
+    """Remove a finished job's progress file"""
+    fd = _progress_fds.pop(job_id, None)
+    if fd is not None:
+        os.unlink(_progress_path(job_id))
+        os.close(fd)
+
+def report_progress(job_id, processed_rows):
+    """Record processed rows without touching the database (safe inside a transaction)"""
+    fd = _progress_fds.get(job_id)
+    if fd is not None:
+        os.pwrite(fd, f'{processed_rows:>20}\n'.encode(), 0)
+
+def _read_progress(job_id):
+    """Rows last reported with report_progress(), or 0"""
+    try:
+        with open(_progress_path(job_id)) as f:
+            return int(f.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def fail_stale_jobs():
+    """Mark queued or running jobs whose process is gone as failed; returns how many"""
+    conn = get_db()
+    job_ids = [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running')")]
+    stale = []
+    for job_id in job_ids:
+        try:
+            fd = os.open(_progress_path(job_id), os.O_RDWR)
+        except FileNotFoundError:
+            stale.append(job_id)
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            continue  # still owned by a live process
+        finally:
+            os.close(fd)
+        stale.append(job_id)
+        os.unlink(_progress_path(job_id))
+    # A job that finished meanwhile is no longer queued or running and stays as it is
+    conn.executemany('''
+        UPDATE jobs SET status = 'failed', message = 'Interrupted: the server stopped while it ran',
+               updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status IN ('queued', 'running')
+    ''', [(job_id,) for job_id in stale])
+    conn.commit()
+    conn.close()
+    return len(stale)
+
+# ==================== RUNNER ====================
+def _run(job_id, func, args):
+    """Execute a job function, recording its outcome"""
+    try:
+        update_job(job_id, status='running')
+        result = func(job_id, *args)
+        update_job(job_id, status='done', phase=None, result=result)
+    except Exception as e:
+        traceback.print_exc()
+        update_job(job_id, status='failed', message=str(e))
+    finally:
+        _release_progress_file(job_id)
+
+def submit_job(kind, filename, user_id, func, *args):
+    """Create a job and run func(job_id, *args) in the background; returns the job id"""
+    # Lock the progress file before the row exists, so fail_stale_jobs never sees it unowned
+    job_id = generate_uuid()
+    _hold_progress_file(job_id)
+    try:
+        create_job(kind, filename, user_id, job_id)
+    except Exception:
+        _release_progress_file(job_id)
+        raise
+    _get_executor().submit(_run, job_id, func, args)
+    return job_id
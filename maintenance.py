@@ -0,0 +1,124 @@
+"""
+Scheduled maintenance for J-INVESTMENTS Fleet Management
+
+One background thread runs periodic tasks (database snapshots, audit log
+archiving, expired session cleanup). Every gunicorn worker starts the thread
+(`post_worker_init`, see gunicorn.conf.py; `python app.py` starts it in the
+serving process), but tasks only run in the process holding an exclusive
+lock on MAINTENANCE_LOCK_FILE. The others keep trying, so if that worker
+dies another one takes over. `python maintenance.py` (e.g. from cron) takes
+the same lock. Task schedules survive restarts because each task reports
+when it last ran from its own output.
+"""
+
+import os
+import fcntl
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from audit_archive import archive_audit_log, last_archive_time
+from config import (SNAPSHOT_INTERVAL_HOURS, AUDIT_ARCHIVE_INTERVAL_HOURS, SESSION_PURGE_INTERVAL_HOURS,
+                    MAINTENANCE_LOCK_FILE)
+from sessions import session_store
+from snapshots import create_snapshot, last_snapshot_time
+
+CHECK_INTERVAL_SECONDS = 60
+
+def run_snapshot():
+    """Take a scheduled snapshot"""
+    path = create_snapshot()
+    print(f"✓ Snapshot written: {path}")
+
+def run_audit_archive():
+    """Move expired audit rows to the monthly archives"""
+    moved = archive_audit_log()
+    if moved:
+        print(f"✓ Audit archive: {sum(moved.values())} rows in {len(moved)} month(s)")
+
+# Purging is idempotent, so an in-memory record is enough: after a restart
+# it simply runs once more
+_last_session_purge = None
+
+def run_session_purge():
+    """Delete expired server-side sessions"""
+    global _last_session_purge
+    removed = session_store.purge_expired()
+    _last_session_purge = datetime.now()
+    if removed:
+        print(f"✓ Sessions: {removed} expired removed")
+
+def last_session_purge_time():
+    """When expired sessions were last purged by this process, or None"""
+    return _last_session_purge
+
+# (name, interval, task, last_run) - last_run() returns a datetime or None
+MAINTENANCE_TASKS = [
+    ('snapshot', timedelta(hours=SNAPSHOT_INTERVAL_HOURS), run_snapshot, last_snapshot_time),
+    ('audit_archive', timedelta(hours=AUDIT_ARCHIVE_INTERVAL_HOURS), run_audit_archive, last_archive_time),
+    ('session_purge', timedelta(hours=SESSION_PURGE_INTERVAL_HOURS), run_session_purge, last_session_purge_time),
+]
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def run_due_tasks(now=None):
+    """Run every task whose interval has elapsed; returns the names run"""
+    now = now or datetime.now()
+    ran = []
+    for name, interval, task, last_run in MAINTENANCE_TASKS:
+        try:
+            previous = last_run()
+            if previous is not None and now - previous < interval:
+                continue
+            task()
+            ran.append(name)
+        except Exception:
+            print(f"⚠️ Maintenance task '{name}' failed")
+            traceback.print_exc()
+    return ran
+
+def acquire_maintenance_lock(path=MAINTENANCE_LOCK_FILE):
+    """Exclusive, non-blocking lock on the maintenance lock file; returns its fd or None if held elsewhere.
+
+    The lock lasts until the fd is closed or the process exits.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def _loop(stop):
+    """Scheduler thread body: run due tasks while holding the maintenance lock"""
+    lock = None
+    while not stop.is_set():
+        if lock is None:
+            lock = acquire_maintenance_lock()
+        if lock is not None:
+            run_due_tasks()
+        stop.wait(CHECK_INTERVAL_SECONDS)
+    if lock is not None:
+        os.close(lock)
+
+def start_scheduler():
+    """Start the maintenance thread once per process; returns its stop event"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler[0].is_alive():
+            stop = threading.Event()
+            thread = threading.Thread(target=_loop, args=(stop,), name='maintenance', daemon=True)
+            thread.start()
+            _scheduler = (thread, stop)
+        return _scheduler[1]
+
+if __name__ == '__main__':
+    # One-off run, e.g. from cron: python maintenance.py
+    if acquire_maintenance_lock() is None:
+        print("Maintenance is running in another process")
+        raise SystemExit(1)
+    started = time.time()
+    print(f"Ran: {', '.join(run_due_tasks()) or 'nothing due'} ({time.time() - started:.1f}s)")
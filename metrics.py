@@ -0,0 +1,73 @@
+"""
+Fuel metrics for J-INVESTMENTS Fleet Management
+
+Expected fuel (usage * machine rate), variance, variance % and the anomaly
+flag are stored on every refuel row. Writers stamp them in their own
+transaction with stamp_refuel_metrics(); a tolerance change re-flags rows
+with restamp_anomalies(). Readers (refueling log, rollup, exports) select
+the stored values and only format them here.
+"""
+
+import numpy as np
+import pandas as pd
+
+from queries import get_tolerance
+
+ANOMALY_LABEL = "⚠️ ANOMALY"
+NORMAL_LABEL = "✅ NORMAL"
+
+# ==================== STORED METRICS ====================
+# Only over-usage beyond the tolerance (%) is an anomaly
+STAMP_METRICS_UPDATE = '''
+    UPDATE refuels AS r SET
+        expected_fuel = r.usage * m.rate,
+        variance = r.fuel - r.usage * m.rate,
+        variance_pct = ROUND((r.fuel - r.usage * m.rate) * 100.0 / (r.usage * m.rate), 2),
+        anomaly = COALESCE(ROUND((r.fuel - r.usage * m.rate) * 100.0 / (r.usage * m.rate), 2) > ?, 0)
+    FROM machines m
+    WHERE m.key = r.machine_key
+'''
+STAMP_BATCH = 500
+
+def stamp_refuel_metrics(cursor, refuel_ids=None, tolerance=None):
+    """Store expected fuel, variance and anomaly flag on the given refuels (default: all)"""
+    if tolerance is None:
+        tolerance = get_tolerance(cursor.connection)
+    if refuel_ids is None:
+        cursor.execute(STAMP_METRICS_UPDATE, (tolerance,))
+        return
+    refuel_ids = list(refuel_ids)
+    for start in range(0, len(refuel_ids), STAMP_BATCH):
+        batch = refuel_ids[start:start + STAMP_BATCH]
+        cursor.execute(f"{STAMP_METRICS_UPDATE} AND r.id IN ({', '.join('?' * len(batch))})",
+                       [tolerance] + batch)
+
+def restamp_anomalies(cursor, tolerance):
+    """Re-flag every refuel for a new tolerance, writing only rows whose flag flips"""
+    cursor.execute('''
+        UPDATE refuels SET anomaly = 1 - anomaly
+        WHERE anomaly != COALESCE(variance_pct > ?, 0)
+    ''', (tolerance,))
+
+# ==================== DISPLAY ====================
+def add_status(df):
+    """Add the status column from stored variance_pct and anomaly columns, in place"""
+    df['status'] = status_labels(df['variance_pct'], df['anomaly'])
+    return df
+
+def status_labels(variance_pct, anomalies):
+    """Status strings such as '⚠️ ANOMALY (+12.3%)' for arrays of variance % and anomaly flags"""
+    variance_pct = np.asarray(variance_pct, dtype=float)
+    flagged = np.asarray(anomalies, dtype=bool)
+    labels = np.where(flagged, ANOMALY_LABEL, NORMAL_LABEL).astype(object)
+    # Format each distinct magnitude once (variance_pct is rounded, so repeats
+    # are common); the sign comes from signbit so -0.0 still prints as '-0.0'
+    magnitude = np.abs(variance_pct)
+    codes, uniques = pd.factorize(magnitude, use_na_sentinel=False)
+    digits = np.array(['{:.1f}'.format(value) for value in uniques], dtype=object)[codes]
+    signs = np.where(np.signbit(variance_pct), '-', '+').astype(object)
+    return labels + ' (' + signs + digits + '%)'
+
+def efficiency(expected_fuel, fuel):
+    """Expected / actual fuel as a percentage, rounded to one decimal"""
+    return (expected_fuel / fuel * 100).round(1)
@@ -0,0 +1,477 @@
+"""
+Schema migrations for J-INVESTMENTS Fleet Management
+
+The schema version is tracked in PRAGMA user_version. Migrations run once
+at process start (see app.py) or from the command line:
+
+    python migrations.py           # apply pending migrations
+    python migrations.py status    # show current / latest version
+"""
+
+import sys
+import json
+
+from database import get_db, generate_uuid, hash_password, DATA_SCOPES
+from rollup import rebuild_rollup
+from indexes import create_indexes
+from metrics import stamp_refuel_metrics
+
+# ==================== MIGRATIONS ====================
+def _initial_schema(cursor):
+    """Enterprise schema, default admin account and settings"""
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            full_name TEXT NOT NULL,
+            email TEXT,
+            role TEXT NOT NULL,
+            permissions TEXT,
+            active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            last_login TIMESTAMP
+        )
+    ''')
+
+    # Machines table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS machines (
+            id TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            rate REAL NOT NULL,
+            capacity REAL NOT NULL,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Operators table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS operators (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            badge TEXT NOT NULL UNIQUE,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Refuels table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refuels (
+            id TEXT PRIMARY KEY,
+            timestamp BIGINT NOT NULL,
+            machine_id TEXT NOT NULL,
+            operator_id TEXT NOT NULL,
+            usage REAL NOT NULL,
+            fuel REAL NOT NULL,
+            notes TEXT,
+            created_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (machine_id) REFERENCES machines(id),
+            FOREIGN KEY (operator_id) REFERENCES operators(id),
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Settings table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            id TEXT PRIMARY KEY,
+            tolerance REAL NOT NULL DEFAULT 10,
+            company_name TEXT DEFAULT 'J-INVESTMENTS',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_by TEXT,
+            FOREIGN KEY (updated_by) REFERENCES users(id)
+        )
+    ''')
+
+    # Audit log table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            action TEXT NOT NULL,
+            entity_type TEXT,
+            entity_id TEXT,
+            details TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+    # Create indices for performance
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_timestamp ON refuels(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_machine ON refuels(machine_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_operator ON refuels(operator_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_user ON audit_log(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log(timestamp)')
+
+    # Create default admin user if not exists
+    cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
+    if cursor.fetchone()[0] == 0:
+        admin_id = generate_uuid()
+        permissions = json.dumps({
+            'machines': ['read', 'write', 'delete', 'admin'],
+            'operators': ['read', 'write', 'delete', 'admin'],
+            'refuels': ['read', 'write', 'delete', 'admin'],
+            'settings': ['read', 'write', 'admin'],
+            'users': ['read', 'write', 'delete', 'admin'],
+            'reports': ['read', 'write', 'admin']
+        })
+        cursor.execute('''
+            INSERT INTO users (id, username, password_hash, full_name, email, role, permissions)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (admin_id, 'admin', hash_password('admin123'), 'System Administrator',
+              'admin@j-investments.com', 'admin', permissions))
+
+        # Plain insert: data_versions (bumped by log_audit) arrives in migration 3
+        cursor.execute('''
+            INSERT INTO audit_log (user_id, username, action, entity_type, entity_id, details)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (admin_id, 'admin', 'system_initialized', 'system', 'db',
+              'Database initialized with default admin account'))
+
+    # Create default settings if not exists
+    cursor.execute("SELECT COUNT(*) FROM settings")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute('''
+            INSERT INTO settings (id, tolerance, company_name)
+            VALUES ('current', 10, 'J-INVESTMENTS')
+        ''')
+
+def _daily_rollup(cursor):
+    """Per day/machine/operator rollup backing the analytics dashboard"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS refuel_daily_rollup (
+            day TEXT NOT NULL,
+            machine_id TEXT NOT NULL,
+            operator_id TEXT NOT NULL,
+            fuel REAL NOT NULL DEFAULT 0,
+            usage REAL NOT NULL DEFAULT 0,
+            expected_fuel REAL NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0,
+            anomalies INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, machine_id, operator_id)
+        ) WITHOUT ROWID
+    ''')
+    return {rebuild_rollup}
+
+def _data_versions(cursor):
+    """Change counters bumped by writers, used for cache keys and refresh checks"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.executemany('INSERT OR IGNORE INTO data_versions (scope, version) VALUES (?, 0)',
+                       [(scope,) for scope in DATA_SCOPES])
+
+def _jobs(cursor):
+    """Background job state and collected row errors"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            filename TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            phase TEXT,
+            total_rows INTEGER NOT NULL DEFAULT 0,
+            processed_rows INTEGER NOT NULL DEFAULT 0,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            message TEXT,
+            created_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_errors (
+            job_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (job_id, seq),
+            FOREIGN KEY (job_id) REFERENCES jobs(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created_by ON jobs(created_by, created_at)')
+
+def _audit_archives(cursor):
+    """Index of the monthly audit archive files written by audit_archive.py"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_archives (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            first_timestamp TIMESTAMP,
+            last_timestamp TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_archive_terms (
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            month TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (field, value, month),
+            FOREIGN KEY (month) REFERENCES audit_archives(month)
+        ) WITHOUT ROWID
+    ''')
+
+def _audit_explorer_indexes(cursor):
+    """Composite indexes behind the audit explorer's filters and keyset pages"""
+    # The rowid (audit id) rides along in every index, so each one serves
+    # ORDER BY timestamp DESC, id DESC without a sort
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_audit_entity
+        ON audit_log(entity_type, entity_id, timestamp)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_user_time ON audit_log(user_id, timestamp)')
+    # Superseded by idx_audit_user_time (same leading column)
+    cursor.execute('DROP INDEX IF EXISTS idx_audit_user')
+
+def _sessions(cursor):
+    """Server-side sessions (see sessions.py); id is the SHA-256 of the cookie's session id"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id TEXT,
+            data TEXT NOT NULL,
+            expires_at INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)')
+
+def _composite_indexes(cursor):
+    """Composite and covering refuels indexes, replacing the single-column ones"""
+    # Frozen DDL: later index changes go into indexes.py and are applied by
+    # the migration that needs them, returning create_indexes as a backfill
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_refuels_time_cover
+        ON refuels(timestamp, machine_id, operator_id, usage, fuel)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_refuels_machine_time
+        ON refuels(machine_id, timestamp, operator_id, usage, fuel)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_refuels_operator_time ON refuels(operator_id, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_operators_name ON operators(name)')
+    cursor.execute('DROP INDEX IF EXISTS idx_refuels_timestamp')
+    cursor.execute('DROP INDEX IF EXISTS idx_refuels_machine')
+    cursor.execute('DROP INDEX IF EXISTS idx_refuels_operator')
+
+def _stored_fuel_metrics(cursor):
+    """Expected fuel, variance and anomaly flag stored on each refuel (see metrics.py)"""
+    cursor.execute('ALTER TABLE refuels ADD COLUMN expected_fuel REAL')
+    cursor.execute('ALTER TABLE refuels ADD COLUMN variance REAL')
+    cursor.execute('ALTER TABLE refuels ADD COLUMN variance_pct REAL')
+    cursor.execute('ALTER TABLE refuels ADD COLUMN anomaly INTEGER NOT NULL DEFAULT 0')
+    # Stamp before the rollup reads the columns; the covering indexes gain the
+    # new columns (indexes.py), built last on the filled table
+    return (stamp_refuel_metrics, rebuild_rollup, create_indexes)
+
+def _rebuild_with_key(cursor, table, columns_sql, columns):
+    """Rebuild a table with an INTEGER PRIMARY KEY 'key' (its old rowid) and a unique string id"""
+    cursor.execute(f'CREATE TABLE {table}_new (key INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, {columns_sql})')
+    column_list = ', '.join(('id',) + columns)
+    cursor.execute(f'INSERT INTO {table}_new (key, {column_list}) SELECT rowid, {column_list} FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+def _integer_keys(cursor):
+    """Integer surrogate keys for users, machines and operators, referenced by refuels"""
+    # Refuels pointing at a missing machine or operator keep an inactive placeholder
+    cursor.execute('''
+        INSERT INTO machines (id, model, rate, capacity, status)
+        SELECT DISTINCT machine_id, 'Unknown', 0, 0, 'inactive' FROM refuels
+        WHERE machine_id NOT IN (SELECT id FROM machines)
+    ''')
+    placeholders = cursor.rowcount
+    cursor.execute('''
+        INSERT INTO operators (id, name, badge, status)
+        SELECT DISTINCT operator_id, 'Unknown', operator_id, 'inactive' FROM refuels
+        WHERE operator_id NOT IN (SELECT id FROM operators)
+    ''')
+    placeholders += cursor.rowcount
+
+    _rebuild_with_key(cursor, 'users', '''
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        full_name TEXT NOT NULL,
+        email TEXT,
+        role TEXT NOT NULL,
+        permissions TEXT,
+        active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by TEXT,
+        last_login TIMESTAMP
+    ''', ('username', 'password_hash', 'full_name', 'email', 'role', 'permissions', 'active',
+          'created_at', 'created_by', 'last_login'))
+    _rebuild_with_key(cursor, 'machines', '''
+        model TEXT NOT NULL,
+        rate REAL NOT NULL,
+        capacity REAL NOT NULL,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by TEXT,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    ''', ('model', 'rate', 'capacity', 'status', 'created_at', 'created_by'))
+    _rebuild_with_key(cursor, 'operators', '''
+        name TEXT NOT NULL,
+        badge TEXT NOT NULL UNIQUE,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by TEXT,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    ''', ('name', 'badge', 'status', 'created_at', 'created_by'))
+
+    cursor.execute('''
+        CREATE TABLE refuels_new (
+            id TEXT PRIMARY KEY,
+            timestamp BIGINT NOT NULL,
+            machine_key INTEGER NOT NULL,
+            operator_key INTEGER NOT NULL,
+            usage REAL NOT NULL,
+            fuel REAL NOT NULL,
+            notes TEXT,
+            created_by_key INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expected_fuel REAL,
+            variance REAL,
+            variance_pct REAL,
+            anomaly INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (machine_key) REFERENCES machines(key),
+            FOREIGN KEY (operator_key) REFERENCES operators(key),
+            FOREIGN KEY (created_by_key) REFERENCES users(key)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO refuels_new
+            (id, timestamp, machine_key, operator_key, usage, fuel, notes, created_by_key, created_at,
+             expected_fuel, variance, variance_pct, anomaly)
+        SELECT r.id, r.timestamp, m.key, o.key, r.usage, r.fuel, r.notes, u.key, r.created_at,
+               r.expected_fuel, r.variance, r.variance_pct, r.anomaly
+        FROM refuels r
+        JOIN machines m ON m.id = r.machine_id
+        JOIN operators o ON o.id = r.operator_id
+        LEFT JOIN users u ON u.id = r.created_by
+        ORDER BY r.rowid
+    ''')
+    cursor.execute('DROP TABLE refuels')
+    cursor.execute('ALTER TABLE refuels_new RENAME TO refuels')
+
+    # Compatibility view: refuels with the external string IDs, writable
+    # through its trigger (used by backups and restores)
+    cursor.execute('''
+        CREATE VIEW refuels_compat AS
+        SELECT r.id, r.timestamp, m.id AS machine_id, o.id AS operator_id, r.usage, r.fuel, r.notes,
+               u.id AS created_by, r.created_at, r.expected_fuel, r.variance, r.variance_pct, r.anomaly
+        FROM refuels r
+        JOIN machines m ON m.key = r.machine_key
+        JOIN operators o ON o.key = r.operator_key
+        LEFT JOIN users u ON u.key = r.created_by_key
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER refuels_compat_insert INSTEAD OF INSERT ON refuels_compat
+        BEGIN
+            INSERT INTO refuels
+                (id, timestamp, machine_key, operator_key, usage, fuel, notes, created_by_key, created_at,
+                 expected_fuel, variance, variance_pct, anomaly)
+            VALUES (NEW.id, NEW.timestamp,
+                    (SELECT key FROM machines WHERE id = NEW.machine_id),
+                    (SELECT key FROM operators WHERE id = NEW.operator_id),
+                    NEW.usage, NEW.fuel, NEW.notes,
+                    (SELECT key FROM users WHERE id = NEW.created_by),
+                    COALESCE(NEW.created_at, CURRENT_TIMESTAMP),
+                    NEW.expected_fuel, NEW.variance, NEW.variance_pct, COALESCE(NEW.anomaly, 0));
+        END
+    ''')
+    # The rebuilt tables lost their secondary indexes. Refuels that now join
+    # a placeholder become visible, so they need metrics and rollup rows.
+    if placeholders:
+        return (stamp_refuel_metrics, rebuild_rollup, create_indexes)
+    return (create_indexes,)
+
+# Numbered migrations, applied in order. Never edit or renumber a released
+# migration - append a new one instead, and keep migration bodies to fixed
+# DDL. Code that follows the live schema (create_indexes, rebuild_rollup,
+# stamp_refuel_metrics) is returned as a backfill instead: backfills are
+# callables (taking a cursor) that run once, with the current code, after
+# the whole chain has been applied in the same transaction. A backfill
+# requested more than once runs at its last requested position.
+MIGRATIONS = [
+    (1, 'Initial schema', _initial_schema),
+    (2, 'Daily refuel rollup', _daily_rollup),
+    (3, 'Data version counters', _data_versions),
+    (4, 'Background jobs', _jobs),
+    (5, 'Audit archive index', _audit_archives),
+    (6, 'Audit explorer indexes', _audit_explorer_indexes),
+    (7, 'Server-side sessions', _sessions),
+    (8, 'Composite and covering indexes', _composite_indexes),
+    (9, 'Stored fuel metrics', _stored_fuel_metrics),
+    (10, 'Integer keys for refuel references', _integer_keys),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ==================== RUNNER ====================
+def current_version(conn):
+    """Return the schema version stored in the database"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate():
+    """Apply pending migrations and their backfills in one transaction"""
+    conn = get_db()
+    try:
+        if current_version(conn) >= LATEST_VERSION:
+            return LATEST_VERSION
+
+        # Take the write lock first so concurrent workers migrate once
+        conn.execute('BEGIN IMMEDIATE')
+        version = current_version(conn)
+        backfills = []
+        for number, description, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            for backfill in apply(conn.cursor()) or ():
+                if backfill in backfills:
+                    backfills.remove(backfill)
+                backfills.append(backfill)
+            conn.execute(f'PRAGMA user_version = {number}')
+            print(f"✓ Migration {number}: {description}")
+
+        for backfill in backfills:
+            backfill(conn.cursor())
+        conn.commit()
+
+        print("✓ Database initialized successfully")
+        return LATEST_VERSION
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'status':
+        conn = get_db()
+        print(f"Schema version: {current_version(conn)} (latest: {LATEST_VERSION})")
+        conn.close()
+    else:
+        migrate()
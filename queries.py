@@ -0,0 +1,383 @@
+"""
+Read-side queries for J-INVESTMENTS Fleet Management
+"""
+
+import re
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from audit_archive import AUDIT_COLUMNS, search_archives
+from cache import ResultCache
+from config import REFUEL_PAGE_SIZE, REFUEL_COUNT_CACHE_ENTRIES, SITE_TIMEZONE, AUDIT_PAGE_SIZE
+from database import get_db, get_data_versions
+
+SITE_TZ = ZoneInfo(SITE_TIMEZONE)
+
+# ==================== TIME RANGES ====================
+# refuels.timestamp is epoch milliseconds; ranges are computed in the site
+# timezone and passed to SQL as [start, end) bounds so idx_refuels_time_metrics
+# answers them with a range search (see indexes.py).
+def to_epoch_ms(dt):
+    """Epoch milliseconds for an aware datetime"""
+    return int(dt.timestamp() * 1000)
+
+def site_now():
+    """Current time in the site timezone"""
+    return datetime.now(SITE_TZ)
+
+def day_bounds(day):
+    """Epoch-ms [start, end) of a calendar day in the site timezone"""
+    start = datetime.combine(day, time.min, tzinfo=SITE_TZ)
+    end = datetime.combine(day + timedelta(days=1), time.min, tzinfo=SITE_TZ)
+    return to_epoch_ms(start), to_epoch_ms(end)
+
+def local_datetimes(timestamps):
+    """Convert an epoch-ms Series to site-local datetimes"""
+    return pd.to_datetime(timestamps, unit='ms', utc=True).dt.tz_convert(SITE_TZ)
+
+def period_bounds(filter_type):
+    """Epoch-ms [start, end) range for a refueling filter, or (None, None)"""
+    now = site_now()
+    if filter_type == 'today':
+        return day_bounds(now.date())
+    if filter_type == 'week':
+        return to_epoch_ms(now - timedelta(days=7)), None
+    return None, None
+
+# ==================== SETTINGS ====================
+def get_tolerance(conn=None):
+    """Current anomaly tolerance (%)"""
+    own = conn is None
+    if own:
+        conn = get_db()
+    row = conn.execute('SELECT tolerance FROM settings WHERE id = ?', ('current',)).fetchone()
+    if own:
+        conn.close()
+    return row['tolerance'] if row else 10
+
+# ==================== REFUELING LOG ====================
+REFUEL_LOG_SELECT = '''
+    SELECT r.id, r.timestamp, m.id AS machine_id, m.model as machine_model, m.rate,
+           o.name as operator_name, r.usage, r.fuel, r.notes,
+           r.expected_fuel, r.variance, r.variance_pct, r.anomaly
+    FROM refuels r
+    JOIN machines m ON m.key = r.machine_key
+    JOIN operators o ON o.key = r.operator_key
+'''
+
+REFUEL_COUNT_SELECT = '''
+    SELECT COUNT(*) FROM refuels r
+    JOIN machines m ON m.key = r.machine_key
+    JOIN operators o ON o.key = r.operator_key
+'''
+
+# refuels references machines, operators and users by their integer keys;
+# writers pass the string IDs: (id, timestamp, machine_id, operator_id,
+# usage, fuel, notes, created_by)
+REFUEL_INSERT = '''
+    INSERT INTO refuels (id, timestamp, machine_key, operator_key, usage, fuel, notes, created_by_key)
+    VALUES (?, ?, (SELECT key FROM machines WHERE id = ?), (SELECT key FROM operators WHERE id = ?),
+            ?, ?, ?, (SELECT key FROM users WHERE id = ?))
+'''
+
+# DataTable column id -> SQL expression, for custom sort/filter
+REFUEL_SORT_COLUMNS = {
+    'datetime_str': 'r.timestamp',
+    'machine_id': 'm.id',
+    'machine_model': 'm.model',
+    'operator_name': 'o.name',
+    'usage': 'r.usage',
+    'fuel': 'r.fuel',
+    'expected_fuel': 'r.expected_fuel',
+    'variance': 'r.variance',
+}
+REFUEL_TEXT_COLUMNS = {'machine_id', 'machine_model', 'operator_name'}
+
+# {column} <operator> value, as produced by the DataTable filter row
+FILTER_PART = re.compile(
+    r'^\s*\{(?P<column>[^}]+)\}\s*'
+    r'[is]?(?P<operator>>=|<=|!=|<|>|=|eq|ne|lt|le|gt|ge|contains|datestartswith)\s*'
+    r'(?P<value>.*?)\s*$'
+)
+FILTER_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+def _period_where(filter_type):
+    """WHERE fragments and params for a refueling filter"""
+    start, end = period_bounds(filter_type)
+    clauses, params = [], []
+    if filter_type == 'anomalies':
+        # Literal 1 so SQLite can use the partial idx_refuels_anomalies
+        clauses.append('r.anomaly = 1')
+    if start is not None:
+        clauses.append('r.timestamp >= ?')
+        params.append(start)
+    if end is not None:
+        clauses.append('r.timestamp < ?')
+        params.append(end)
+    return clauses, params
+
+def _split_filter_part(part):
+    """Split one DataTable filter expression into (column, operator, value)"""
+    match = FILTER_PART.match(part)
+    if not match:
+        return None, None, None
+    operator = FILTER_OPERATORS.get(match.group('operator'), match.group('operator'))
+    value = match.group('value')
+    if value and value[0] == value[-1] and value[0] in ('"', "'", '`') and len(value) > 1:
+        value = value[1:-1].replace('\\' + value[0], value[0])
+    else:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+    return match.group('column'), operator, value
+
+def parse_filter_query(filter_query):
+    """Translate a DataTable filter_query into SQL clauses and params.
+
+    Only whitelisted columns are accepted; anything else is ignored.
+    """
+    clauses, params = [], []
+    if not filter_query:
+        return clauses, params
+
+    for part in filter_query.split(' && '):
+        column, operator, value = _split_filter_part(part)
+        expr = REFUEL_SORT_COLUMNS.get(column)
+        if expr is None or column == 'datetime_str':
+            continue
+        if operator in ('contains', 'datestartswith'):
+            clauses.append(f'{expr} LIKE ?')
+            params.append(f'%{value}%' if operator == 'contains' else f'{value}%')
+        elif column in REFUEL_TEXT_COLUMNS:
+            clauses.append(f'{expr} {operator} ?')
+            params.append(str(value))
+        elif isinstance(value, float):
+            clauses.append(f'{expr} {operator} ?')
+            params.append(value)
+    return clauses, params
+
+def fetch_refuel_page(filter_type='today', sort_by=None, filter_query=None,
+                      page=0, after=None, conn=None):
+    """Fetch one page of the refueling log.
+
+    Pages sorted by time use keyset pagination on (timestamp, id) when the
+    previous page's last key is given in `after`; other sorts (or jumps to
+    an unvisited page) fall back to OFFSET. The total is counted once per
+    filter and data version (see count_refuels), not on every page.
+    Returns (DataFrame, total matching rows).
+    """
+    clauses, params = _period_where(filter_type)
+    filter_clauses, filter_params = parse_filter_query(filter_query)
+    clauses += filter_clauses
+    params += filter_params
+
+    sort = (sort_by or [{'column_id': 'datetime_str', 'direction': 'desc'}])[0]
+    sort_expr = REFUEL_SORT_COLUMNS.get(sort.get('column_id'), 'r.timestamp')
+    direction = 'ASC' if sort.get('direction') == 'asc' else 'DESC'
+
+    own = conn is None
+    if own:
+        conn = get_db()
+
+    total = count_refuels(clauses, params, conn)
+
+    page_clauses, page_params = list(clauses), list(params)
+    offset = page * REFUEL_PAGE_SIZE
+    if sort_expr == 'r.timestamp' and after:
+        page_clauses.append(f"(r.timestamp, r.id) {'<' if direction == 'DESC' else '>'} (?, ?)")
+        page_params += list(after)
+        offset = 0
+
+    where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ''
+    df = pd.read_sql_query(f'''
+        {REFUEL_LOG_SELECT}
+        {where}
+        ORDER BY {sort_expr} {direction}, r.id {direction}
+        LIMIT ? OFFSET ?
+    ''', conn, params=page_params + [REFUEL_PAGE_SIZE, offset])
+
+    if own:
+        conn.close()
+    return df, total
+
+# Totals keyed by the WHERE clause, its parameters (which carry the period
+# bounds, so "today" rolls over by itself) and the versions of the tables the
+# count reads (settings: a tolerance change restamps r.anomaly); a write bumps
+# a version and old totals age out of the LRU.
+refuel_count_cache = ResultCache(REFUEL_COUNT_CACHE_ENTRIES, 1024 * 1024)
+
+def count_refuels(clauses, params, conn):
+    """Number of refuels matching the WHERE clauses, cached per data version"""
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    versions = get_data_versions(conn)
+    key = (where, tuple(params),
+           tuple(versions.get(scope, 0) for scope in ('refuels', 'machines', 'operators', 'settings')))
+    return refuel_count_cache.get_or_compute(
+        key, lambda: conn.execute(f'{REFUEL_COUNT_SELECT} {where}', params).fetchone()[0])
+
+def fetch_refuel_key(filter_type, position, conn=None):
+    """(timestamp, id) of the row at `position` of the newest-first view, or None"""
+    clauses, params = _period_where(filter_type)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    own = conn is None
+    if own:
+        conn = get_db()
+    row = conn.execute(f'''
+        SELECT r.timestamp, r.id FROM refuels r {where}
+        ORDER BY r.timestamp DESC, r.id DESC LIMIT 1 OFFSET ?
+    ''', params + [position]).fetchone()
+    if own:
+        conn.close()
+    return [row[0], row[1]] if row else None
+
+def fetch_refuel_row(refuel_id, conn=None):
+    """One refueling log row (same columns as a page) as a DataFrame"""
+    own = conn is None
+    if own:
+        conn = get_db()
+    df = pd.read_sql_query(f'{REFUEL_LOG_SELECT} WHERE r.id = ?', conn, params=[refuel_id])
+    if own:
+        conn.close()
+    return df
+
+REFUEL_SUMMARY_SELECT = '''
+    SELECT COUNT(*) AS entries,
+           COALESCE(SUM(r.fuel), 0) AS fuel,
+           COALESCE(SUM(r.usage), 0) AS usage,
+           COALESCE(SUM(r.expected_fuel), 0) AS expected_fuel,
+           COALESCE(SUM(r.anomaly), 0) AS anomalies
+    FROM refuels r
+    JOIN machines m ON m.key = r.machine_key
+    JOIN operators o ON o.key = r.operator_key
+'''
+
+def refuel_summary(filter_type='today', conn=None):
+    """Summary statistics for the refueling log in one aggregate query"""
+    clauses, params = _period_where(filter_type)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    own = conn is None
+    if own:
+        conn = get_db()
+    row = conn.execute(f'{REFUEL_SUMMARY_SELECT} {where}', params).fetchone()
+    if own:
+        conn.close()
+    return dict(row)
+
+# ==================== ANALYTICS ====================
+def analytics_rollup(date_from=None, date_to=None, conn=None):
+    """Daily rollup rows (with machine model and operator name) for a date range"""
+    clauses, params = [], []
+    if date_from:
+        clauses.append('ru.day >= ?')
+        params.append(pd.to_datetime(date_from).date().isoformat())
+    if date_to:
+        clauses.append('ru.day <= ?')
+        params.append(pd.to_datetime(date_to).date().isoformat())
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+
+    own = conn is None
+    if own:
+        conn = get_db()
+    df = pd.read_sql_query(f'''
+        SELECT ru.day, ru.machine_id, m.model, ru.operator_id, o.name AS operator_name,
+               ru.fuel, ru.usage, ru.expected_fuel, ru.entries, ru.anomalies
+        FROM refuel_daily_rollup ru
+        JOIN machines m ON ru.machine_id = m.id
+        JOIN operators o ON ru.operator_id = o.id
+        {where}
+    ''', conn, params=params)
+    if own:
+        conn.close()
+    return df
+
+# ==================== AUDIT LOG ====================
+# Filters are a dict with any of user_id, action, entity_type, entity_id
+# (exact matches) and date_from / date_to (UTC 'YYYY-MM-DD HH:MM:SS' like
+# the stored timestamps, date_to exclusive; see audit_filters). Pages are
+# newest first and continue from the (timestamp, id) of the previous
+# page's last row, so every page is an index range scan on
+# idx_audit_entity, idx_audit_user_time or idx_audit_timestamp however
+# deep the user pages.
+AUDIT_EQUALITY_FILTERS = ('user_id', 'action', 'entity_type', 'entity_id')
+
+def _utc_text(day):
+    """Start of a site-local day as a UTC audit timestamp string"""
+    start = datetime.combine(day, time.min, tzinfo=SITE_TZ)
+    return start.astimezone(ZoneInfo('UTC')).strftime('%Y-%m-%d %H:%M:%S')
+
+def audit_filters(user_id=None, action=None, entity_type=None, entity_id=None,
+                  day_from=None, day_to=None):
+    """Filter dict from explorer inputs; days are site-local and inclusive"""
+    filters = {'user_id': user_id, 'action': action, 'entity_type': entity_type,
+               'entity_id': (entity_id or '').strip() or None}
+    if day_from:
+        filters['date_from'] = _utc_text(pd.to_datetime(day_from).date())
+    if day_to:
+        filters['date_to'] = _utc_text(pd.to_datetime(day_to).date() + timedelta(days=1))
+    return {field: value for field, value in filters.items() if value}
+
+def _audit_where(filters, before=None):
+    """WHERE clause and params for audit filters and a keyset position"""
+    clauses, params = [], []
+    for field in AUDIT_EQUALITY_FILTERS:
+        if filters.get(field):
+            clauses.append(f'{field} = ?')
+            params.append(filters[field])
+    if filters.get('date_from'):
+        clauses.append('timestamp >= ?')
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        clauses.append('timestamp < ?')
+        params.append(filters['date_to'])
+    if before:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params += list(before)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+def _archived_audit_rows(filters, before, limit):
+    """Archived rows for the same filters, continuing after `before`"""
+    return search_archives(date_from=filters.get('date_from'), date_to=filters.get('date_to'),
+                           entity_id=filters.get('entity_id') or None, before=before, limit=limit,
+                           **{field: filters.get(field) or None
+                              for field in ('user_id', 'action', 'entity_type')})
+
+def fetch_audit_page(filters, before=None, limit=AUDIT_PAGE_SIZE, include_archive=False, conn=None):
+    """One page of audit rows (dicts), newest first.
+
+    When the live table runs out and include_archive is set, the page is
+    filled from the monthly archives, which only hold older rows.
+    """
+    where, params = _audit_where(filters, before)
+    own = conn is None
+    if own:
+        conn = get_db()
+    rows = [dict(row) for row in conn.execute(f'''
+        SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_log
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params + [limit])]
+    if own:
+        conn.close()
+
+    if include_archive and len(rows) < limit:
+        after = (rows[-1]['timestamp'], rows[-1]['id']) if rows else before
+        rows += _archived_audit_rows(filters, after, limit - len(rows))
+    return rows
+
+def iter_audit_rows(filters, include_archive=False, chunk_rows=5000):
+    """Every matching audit row, newest first, fetched a keyset chunk at a time"""
+    before = None
+    while True:
+        rows = fetch_audit_page(filters, before, chunk_rows)
+        yield from rows
+        if rows:
+            before = (rows[-1]['timestamp'], rows[-1]['id'])
+        if len(rows) < chunk_rows:
+            break
+    if include_archive:
+        yield from _archived_audit_rows(filters, before, None)
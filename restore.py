@@ -0,0 +1,282 @@
+"""
+Restore from backups for J-INVESTMENTS Fleet Management
+
+Accepts both the legacy JSON backup (one object with a list of records per
+table) and the streaming gzip/NDJSON format written by backup.py. A restore
+is two passes over the file:
+
+1. verify - check the format, columns, required values, references between
+   tables and (NDJSON) the manifest row counts and checksums. A dry run
+   stops here.
+2. load - in one transaction: drop the secondary indexes of the restored
+   tables, replace their rows with executemany batches, recreate the
+   indexes from their saved SQL and rebuild the daily rollup.
+"""
+
+import io
+import gzip
+import json
+import hashlib
+import math
+
+from backup import BACKUP_FORMAT, BACKUP_TABLES, BACKUP_SOURCES, BACKUP_KEY_COLUMNS
+from config import BACKUP_CHUNK_ROWS
+from database import get_db, log_audit, bump_data_version, DATA_SCOPES
+from events import notify_change
+from jobs import update_job, add_job_errors
+from metrics import stamp_refuel_metrics
+from rollup import rebuild_rollup
+
+MAX_REPORTED_ERRORS = 1000
+
+class RestoreError(Exception):
+    """The backup file failed verification"""
+
+# ==================== READING ====================
+def _clean(value):
+    """JSON NaN (written by pandas for missing numbers) becomes NULL"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+def detect_format(data):
+    """'ndjson' (plain or gzip) or 'json' (legacy backup)"""
+    if data[:2] == b'\x1f\x8b':
+        return 'ndjson'
+    first_line = data.split(b'\n', 1)[0]
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        return 'json'
+    return 'ndjson' if isinstance(header, dict) and header.get('format') == BACKUP_FORMAT else 'json'
+
+def _ndjson_events(data):
+    """Events from an NDJSON backup; row batches carry their raw lines for checksums"""
+    stream = gzip.GzipFile(fileobj=io.BytesIO(data)) if data[:2] == b'\x1f\x8b' else io.BytesIO(data)
+
+    def row_batch(lines):
+        # One decode per batch instead of one per line
+        raw = b''.join(lines)
+        return 'rows', (json.loads(b'[' + b','.join(lines) + b']'), raw)
+
+    with stream:
+        header = json.loads(stream.readline())
+        yield 'header', header
+        lines = []
+        for line in stream:
+            if line.startswith(b'['):
+                lines.append(line)
+                if len(lines) >= BACKUP_CHUNK_ROWS:
+                    yield row_batch(lines)
+                    lines = []
+                continue
+            if lines:
+                yield row_batch(lines)
+                lines = []
+            if not line.strip():
+                continue
+            value = json.loads(line)
+            if 'table' in value:
+                yield 'table', (value['table'], value['columns'])
+            elif 'manifest' in value:
+                yield 'manifest', value['manifest']
+        if lines:
+            yield row_batch(lines)
+
+def _json_events(data):
+    """Events from a legacy JSON backup"""
+    backup = json.loads(data)
+    if not isinstance(backup, dict):
+        raise RestoreError("Not a backup file")
+    yield 'header', {key: backup.get(key) for key in ('timestamp', 'version', 'company')}
+    for table in BACKUP_TABLES:
+        records = backup.get(table)
+        if records is None:
+            continue
+        columns = list(dict.fromkeys(column for record in records for column in record))
+        yield 'table', (table, columns)
+        for start in range(0, len(records), BACKUP_CHUNK_ROWS):
+            rows = [[_clean(record.get(column)) for column in columns]
+                    for record in records[start:start + BACKUP_CHUNK_ROWS]]
+            yield 'rows', (rows, None)
+
+def read_backup(data):
+    """Yield ('header' | 'table' | 'rows' | 'manifest', payload) events for a backup file"""
+    if detect_format(data) == 'ndjson':
+        return _ndjson_events(data)
+    return _json_events(data)
+
+# ==================== VERIFY ====================
+def _table_columns(conn, table):
+    """Column names (of its backup source) and required (NOT NULL, no default) columns of a table"""
+    source = BACKUP_SOURCES.get(table, table)
+    columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({source})')]
+    # Views report no constraints: take them from the table, naming its
+    # keys by the view's string ID columns. An INTEGER PRIMARY KEY is
+    # assigned when missing.
+    info = conn.execute(f'PRAGMA table_info({table})').fetchall()
+    required = {BACKUP_KEY_COLUMNS.get(row['name'], row['name']) for row in info
+                if (row['notnull'] or (row['pk'] and row['type'].upper() != 'INTEGER'))
+                and row['dflt_value'] is None}
+    return columns, required
+
+def verify_backup(data, conn):
+    """Check a backup without writing; returns a report dict with counts and errors"""
+    report = {'format': detect_format(data), 'header': None, 'tables': {}, 'errors': []}
+    errors = report['errors']
+
+    def error(message):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(message)
+
+    schema = {table: _table_columns(conn, table) for table in BACKUP_TABLES}
+    keys = {'machines': set(), 'operators': set()}
+    keyless = []
+    manifest = None
+    digests = {}
+    table = None
+
+    try:
+        for kind, payload in read_backup(data):
+            if kind == 'header':
+                report['header'] = payload
+            elif kind == 'table':
+                table, columns = payload
+                if table not in schema:
+                    error(f"Unknown table '{table}'")
+                    table = None
+                    continue
+                known, required = schema[table]
+                for column in set(columns) - set(known):
+                    error(f"{table}: unknown column '{column}'")
+                for column in required - set(columns):
+                    error(f"{table}: required column '{column}' is missing")
+                positions = {column: i for i, column in enumerate(columns)}
+                required_positions = [(column, positions[column]) for column in required if column in positions]
+                check_refs = table == 'refuels' and {'machine_id', 'operator_id'} <= set(positions)
+                if check_refs:
+                    machine_position, operator_position = positions['machine_id'], positions['operator_id']
+                if table in keys and 'key' not in positions:
+                    keyless.append(table)
+                report['tables'][table] = 0
+                digests[table] = hashlib.sha256()
+            elif kind == 'rows' and table:
+                rows, raw = payload
+                if raw is not None:
+                    digests[table].update(raw)
+                for values in rows:
+                    report['tables'][table] += 1
+                    row_number = report['tables'][table]
+                    if len(values) != len(columns):
+                        error(f"{table} row {row_number}: expected {len(columns)} values")
+                        continue
+                    for column, position in required_positions:
+                        if values[position] is None:
+                            error(f"{table} row {row_number}: '{column}' is empty")
+                    if table in keys and 'id' in positions:
+                        keys[table].add(values[positions['id']])
+                    elif check_refs:
+                        # Backups write machines and operators before refuels
+                        if values[machine_position] not in keys['machines']:
+                            error(f"refuels row {row_number}: machine "
+                                  f"'{values[machine_position]}' is not in the backup")
+                        elif values[operator_position] not in keys['operators']:
+                            error(f"refuels row {row_number}: operator "
+                                  f"'{values[operator_position]}' is not in the backup")
+            elif kind == 'manifest':
+                manifest = payload
+    except (ValueError, OSError, EOFError) as e:
+        error(f"Unreadable backup: {e}")
+        return report
+
+    if report['format'] == 'ndjson':
+        if manifest is None:
+            error("Manifest missing: the backup is truncated")
+        else:
+            for name, expected in manifest.items():
+                if report['tables'].get(name) != expected['rows']:
+                    error(f"{name}: {report['tables'].get(name, 0)} rows, manifest says {expected['rows']}")
+                elif name in digests and digests[name].hexdigest() != expected['sha256']:
+                    error(f"{name}: checksum mismatch")
+
+    # Machines and operators from older backups get new integer keys, which
+    # only the refuels restored alongside them would follow
+    if keyless and 'refuels' not in report['tables']:
+        error(f"{', '.join(keyless)}: backups without integer keys must include refuels")
+
+    if not report['tables']:
+        error("No tables found in the backup")
+    return report
+
+# ==================== LOAD ====================
+def _secondary_indexes(cursor, tables):
+    """(name, sql) of the explicit indexes on the given tables"""
+    placeholders = ', '.join('?' * len(tables))
+    return cursor.execute(f'''
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+    ''', list(tables)).fetchall()
+
+def load_backup(cursor, data, tables):
+    """Replace the given tables with the backup's rows. Caller owns the transaction."""
+    indexes = _secondary_indexes(cursor, tables)
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+    # Children first, so nothing points at a deleted parent mid-way
+    for table in sorted(tables, key=lambda name: name != 'refuels'):
+        cursor.execute(f'DELETE FROM {table}')
+
+    counts = {}
+    insert, table = None, None
+    for kind, payload in read_backup(data):
+        if kind == 'table':
+            table, columns = payload
+            column_list = ', '.join(columns)
+            insert = (f"INSERT INTO {BACKUP_SOURCES.get(table, table)} ({column_list}) "
+                      f"VALUES ({', '.join('?' * len(columns))})")
+            counts[table] = 0
+        elif kind == 'rows' and table:
+            rows = payload[0]
+            cursor.executemany(insert, rows)
+            counts[table] += len(rows)
+
+    for _, sql in indexes:
+        cursor.execute(sql)
+    # Older backups lack the stored metrics; restamp with the restored rates and tolerance
+    stamp_refuel_metrics(cursor)
+    rebuild_rollup(cursor)
+    return counts
+
+# ==================== BACKGROUND JOB ====================
+def run_restore_job(job_id, data, filename, dry_run, user_data):
+    """Job function: verify the backup, then (unless dry run) restore it atomically"""
+    update_job(job_id, phase='verifying')
+    conn = get_db()
+    try:
+        report = verify_backup(data, conn)
+        total_rows = sum(report['tables'].values())
+        if report['errors']:
+            add_job_errors(job_id, report['errors'])
+            raise RestoreError(f"Backup failed verification: {report['errors'][0]} "
+                               f"({len(report['errors'])} problems, see the error report)")
+        update_job(job_id, total_rows=total_rows, processed_rows=total_rows if dry_run else 0)
+        if dry_run:
+            return {'dry_run': True, 'tables': report['tables']}
+
+        update_job(job_id, phase='writing')
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+        counts = load_backup(cursor, data, list(report['tables']))
+        log_audit(cursor, user_data['id'], user_data['username'], 'restore_backup', 'system', filename,
+                  f"Restored: {counts}")
+        bump_data_version(cursor, *DATA_SCOPES)
+        conn.commit()
+        notify_change()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return {'dry_run': False, 'tables': counts}
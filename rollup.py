@@ -0,0 +1,52 @@
+"""
+Daily refuel rollup for J-INVESTMENTS Fleet Management
+
+refuel_daily_rollup holds one row per (site-local day, machine, operator)
+with fuel/usage/expected sums and entry/anomaly counts, summed from the
+metrics stored on each refuel (see metrics.py). Writers refresh the
+days they touch inside their own transaction, so the analytics dashboard
+never has to read raw refuels.
+"""
+
+from datetime import datetime, timedelta
+
+from queries import SITE_TZ, day_bounds
+
+def day_of(timestamp):
+    """Site-local calendar day of an epoch-ms timestamp"""
+    return datetime.fromtimestamp(timestamp / 1000, SITE_TZ).date()
+
+ROLLUP_DAY_INSERT = '''
+    INSERT INTO refuel_daily_rollup
+        (day, machine_id, operator_id, fuel, usage, expected_fuel, entries, anomalies)
+    SELECT ?, m.id, o.id,
+           SUM(r.fuel), SUM(r.usage), SUM(r.expected_fuel), COUNT(*), SUM(r.anomaly)
+    FROM refuels r
+    JOIN machines m ON m.key = r.machine_key
+    JOIN operators o ON o.key = r.operator_key
+    WHERE r.timestamp >= ? AND r.timestamp < ?
+    GROUP BY r.machine_key, r.operator_key
+'''
+
+def refresh_rollup_day(cursor, day):
+    """Recompute every rollup row of one day from the raw refuels' stored metrics"""
+    start, end = day_bounds(day)
+    cursor.execute('DELETE FROM refuel_daily_rollup WHERE day = ?', (day.isoformat(),))
+    cursor.execute(ROLLUP_DAY_INSERT, (day.isoformat(), start, end))
+
+def refresh_rollup(cursor, timestamps):
+    """Refresh the rollup for the days containing the given timestamps"""
+    for day in sorted({day_of(ts) for ts in timestamps if ts is not None}):
+        refresh_rollup_day(cursor, day)
+
+def rebuild_rollup(cursor):
+    """Rebuild the whole rollup (after tolerance or rate changes, restores)"""
+    cursor.execute('DELETE FROM refuel_daily_rollup')
+    cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM refuels')
+    first, last = cursor.fetchone()
+    if first is None:
+        return
+    day, last_day = day_of(first), day_of(last)
+    while day <= last_day:
+        refresh_rollup_day(cursor, day)
+        day += timedelta(days=1)
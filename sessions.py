@@ -0,0 +1,286 @@
+"""
+Signing key and server-side sessions for J-INVESTMENTS Fleet Management
+
+Every gunicorn worker must sign cookies with the same key, so the key comes
+from the SECRET_KEY environment variable or from SECRET_KEY_FILE, which the
+first process to start creates atomically.
+
+The session cookie holds only a signed random id. The session data lives in
+a SessionStore (SQLite by default, table `sessions`), keyed by the SHA-256
+of the id so a copied database holds no usable cookies. Each worker keeps
+an LRU front cache of recently used sessions; revoking a user's sessions
+takes effect immediately in the revoking worker and within
+SESSION_CACHE_TTL_SECONDS in the others. Saving an existing session only
+updates its row, so a stale cached copy can never re-create a revoked one.
+
+The SQLite store writes on its own per-thread connection: save_session runs
+before the request's pooled connection is released, and committing there
+would also commit whatever a failed callback left behind.
+"""
+
+import os
+import time
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from config import SECRET_KEY_FILE, SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SECONDS
+from database import open_connection
+
+# ==================== SIGNING KEY ====================
+def load_secret_key(path=SECRET_KEY_FILE):
+    """Shared cookie signing key: $SECRET_KEY, else the key file (created on first use)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    if not os.path.exists(path):
+        # Write a complete key under a private name, then link it into place;
+        # os.link fails if another worker got there first, and nobody ever
+        # sees a half-written file
+        temp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(temp, path)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(temp)
+    with open(path) as f:
+        return f.read().strip()
+
+# ==================== STORES ====================
+def _key(sid):
+    """Storage key of a session id"""
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+class SessionStore:
+    """Where session data lives; subclass to plug in another backend"""
+
+    def load(self, sid):
+        """Session data dict, or None if missing or expired"""
+        raise NotImplementedError
+
+    def create(self, sid, data, user_id, expires_at):
+        """Store a newly issued session"""
+        raise NotImplementedError
+
+    def update(self, sid, data, user_id, expires_at):
+        """Rewrite an existing session; returns False if it is gone (revoked)"""
+        raise NotImplementedError
+
+    def delete(self, sid):
+        """Remove one session"""
+        raise NotImplementedError
+
+    def revoke_user(self, user_id, keep=None):
+        """Remove every session of a user except `keep`; returns the number removed"""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Remove expired sessions; returns the number removed"""
+        raise NotImplementedError
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in the application database, shared by every worker"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _db(self):
+        """This thread's session connection, never the request's pooled one"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = open_connection()
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        row = self._db().execute('SELECT data, expires_at FROM sessions WHERE id = ?', (_key(sid),)).fetchone()
+        if row is None or row['expires_at'] <= time.time():
+            return None
+        return self.serializer.loads(row['data'])
+
+    def create(self, sid, data, user_id, expires_at):
+        with self._db() as conn:
+            conn.execute('INSERT INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)',
+                         (_key(sid), user_id, self.serializer.dumps(dict(data)), int(expires_at)))
+
+    def update(self, sid, data, user_id, expires_at):
+        # Never upsert: a worker holding a cached copy of a revoked session
+        # must not bring its row back
+        with self._db() as conn:
+            cursor = conn.execute('UPDATE sessions SET user_id = ?, data = ?, expires_at = ? WHERE id = ?',
+                                  (user_id, self.serializer.dumps(dict(data)), int(expires_at), _key(sid)))
+        return cursor.rowcount > 0
+
+    def delete(self, sid):
+        with self._db() as conn:
+            conn.execute('DELETE FROM sessions WHERE id = ?', (_key(sid),))
+
+    def revoke_user(self, user_id, keep=None):
+        with self._db() as conn:
+            cursor = conn.execute('DELETE FROM sessions WHERE user_id = ? AND id != ?',
+                                  (user_id, _key(keep) if keep else ''))
+        return cursor.rowcount
+
+    def purge_expired(self):
+        with self._db() as conn:
+            cursor = conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (int(time.time()),))
+        return cursor.rowcount
+
+class CachedSessionStore(SessionStore):
+    """Per-process TTL/LRU cache in front of another store"""
+
+    def __init__(self, store, size=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS):
+        self.store = store
+        self.size = size
+        self.ttl = ttl
+        self._cache = OrderedDict()  # sid -> (cached_until, data or None, user_id)
+        self._lock = threading.Lock()
+
+    def _remember(self, sid, data, user_id):
+        with self._lock:
+            self._cache[sid] = (time.monotonic() + self.ttl, data, user_id)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry and entry[0] > time.monotonic():
+                self._cache.move_to_end(sid)
+                return dict(entry[1]) if entry[1] is not None else None
+        data = self.store.load(sid)
+        self._remember(sid, data, data.get('user_id') if data else None)
+        return dict(data) if data is not None else None
+
+    def create(self, sid, data, user_id, expires_at):
+        self.store.create(sid, data, user_id, expires_at)
+        self._remember(sid, dict(data), user_id)
+
+    def update(self, sid, data, user_id, expires_at):
+        if not self.store.update(sid, data, user_id, expires_at):
+            with self._lock:
+                self._cache.pop(sid, None)
+            return False
+        self._remember(sid, dict(data), user_id)
+        return True
+
+    def delete(self, sid):
+        self.store.delete(sid)
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def revoke_user(self, user_id, keep=None):
+        removed = self.store.revoke_user(user_id, keep)
+        with self._lock:
+            for sid in [sid for sid, entry in self._cache.items() if entry[2] == user_id and sid != keep]:
+                del self._cache[sid]
+        return removed
+
+    def purge_expired(self):
+        return self.store.purge_expired()
+
+session_store = CachedSessionStore(SQLiteSessionStore())
+
+def revoke_user_sessions(user_id, keep=None):
+    """Log a user out everywhere (except the session id `keep`)"""
+    return session_store.revoke_user(user_id, keep)
+
+# ==================== FLASK INTERFACE ====================
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.loaded_user_id = (initial or {}).get('user_id')
+        self.modified = False
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing session data in a SessionStore"""
+
+    salt = 'session-id'
+
+    def __init__(self, store=session_store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            data = self.store.load(sid) if sid else None
+            if data is not None:
+                expires_at = data.pop('_expires_at', None)
+                # The front cache may outlive the session itself
+                if expires_at and expires_at > time.time():
+                    return ServerSession(data, sid=sid, expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+            if session.modified and session.sid:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Sliding expiry without a write per request: extend once half the
+        # lifetime has passed
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or stale):
+            return
+
+        session.expires_at = now + lifetime
+        if session.sid is None or session.get('user_id') != session.loaded_user_id:
+            # New login (or user switch): never keep a pre-login session id
+            if session.sid:
+                self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.loaded_user_id = session.get('user_id')
+            self.store.create(session.sid, {**session, '_expires_at': session.expires_at},
+                              session.get('user_id'), session.expires_at)
+        elif not self.store.update(session.sid, {**session, '_expires_at': session.expires_at},
+                                   session.get('user_id'), session.expires_at):
+            # Revoked in another worker while this one still had it cached
+            session.clear()
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        expires = (datetime.fromtimestamp(session.expires_at, timezone.utc)
+                   if session.permanent else None)
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(), expires=expires,
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
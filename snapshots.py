@@ -0,0 +1,84 @@
+"""
+Hot database snapshots for J-INVESTMENTS Fleet Management
+
+Snapshots are full copies of the live database (every table, including
+users and audit_log) taken with the SQLite online backup API. Pages are
+copied in small steps with a pause in between, so writers are never held
+up for the whole copy; if another connection writes mid-copy SQLite restarts
+the copy, so the finished file is always a consistent point in time. Each
+snapshot is integrity-checked before it replaces its temporary name, and
+only the newest SNAPSHOT_RETENTION files are kept.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+from config import (SNAPSHOT_DIR, SNAPSHOT_RETENTION, SNAPSHOT_PAGES_PER_STEP,
+                    SNAPSHOT_STEP_SLEEP)
+from database import open_connection
+
+SNAPSHOT_PREFIX = 'snapshot_'
+SNAPSHOT_SUFFIX = '.db'
+
+class SnapshotError(Exception):
+    """A snapshot failed its integrity check"""
+
+def create_snapshot():
+    """Copy the live database into a new snapshot file and return its path"""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}{SNAPSHOT_SUFFIX}"
+    path = os.path.join(SNAPSHOT_DIR, name)
+    partial = path + '.partial'
+
+    source = open_connection()
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=SNAPSHOT_PAGES_PER_STEP, sleep=SNAPSHOT_STEP_SLEEP)
+        # Self-contained file: no -wal/-shm companions
+        target.execute('PRAGMA journal_mode=DELETE')
+        result = target.execute('PRAGMA integrity_check').fetchone()[0]
+        if result != 'ok':
+            raise SnapshotError(f"Integrity check failed for {name}: {result}")
+    except Exception:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.dispose()
+    target.close()
+
+    os.replace(partial, path)
+    prune_snapshots()
+    return path
+
+def list_snapshots():
+    """Snapshot files, newest first, as dicts with path, name, size and created"""
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    snapshots = []
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX):
+            path = os.path.join(SNAPSHOT_DIR, name)
+            stat = os.stat(path)
+            snapshots.append({'path': path, 'name': name, 'size': stat.st_size,
+                              'created': datetime.fromtimestamp(stat.st_mtime)})
+    return sorted(snapshots, key=lambda snapshot: snapshot['name'], reverse=True)
+
+def latest_snapshot():
+    """Newest snapshot, or None"""
+    snapshots = list_snapshots()
+    return snapshots[0] if snapshots else None
+
+def prune_snapshots(keep=SNAPSHOT_RETENTION):
+    """Delete all but the newest `keep` snapshots; returns the removed names"""
+    removed = []
+    for snapshot in list_snapshots()[keep:]:
+        os.remove(snapshot['path'])
+        removed.append(snapshot['name'])
+    return removed
+
+def last_snapshot_time():
+    """When the newest snapshot was written (scheduler bookkeeping), or None"""
+    snapshot = latest_snapshot()
+    return snapshot['created'] if snapshot else None
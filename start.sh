@@ -7,6 +7,7 @@ echo ""
 echo "[1/3] Checking dependencies..."
 pip install -r requirements.txt --quiet
 echo "[2/3] Initializing database..."
+python3 migrations.py
 echo "[3/3] Starting application..."
 echo ""
 echo "========================================"
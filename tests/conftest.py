@@ -0,0 +1,62 @@
+"""
+Shared fixtures: the app on a scratch database and a Dash callback client
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported in a scratch directory, so it creates its own database there"""
+    os.chdir(tmp_path_factory.mktemp('app'))
+    sys.path.insert(0, ROOT)
+    import app
+    return app
+
+@pytest.fixture
+def client(app_module):
+    """Flask test client logged in as the default admin"""
+    from database import get_db
+    client = app_module.server.test_client()
+    conn = get_db()
+    admin_id = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()[0]
+    conn.close()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+    return client
+
+def dash_call(app_module, client, callback, values, changed):
+    """Run the callback named `callback` like the browser does.
+
+    values maps 'component-id.property' to the value of each input and
+    state (missing ones are None); changed is the triggering property.
+    Returns (outputs by 'id.property', set_props updates by id).
+    """
+    for key, spec in app_module.app.callback_map.items():
+        if getattr(spec.get('callback'), '__name__', None) == callback:
+            break
+    else:
+        raise KeyError(callback)
+
+    def props(items):
+        return [{'id': item['id'], 'property': item['property'],
+                 'value': values.get(f"{item['id']}.{item['property']}")} for item in items]
+
+    outputs = [{'id': part.rsplit('.', 1)[0], 'property': part.rsplit('.', 1)[1].split('@')[0]}
+               for part in key.strip('.').split('...')]
+    response = client.post('/_dash-update-component', json={
+        'output': key, 'outputs': outputs if key.startswith('..') else outputs[0],
+        'inputs': props(spec['inputs']), 'state': props(spec['state']), 'changedPropIds': [changed],
+    })
+    assert response.status_code in (200, 204), response.data[:500]
+    if response.status_code == 204:
+        return {}, {}
+    body = response.get_json()
+    results = {f'{component}.{prop}': value
+               for component, component_props in body.get('response', {}).items()
+               for prop, value in component_props.items()}
+    return results, body.get('sideUpdate', {})
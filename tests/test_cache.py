@@ -0,0 +1,40 @@
+"""
+ResultCache computes a missing key once even when many callers miss it together.
+"""
+
+import threading
+import time
+
+import pytest
+
+from cache import ResultCache
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [42] * 8 and len(calls) == 1
+    assert cache.get('key') == (True, 42)
+
+def test_failed_compute_is_not_cached():
+    cache = ResultCache()
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('key', fail)
+    assert cache.get_or_compute('key', lambda: 7) == 7
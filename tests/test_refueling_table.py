@@ -0,0 +1,212 @@
+"""
+Refueling log writes patch the table on screen instead of re-rendering it:
+an add prepends the new row, an edit replaces its row, a delete re-reads
+the page so the next row moves up. Paging cursors and the selection follow.
+"""
+
+import copy
+import time
+
+import pytest
+
+from conftest import dash_call
+
+ROWS = 30
+
+def apply_patch(value, patch):
+    """Apply a dash Patch (as sent to the browser) to a plain value"""
+    if not isinstance(patch, dict) or '__dash_patch_update' not in patch:
+        return patch
+    value = copy.deepcopy(value)
+    for op in patch['operations']:
+        *parents, last = op['location'] or [None]
+        target = value
+        for key in parents:
+            target = target[key]
+        if op['operation'] == 'Assign':
+            target[last] = op['params']['value']
+        elif op['operation'] == 'Delete':
+            del target[last]
+        elif op['operation'] == 'Prepend':
+            (target if last is None else target[last]).insert(0, op['params']['value'])
+        else:
+            raise NotImplementedError(op['operation'])
+    return value
+
+@pytest.fixture
+def refuel_ids(app_module):
+    """ROWS refuels one minute apart, newest first"""
+    from database import get_db, bump_data_version
+    from queries import REFUEL_INSERT
+    from metrics import stamp_refuel_metrics
+    from rollup import rebuild_rollup
+
+    conn = get_db()
+    cursor = conn.cursor()
+    admin_id = cursor.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()[0]
+    cursor.execute('DELETE FROM refuels')
+    cursor.execute("INSERT OR IGNORE INTO machines (id, model, rate, capacity) VALUES ('EX-1', 'CAT 320', 10, 400)")
+    cursor.execute("INSERT OR IGNORE INTO operators (id, name, badge) VALUES ('op-1', 'Operator One', 'B1')")
+    now = int(time.time() * 1000)
+    ids = [f'refuel-{i:02d}' for i in range(ROWS)]
+    cursor.executemany(REFUEL_INSERT, [(refuel_id, now - (i + 1) * 60000, 'EX-1', 'op-1', 2.0, 20.0, '', admin_id)
+                                       for i, refuel_id in enumerate(ids)])
+    stamp_refuel_metrics(cursor)
+    rebuild_rollup(cursor)
+    bump_data_version(cursor, 'refuels')
+    conn.commit()
+    conn.close()
+    return ids
+
+def refuel_key(refuel_id):
+    """(timestamp, id) paging key of a refuel"""
+    from database import get_db
+    conn = get_db()
+    timestamp = conn.execute('SELECT timestamp FROM refuels WHERE id = ?', (refuel_id,)).fetchone()[0]
+    conn.close()
+    return [timestamp, refuel_id]
+
+def render_all(app_module, client):
+    """Render the 'All' view; returns (table rows, table state)"""
+    outputs, _ = dash_call(app_module, client, 'update_refueling_table',
+                           {'btn-refuel-all.n_clicks': 1}, 'btn-refuel-all.n_clicks')
+    return find_component(outputs['refueling-table-container.children'], 'refueling-data-table')['data'], \
+        outputs['refuel-table-state.data']
+
+def find_component(tree, component_id):
+    """Props of the component with that id in a serialized layout, or None"""
+    if isinstance(tree, list):
+        return next(filter(None, (find_component(child, component_id) for child in tree)), None)
+    if isinstance(tree, dict) and 'props' in tree:
+        if tree['props'].get('id') == component_id:
+            return tree['props']
+        return find_component(tree['props'].get('children'), component_id)
+    return None
+
+def select(state, data, index):
+    """Table state after the user selected one row"""
+    return {**state, 'selected': [index], 'selected_id': data[index]['id']}
+
+def test_add_prepends_row_and_moves_cursor_and_selection(app_module, client, refuel_ids):
+    from config import REFUEL_PAGE_SIZE
+    data, state = render_all(app_module, client)
+    state = select(state, data, 2)
+
+    outputs, side = dash_call(app_module, client, 'add_refuel', {
+        'btn-add-refuel.n_clicks': 1, 'refuel-machine.value': 'EX-1', 'refuel-operator.value': 'op-1',
+        'refuel-usage.value': 3, 'refuel-fuel.value': 30, 'refuel-table-state.data': state,
+    }, 'btn-add-refuel.n_clicks')
+
+    table = side['refueling-data-table']
+    data = apply_patch(data, table['data'])
+    state = apply_patch(state, outputs['refuel-table-state.data'])
+    assert len(data) == REFUEL_PAGE_SIZE
+    assert [row['id'] for row in data[1:]] == refuel_ids[:REFUEL_PAGE_SIZE - 1]
+    assert table['selected_rows'] == [3] and state['selected'] == [3]
+    assert state['cursors'] == {'0': refuel_key(refuel_ids[REFUEL_PAGE_SIZE - 2])}
+
+    # The row pushed off page 0 opens page 1
+    outputs, _ = dash_call(app_module, client, 'page_refueling_table', {
+        'refueling-data-table.page_current': 1, 'refuel-table-state.data': state,
+    }, 'refueling-data-table.page_current')
+    assert outputs['refueling-data-table.data'][0]['id'] == refuel_ids[REFUEL_PAGE_SIZE - 1]
+
+def test_edit_replaces_row_in_place(app_module, client, refuel_ids):
+    data, state = render_all(app_module, client)
+    state = select(state, data, 4)
+
+    outputs, side = dash_call(app_module, client, 'confirm_edit_refuel', {
+        'confirm-edit-btn.n_clicks': 1, 'edit-admin-password-input.value': 'admin123',
+        'edit-refuel-usage.value': 2, 'edit-refuel-fuel.value': 25, 'edit-refuel-notes.value': 'topped up',
+        'edit-refuel-store.data': {'id': refuel_ids[4], 'row': 4},
+        'refueling-data-table.selected_rows': [4], 'refuel-table-state.data': state,
+    }, 'confirm-edit-btn.n_clicks')
+
+    table = side['refueling-data-table']
+    assert 'selected_rows' not in table
+    data = apply_patch(data, table['data'])
+    assert [row['id'] for row in data] == [row['id'] for row in render_all(app_module, client)[0]]
+    assert data[4]['fuel'] == 25 and data[4]['notes'] == 'topped up'
+    assert 'cursors' not in apply_patch({}, outputs['refuel-table-state.data'])
+
+def test_delete_pulls_next_row_into_page(app_module, client, refuel_ids):
+    from config import REFUEL_PAGE_SIZE
+    data, state = render_all(app_module, client)
+    state = select(state, data, 5)
+
+    _, side = dash_call(app_module, client, 'confirm_delete', {
+        'confirm-delete-btn.n_clicks': 1, 'admin-password-input.value': 'admin123',
+        'delete-confirmation-store.data': {'type': 'refuel', 'id': refuel_ids[5], 'view': state},
+    }, 'confirm-delete-btn.n_clicks')
+
+    table = side['refueling-data-table']
+    remaining = refuel_ids[:5] + refuel_ids[6:]
+    assert [row['id'] for row in table['data']] == remaining[:REFUEL_PAGE_SIZE]
+    assert table['selected_rows'] == [] and 'page_current' not in table
+    state = apply_patch(state, side['refuel-table-state']['data'])
+    assert state['page'] == 0
+    assert state['cursors'] == {'0': refuel_key(remaining[REFUEL_PAGE_SIZE - 1])}
+
+def test_delete_on_later_page_keeps_page_and_selection(app_module, client, refuel_ids):
+    from config import REFUEL_PAGE_SIZE
+    data, state = render_all(app_module, client)
+    outputs, _ = dash_call(app_module, client, 'page_refueling_table', {
+        'refueling-data-table.page_current': 1, 'refuel-table-state.data': state,
+    }, 'refueling-data-table.page_current')
+    data = outputs['refueling-data-table.data']
+    state = select(apply_patch(state, outputs['refuel-table-state.data']), data, 3)
+
+    # Another row on the page goes; the selected one stays selected
+    _, side = dash_call(app_module, client, 'confirm_delete', {
+        'confirm-delete-btn.n_clicks': 1, 'admin-password-input.value': 'admin123',
+        'delete-confirmation-store.data': {'type': 'refuel', 'id': data[0]['id'], 'view': state},
+    }, 'confirm-delete-btn.n_clicks')
+
+    table = side['refueling-data-table']
+    assert [row['id'] for row in table['data']] == refuel_ids[REFUEL_PAGE_SIZE + 1:]
+    assert table['selected_rows'] == [2]
+    state = apply_patch(state, side['refuel-table-state']['data'])
+    assert state['page'] == 1 and state['selected_id'] == data[3]['id']
+    assert state['cursors']['0'] == refuel_key(refuel_ids[REFUEL_PAGE_SIZE - 1])
+
+def test_write_elsewhere_keeps_page_sort_and_selection(app_module, client, refuel_ids):
+    from database import get_db, get_data_versions, bump_data_version
+    data, state = render_all(app_module, client)
+    outputs, _ = dash_call(app_module, client, 'page_refueling_table', {
+        'refueling-data-table.page_current': 1, 'refuel-table-state.data': state,
+    }, 'refueling-data-table.page_current')
+    data = outputs['refueling-data-table.data']
+    state = select(apply_patch(state, outputs['refuel-table-state.data']), data, 4)
+
+    # Another user deletes a row above the selection
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM refuels WHERE id = ?', (data[1]['id'],))
+    bump_data_version(cursor, 'refuels')
+    conn.commit()
+    version = get_data_versions(conn)['refuels']
+    conn.close()
+
+    outputs, side = dash_call(app_module, client, 'update_refueling_table', {
+        'version-refuels.data': version, 'refuel-table-state.data': state,
+    }, 'version-refuels.data')
+
+    assert 'refueling-table-container.children' not in outputs
+    table = side['refueling-data-table']
+    assert [row['id'] for row in table['data']] == [data[0]['id']] + [row['id'] for row in data[2:]]
+    assert 'page_current' not in table
+    assert table['selected_rows'] == [3]
+    state = apply_patch(state, outputs['refuel-table-state.data'])
+    assert state['page'] == 1 and state['version'] == version and state['selected_id'] == data[4]['id']
+
+def test_total_is_counted_once_per_filter_and_version(app_module, client, refuel_ids):
+    from queries import refuel_count_cache
+    data, state = render_all(app_module, client)
+    misses = refuel_count_cache.stats()['misses']
+    for page in (1, 0, 1):
+        outputs, _ = dash_call(app_module, client, 'page_refueling_table', {
+            'refueling-data-table.page_current': page, 'refuel-table-state.data': state,
+        }, 'refueling-data-table.page_current')
+        state = apply_patch(state, outputs['refuel-table-state.data'])
+        assert outputs['refueling-data-table.page_count'] == 2
+    assert refuel_count_cache.stats()['misses'] == misses